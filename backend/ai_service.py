@@ -1,99 +1,331 @@
+import asyncio
+import hashlib
 import os
-import requests
+import re
+import time
+from enum import Enum
+import httpx
 from dotenv import load_dotenv
+import metrics
+from lru import TTLCache
 
 # Load environment variables from .env file
 load_dotenv()
 
 HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN")
 # Use a more accessible model that works with basic API tokens
-API_URL = "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium"
+API_URL = os.getenv("AI_API_URL", "https://api-inference.huggingface.co/models/microsoft/DialoGPT-medium")
 
-def get_ai_response(context: str, question: str) -> str:
+# Upstream client settings
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", "15"))
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "10"))
+# Response cache settings
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "256"))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", "300"))
+# Consecutive failures that open the circuit, and seconds before it is retried
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "5"))
+AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "30"))
+
+MODEL_LOADING_MESSAGE = "Error: The AI model is currently loading and not available. Please try again in a few moments."
+
+AI_REQUESTS = metrics.Counter(
+    "ai_requests_total", "Chatbot answers by how they were produced", labelnames=("result",)
+)
+
+
+class CircuitBreaker:
     """
-    Sends a formatted prompt to the Hugging Face API and returns the response.
-    Falls back to a simple rule-based response if API fails.
+    Opens after `threshold` consecutive failures. While open, calls are
+    refused until `reset_timeout` has passed; then a single trial call is let
+    through, which closes the circuit on success or reopens it on failure.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self.trial_in_flight and self.clock() - self.opened_at >= self.reset_timeout:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.failures >= self.threshold:
+            self.opened_at = self.clock()
+
+
+def cache_key(context: str, question: str):
+    """
+    Questions differing only in case, spacing or trailing punctuation share
+    an entry; the context fingerprint keeps answers tied to the data they
+    were given.
+    """
+    normalized = " ".join(question.lower().split()).rstrip("?!. ")
+    fingerprint = hashlib.blake2b(context.encode("utf-8"), digest_size=16).hexdigest()
+    return normalized, fingerprint
+
+
+class AIClient:
     """
-    if not HUGGINGFACE_API_TOKEN:
-        return get_fallback_response(context, question)
+    Answers questions through the Hugging Face API with one pooled HTTP
+    client, a response cache, a circuit breaker and coalescing of identical
+    in-flight questions.
+    """
+
+    def __init__(self, api_url: str = API_URL, token=HUGGINGFACE_API_TOKEN):
+        self.api_url = api_url
+        self.token = token
+        self.cache = TTLCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+        self.breaker = CircuitBreaker(AI_BREAKER_THRESHOLD, AI_BREAKER_RESET)
+        self._http = None
+        self._loop = None
+        self._inflight = {}
 
-    headers = {"Authorization": f"Bearer {HUGGINGFACE_API_TOKEN}"}
+    def _client(self) -> httpx.AsyncClient:
+        # httpx clients belong to the event loop that created them
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._loop is not loop:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(AI_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(max_connections=AI_MAX_CONNECTIONS, max_keepalive_connections=AI_MAX_CONNECTIONS),
+                headers={"Authorization": f"Bearer {self.token}"},
+            )
+            self._loop = loop
+            self._inflight = {}
+        return self._http
 
-    # Create a simpler prompt for DialoGPT
-    prompt = f"""Context: {context}
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+            self._loop = None
+
+    async def ask(self, context: str, question: str) -> str:
+        if not self.token:
+            AI_REQUESTS.inc(result="fallback")
+            return get_fallback_response(context, question)
+
+        key = cache_key(context, question)
+        answer = self.cache.get(key)
+        if answer is not None:
+            AI_REQUESTS.inc(result="cache_hit")
+            return answer
+
+        client = self._client()
+        task = self._inflight.get(key)
+        if task is not None:
+            AI_REQUESTS.inc(result="coalesced")
+        else:
+            if not self.breaker.allow():
+                AI_REQUESTS.inc(result="circuit_open")
+                return get_fallback_response(context, question)
+            task = asyncio.ensure_future(self._call(client, key, context, question))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller disconnecting doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def _call(self, client: httpx.AsyncClient, key, context: str, question: str) -> str:
+        # Create a simpler prompt for DialoGPT
+        prompt = f"""Context: {context}
 
 Question: {question}
 
 Answer:"""
 
-    payload = {
-        "inputs": prompt,
-        "parameters": {
-            "max_length": 150,
-            "temperature": 0.7,
-            "do_sample": True,
-            "return_full_text": False
+        payload = {
+            "inputs": prompt,
+            "parameters": {
+                "max_length": 150,
+                "temperature": 0.7,
+                "do_sample": True,
+                "return_full_text": False
+            }
         }
-    }
 
-    try:
-        response = requests.post(API_URL, headers=headers, json=payload, timeout=30)
-        
-        # Check for a successful response
-        if response.status_code == 200:
-            response_data = response.json()
-            # The response format can vary, so we check for common keys.
-            if isinstance(response_data, list) and response_data:
-                generated_text = response_data[0].get("generated_text")
-                if generated_text:
-                    return generated_text.strip()
-            return "Sorry, I received an unexpected response format from the AI service."
-        
-        # Handle specific errors - fall back to rule-based response
-        elif response.status_code == 401:
-            return get_fallback_response(context, question)
-        elif response.status_code == 403:
+        try:
+            response = await client.post(self.api_url, json=payload)
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            AI_REQUESTS.inc(result="upstream_error")
             return get_fallback_response(context, question)
-        elif response.status_code == 503:
-             return "Error: The AI model is currently loading and not available. Please try again in a few moments."
-        else:
-            # General error - fall back to rule-based response
+
+        # Any non-200 counts against the breaker; 503 means the model is loading
+        if response.status_code != 200:
+            self.breaker.record_failure()
+            AI_REQUESTS.inc(result="upstream_error")
+            if response.status_code == 503:
+                return MODEL_LOADING_MESSAGE
             return get_fallback_response(context, question)
 
-    except requests.exceptions.RequestException as e:
-        return get_fallback_response(context, question)
+        self.breaker.record_success()
+        AI_REQUESTS.inc(result="upstream")
+        try:
+            response_data = response.json()
+        except ValueError:
+            response_data = None
+        # The response format can vary, so we check for common keys.
+        if isinstance(response_data, list) and response_data and isinstance(response_data[0], dict):
+            generated_text = response_data[0].get("generated_text")
+            if generated_text:
+                answer = generated_text.strip()
+                self.cache.set(key, answer)
+                return answer
+        return "Sorry, I received an unexpected response format from the AI service."
+
+
+_client = AIClient()
+
+metrics.Gauge("ai_circuit_open", "1 while the AI circuit breaker is refusing upstream calls",
+              callback=lambda: int(_client.breaker.is_open))
+
+
+async def get_ai_response(context: str, question: str) -> str:
+    """
+    Answers a question about the given context with the Hugging Face API.
+    Falls back to a simple rule-based response if API fails.
+    """
+    return await _client.ask(context, question)
+
+
+async def close():
+    await _client.close()
+
+
+class Intent(str, Enum):
+    OFF_TOPIC = "off_topic"
+    USER_COUNT = "user_count"
+    GROUP_COUNT = "group_count"
+    LIST_USERS = "list_users"
+    LIST_GROUPS = "list_groups"
+    BALANCES = "balances"
+    HELP = "help"
+    COMPLEX = "complex"
+    GENERAL = "general"
+
+
+# Keyword phrases and the intents they signal, in priority order. A question
+# mentioning none of APP_KEYWORDS is off topic.
+APP_KEYWORDS = ['user', 'group', 'expense', 'balance', 'settlement', 'owe', 'debt', 'money', 'split', 'bill', 'pay', 'member']
+INTENT_PHRASES = [
+    (Intent.USER_COUNT, ["how many users", "number of users"]),
+    (Intent.GROUP_COUNT, ["how many groups", "number of groups"]),
+    (Intent.LIST_USERS, ["list users", "show users", "who are the users"]),
+    (Intent.LIST_GROUPS, ["list groups", "show groups", "what groups"]),
+    (Intent.BALANCES, ["balance", "owe", "debt"]),
+    (Intent.HELP, ["help", "what can you do", "how to"]),
+    (Intent.COMPLEX, ['complex', 'detailed', 'explain', 'algorithm', 'how does', 'why']),
+]
+COMPLEX_QUESTION_LENGTH = 100
+
+# INTENT_PHRASES as one flat list in priority order, so classification
+# doesn't compare intents per question. Complex is the last intent, and its
+# phrases are checked after the length check that also makes a question
+# complex
+_CHECKED_PHRASES = [
+    (phrase, intent) for intent, phrases in INTENT_PHRASES if intent != Intent.COMPLEX for phrase in phrases
+]
+_COMPLEX_PHRASES = dict(INTENT_PHRASES)[Intent.COMPLEX]
+
+
+def classify_question(question: str) -> Intent:
+    """
+    Sorts a question into the intents the rule-based fallback can answer,
+    with plain substring checks that stop at the first phrase found.
+    """
+    question_lower = question.lower()
+    for keyword in APP_KEYWORDS:
+        if keyword in question_lower:
+            break
+    else:
+        return Intent.OFF_TOPIC
+    for phrase, intent in _CHECKED_PHRASES:
+        if phrase in question_lower:
+            return intent
+    if len(question) > COMPLEX_QUESTION_LENGTH:
+        return Intent.COMPLEX
+    for phrase in _COMPLEX_PHRASES:
+        if phrase in question_lower:
+            return Intent.COMPLEX
+    return Intent.GENERAL
+
+
+OFF_TOPIC_RESPONSE = (
+    "I can only help with questions about users, groups, expenses, balances, and settlements in this Splitwise application. "
+    "For other inquiries or complex questions, please contact us at:\n\n"
+    "📧 Email: splitwise@gmail.com\n"
+    "📞 Phone: 9876543214\n\n"
+    "How can I help you with your expense management today?"
+)
+HELP_RESPONSE = (
+    "I can help you with:\n"
+    "• Viewing user information and counts\n"
+    "• Checking group details and members\n"
+    "• Reviewing expense balances and settlements\n"
+    "• Understanding who owes what to whom\n\n"
+    "Try asking: 'How many users are there?', 'List all groups', or 'Show me the balances'"
+)
+COMPLEX_RESPONSE = (
+    "This question seems complex and might require detailed assistance. "
+    "For comprehensive support, please contact us at:\n\n"
+    "📧 Email: splitwise@gmail.com\n"
+    "📞 Phone: 9876543214\n\n"
+    "I can help with basic questions about users, groups, expenses, and balances in this app."
+)
+
+
+def count_response(noun: str, count: int) -> str:
+    return f"There are {count} {noun} in the system."
+
+
+def _section_total(context: str, title: str, line_prefix: str) -> int:
+    # Sections may be truncated, so prefer the total in their header
+    match = re.search(rf"\*\*{title} \((\d+)\):\*\*", context)
+    if match:
+        return int(match.group(1))
+    return context.count(line_prefix)
 
 
 def get_fallback_response(context: str, question: str) -> str:
     """
     Simple rule-based chatbot fallback when the AI API is not available.
     """
-    question_lower = question.lower()
-    
-    # Check if question is related to the app
-    app_keywords = ['user', 'group', 'expense', 'balance', 'settlement', 'owe', 'debt', 'money', 'split', 'bill', 'pay', 'member']
-    is_app_related = any(keyword in question_lower for keyword in app_keywords)
+    intent = classify_question(question)
     
     # If not app-related, provide contact information
-    if not is_app_related:
-        return ("I can only help with questions about users, groups, expenses, balances, and settlements in this Splitwise application. "
-                "For other inquiries or complex questions, please contact us at:\n\n"
-                "📧 Email: splitwise@gmail.com\n"
-                "📞 Phone: 9876543214\n\n"
-                "How can I help you with your expense management today?")
+    if intent == Intent.OFF_TOPIC:
+        return OFF_TOPIC_RESPONSE
     
     # Count users
-    if "how many users" in question_lower or "number of users" in question_lower:
-        user_count = context.count("- ID:")
-        return f"There are {user_count} users in the system."
+    if intent == Intent.USER_COUNT:
+        user_count = _section_total(context, "Users", "- ID:")
+        return count_response("users", user_count)
     
     # Count groups
-    elif "how many groups" in question_lower or "number of groups" in question_lower:
-        group_count = context.count("- Group ID:")
-        return f"There are {group_count} groups in the system."
+    elif intent == Intent.GROUP_COUNT:
+        group_count = _section_total(context, "Groups", "- Group ID:")
+        return count_response("groups", group_count)
     
     # List users
-    elif "list users" in question_lower or "show users" in question_lower or "who are the users" in question_lower:
+    elif intent == Intent.LIST_USERS:
         lines = context.split('\n')
         users = [line.strip() for line in lines if line.strip().startswith("- ID:")]
         if users:
@@ -101,7 +333,7 @@ def get_fallback_response(context: str, question: str) -> str:
         return "No users found in the system."
     
     # List groups
-    elif "list groups" in question_lower or "show groups" in question_lower or "what groups" in question_lower:
+    elif intent == Intent.LIST_GROUPS:
         lines = context.split('\n')
         groups = [line.strip() for line in lines if line.strip().startswith("- Group ID:")]
         if groups:
@@ -109,28 +341,18 @@ def get_fallback_response(context: str, question: str) -> str:
         return "No groups found in the system."
     
     # Balance information
-    elif "balance" in question_lower or "owe" in question_lower or "debt" in question_lower:
+    elif intent == Intent.BALANCES:
         if "Expenses & Balances:" in context:
             balance_section = context.split("Expenses & Balances:")[1]
             return f"Here's the balance information:\n{balance_section.strip()}"
         return "No balance information available."
     
     # Help or general app questions
-    elif "help" in question_lower or "what can you do" in question_lower or "how to" in question_lower:
-        return ("I can help you with:\n"
-                "• Viewing user information and counts\n"
-                "• Checking group details and members\n"
-                "• Reviewing expense balances and settlements\n"
-                "• Understanding who owes what to whom\n\n"
-                "Try asking: 'How many users are there?', 'List all groups', or 'Show me the balances'")
+    elif intent == Intent.HELP:
+        return HELP_RESPONSE
     
     # Default response for complex or unclear questions
+    elif intent == Intent.COMPLEX:
+        return COMPLEX_RESPONSE
     else:
-        if len(question) > 100 or any(word in question_lower for word in ['complex', 'detailed', 'explain', 'algorithm', 'how does', 'why']):
-            return ("This question seems complex and might require detailed assistance. "
-                    "For comprehensive support, please contact us at:\n\n"
-                    "📧 Email: splitwise@gmail.com\n"
-                    "📞 Phone: 9876543214\n\n"
-                    "I can help with basic questions about users, groups, expenses, and balances in this app.")
-        else:
-            return f"I can help you with information about users, groups, and balances. Here's what I found in the system:\n\n{context}"
+        return f"I can help you with information about users, groups, and balances. Here's what I found in the system:\n\n{context}"
@@ -0,0 +1,182 @@
+"""
+Archival of settled group history.
+
+archive() moves a group's expenses (with their splits) and settlements
+dated up to a cutoff out of the hot tables into archived_expenses,
+archived_expense_splits and archived_settlements, with one INSERT ... SELECT
+and one DELETE per table. The group's net balances must all be zero at the
+cutoff. Each member's totals over everything archived so far are kept in
+group_opening_balances, and the balance aggregates (ledger verify and
+rebuild, historical balances) add those in place of the archived rows. So
+balances stay exact while the hot tables and their indexes only hold what
+happened since. The ledger itself doesn't change.
+
+Archived rows stay readable through ?include_archived=true on the expense
+and settlement listings and on historical balances, which also query the
+archive tables. export() writes a copy of a group's archived rows to a
+gzip-compressed JSON Lines file, e.g. to move it to cold storage.
+
+Usage:
+    python archive.py run --group-id ID [--before 2026-01-01T00:00:00]
+    python archive.py export --group-id ID --out group-1.jsonl.gz
+"""
+import argparse
+import gzip
+import json
+from datetime import datetime
+from sqlalchemy import DateTime, delete, insert, literal, select
+from sqlalchemy.orm import Session, selectinload
+import journal
+import ledger
+import models
+from balance_engine import archive_cutoffs, archived_totals, compute_member_totals, net_balance_cents
+from ledger import LEDGER_FIELDS
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPENSE_COLUMNS = ["id", "description", "amount_cents", "group_id", "paid_by", "split_type", "created_at"]
+SPLIT_COLUMNS = ["id", "expense_id", "user_id", "amount_cents", "percentage"]
+SETTLEMENT_COLUMNS = ["id", "group_id", "payer_id", "payee_id", "amount_cents", "description", "settled_at"]
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def _copy(db: Session, source, target, columns, condition, archived_at=None) -> int:
+    # INSERT INTO target (columns) SELECT columns FROM source WHERE condition
+    names = list(columns)
+    selected = [getattr(source, name) for name in columns]
+    if archived_at is not None:
+        names.append("archived_at")
+        selected.append(literal(archived_at, DateTime))
+    return db.execute(insert(target).from_select(names, select(*selected).where(condition))).rowcount
+
+
+def archive(db: Session, group: models.Group, cutoff: datetime):
+    """
+    Archives the group's expenses created and settlements made up to and
+    including cutoff, and updates its opening balances. The caller
+    commits. Returns (expenses archived, settlements archived).
+    """
+    previous = archive_cutoffs(db, [group.id]).get(group.id)
+    if previous is not None and cutoff < previous:
+        raise ArchiveError(f"History up to {previous.isoformat()} is already archived")
+    if cutoff > datetime.utcnow():
+        raise ArchiveError("The cutoff can't be in the future")
+    totals = compute_member_totals(db, [group.id], until=cutoff)[group.id]
+    if any(net_balance_cents(member) for member in totals.values()):
+        raise ArchiveError(f"Group '{group.name}' is not settled at {cutoff.isoformat()}")
+
+    # Rows of this run are told apart by archived_at, so exactly the rows
+    # copied are deleted even if others are written meanwhile
+    archived_at = datetime.utcnow()
+    expense, settlement = models.ArchivedExpense, models.ArchivedSettlement
+    this_run_expenses = select(expense.id).where(expense.group_id == group.id, expense.archived_at == archived_at)
+    this_run_settlements = select(settlement.id).where(
+        settlement.group_id == group.id, settlement.archived_at == archived_at
+    )
+    expenses = _copy(db, models.Expense, expense, EXPENSE_COLUMNS, (models.Expense.group_id == group.id)
+                     & (models.Expense.created_at <= cutoff), archived_at)
+    _copy(db, models.ExpenseSplit, models.ArchivedExpenseSplit, SPLIT_COLUMNS,
+          models.ExpenseSplit.expense_id.in_(this_run_expenses))
+    settlements = _copy(db, models.Settlement, settlement, SETTLEMENT_COLUMNS, (models.Settlement.group_id == group.id)
+                        & (models.Settlement.settled_at <= cutoff), archived_at)
+    # Splits go with their expenses (ON DELETE CASCADE)
+    db.execute(delete(models.Expense).where(models.Expense.id.in_(this_run_expenses)))
+    db.execute(delete(models.Settlement).where(models.Settlement.id.in_(this_run_settlements)))
+
+    # The opening balance is whatever the archive holds now
+    db.execute(delete(models.GroupOpeningBalance).where(models.GroupOpeningBalance.group_id == group.id))
+    rows = [
+        {"group_id": group.id, "user_id": user_id, "as_of": cutoff,
+         **{name: getattr(member, name) for name in LEDGER_FIELDS}}
+        for user_id, member in archived_totals(db, [group.id])[group.id].items()
+    ]
+    if rows:
+        db.execute(insert(models.GroupOpeningBalance), rows)
+
+    # Balances are unchanged, but the listings are not
+    ledger.mark_changed(db, group.id)
+    journal.record(db, group.id, journal.HISTORY_ARCHIVED, group.id, {
+        "before": cutoff.isoformat(), "expense_count": expenses, "settlement_count": settlements
+    })
+    return expenses, settlements
+
+
+def _row(table: str, obj, columns) -> dict:
+    row = {"table": table}
+    for name in columns:
+        value = getattr(obj, name)
+        row[name] = value.isoformat() if isinstance(value, datetime) else getattr(value, "value", value)
+    return row
+
+
+def export(db: Session, group_id: int, path: str) -> int:
+    """
+    Writes the group's archived expenses, each followed by its splits, and
+    then its archived settlements to a gzip-compressed JSON Lines file.
+    Every line names its table. Returns the number of lines written.
+    """
+    written = 0
+    with gzip.open(path, "wt", encoding="utf-8") as out:
+        def write(row):
+            nonlocal written
+            out.write(json.dumps(row, separators=(",", ":")) + "\n")
+            written += 1
+
+        expenses = db.query(models.ArchivedExpense).options(selectinload(models.ArchivedExpense.splits)).filter(
+            models.ArchivedExpense.group_id == group_id
+        ).order_by(models.ArchivedExpense.created_at, models.ArchivedExpense.id)
+        for expense in expenses.yield_per(EXPORT_BATCH_SIZE):
+            write(_row("expense", expense, EXPENSE_COLUMNS))
+            for split in sorted(expense.splits, key=lambda split: split.id):
+                write(_row("expense_split", split, SPLIT_COLUMNS))
+        settlements = db.query(models.ArchivedSettlement).filter(
+            models.ArchivedSettlement.group_id == group_id
+        ).order_by(models.ArchivedSettlement.settled_at, models.ArchivedSettlement.id)
+        for settlement in settlements.yield_per(EXPORT_BATCH_SIZE):
+            write(_row("settlement", settlement, SETTLEMENT_COLUMNS))
+    return written
+
+
+def main():
+    from database import SessionLocal, create_tables
+    from snapshots import to_utc
+
+    parser = argparse.ArgumentParser(description="Archive settled group history.")
+    parser.add_argument("command", choices=["run", "export"])
+    parser.add_argument("--group-id", type=int, required=True)
+    parser.add_argument("--before", type=datetime.fromisoformat,
+                        help="Archive cutoff, UTC unless an offset is given (default: now)")
+    parser.add_argument("--out", help="File to export to (export only)")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if args.command == "export":
+            if not args.out:
+                parser.error("export needs --out")
+            print(f"Wrote {export(db, args.group_id, args.out)} line(s) to {args.out}")
+            return 0
+
+        group = db.get(models.Group, args.group_id)
+        if group is None:
+            print(f"Group {args.group_id} not found")
+            return 1
+        cutoff = to_utc(args.before) if args.before else datetime.utcnow()
+        try:
+            expenses, settlements = archive(db, group, cutoff)
+        except ArchiveError as e:
+            print(e)
+            return 1
+        db.commit()
+        print(f"Archived {expenses} expense(s) and {settlements} settlement(s) of group {group.id} up to {cutoff.isoformat()}")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,288 @@
+from collections import defaultdict
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+import models
+import schemas
+from money import from_cents, to_cents
+
+
+class MemberTotals:
+    """
+    Raw per-member totals for one group in cents, as produced by the grouped
+    aggregates.
+    """
+    __slots__ = ("paid", "owed", "own_share", "settlements_made", "settlements_received")
+
+    def __init__(self):
+        self.paid = 0                  # Sum of expenses this user paid
+        self.owed = 0                  # Sum of this user's splits
+        self.own_share = 0             # This user's splits on expenses they paid themselves
+        self.settlements_made = 0      # Settlements where this user was the payer
+        self.settlements_received = 0  # Settlements where this user was the payee
+
+
+class ArchivedHistory(Exception):
+    """
+    Raised when totals need expenses or settlements that were archived
+    without include_archived.
+    """
+
+    def __init__(self, group_id: int, cutoff):
+        super().__init__(f"History of group {group_id} up to {cutoff.isoformat()} is archived")
+        self.group_id = group_id
+        self.cutoff = cutoff
+
+
+def _in_window(column, after, until):
+    # Rows in (after, until]; either bound may be None
+    conditions = []
+    if after is not None:
+        conditions.append(column > after)
+    if until is not None:
+        conditions.append(column <= until)
+    return conditions
+
+
+def opening_balances(db: Session, group_ids):
+    """
+    Returns {group_id: (cutoff, {user_id: row})} from group_opening_balances
+    for the given groups that have archived history.
+    """
+    openings = {}
+    for row in db.query(models.GroupOpeningBalance).filter(
+        models.GroupOpeningBalance.group_id.in_(list(group_ids))
+    ).all():
+        openings.setdefault(row.group_id, (row.as_of, {}))[1][row.user_id] = row
+    return openings
+
+
+def archive_cutoffs(db: Session, group_ids) -> dict:
+    """
+    Returns {group_id: cutoff} for the given groups that have archived history.
+    """
+    return dict(db.query(models.GroupOpeningBalance.group_id, models.GroupOpeningBalance.as_of).filter(
+        models.GroupOpeningBalance.group_id.in_(list(group_ids))
+    ).distinct().all())
+
+
+# Hot tables, and the archive tables with the same columns
+HOT = (models.Expense, models.ExpenseSplit, models.Settlement)
+ARCHIVED = (models.ArchivedExpense, models.ArchivedExpenseSplit, models.ArchivedSettlement)
+
+
+def _add_row_totals(db: Session, totals, tables, group_ids, after, until):
+    expense, split, settlement = tables
+    expense_window = _in_window(expense.created_at, after, until)
+    settlement_window = _in_window(settlement.settled_at, after, until)
+
+    # Splits owed by each user, and the part of that which sits on expenses they paid
+    split_rows = db.query(
+        expense.group_id,
+        split.user_id,
+        func.sum(split.amount_cents),
+        func.sum(case(
+            (expense.paid_by == split.user_id, split.amount_cents),
+            else_=0
+        ))
+    ).join(expense, split.expense_id == expense.id).filter(
+        expense.group_id.in_(group_ids), *expense_window
+    ).group_by(expense.group_id, split.user_id).all()
+    for group_id, user_id, owed, own_share in split_rows:
+        member = totals[group_id][user_id]
+        member.owed += int(owed or 0)
+        member.own_share += int(own_share or 0)
+
+    # Expenses paid by each user
+    paid_rows = db.query(
+        expense.group_id,
+        expense.paid_by,
+        func.sum(expense.amount_cents)
+    ).filter(
+        expense.group_id.in_(group_ids), *expense_window
+    ).group_by(expense.group_id, expense.paid_by).all()
+    for group_id, user_id, paid in paid_rows:
+        totals[group_id][user_id].paid += int(paid or 0)
+
+    # Settlements made and received
+    made_rows = db.query(
+        settlement.group_id,
+        settlement.payer_id,
+        func.sum(settlement.amount_cents)
+    ).filter(
+        settlement.group_id.in_(group_ids), *settlement_window
+    ).group_by(settlement.group_id, settlement.payer_id).all()
+    for group_id, user_id, amount in made_rows:
+        totals[group_id][user_id].settlements_made += int(amount or 0)
+
+    received_rows = db.query(
+        settlement.group_id,
+        settlement.payee_id,
+        func.sum(settlement.amount_cents)
+    ).filter(
+        settlement.group_id.in_(group_ids), *settlement_window
+    ).group_by(settlement.group_id, settlement.payee_id).all()
+    for group_id, user_id, amount in received_rows:
+        totals[group_id][user_id].settlements_received += int(amount or 0)
+
+
+def archived_totals(db: Session, group_ids):
+    """
+    Computes MemberTotals over the archive tables alone. Returns
+    {group_id: {user_id: MemberTotals}}.
+    """
+    group_ids = list(group_ids)
+    totals = defaultdict(lambda: defaultdict(MemberTotals))
+    if group_ids:
+        _add_row_totals(db, totals, ARCHIVED, group_ids, None, None)
+    return totals
+
+
+def compute_member_totals(db: Session, group_ids, after=None, until=None, include_archived=False):
+    """
+    Computes MemberTotals for every user with activity in the given groups.
+
+    Uses a fixed number of GROUP BY queries regardless of how many groups or
+    members are involved. With after and/or until, only expenses created and
+    settlements made in (after, until] are counted. Archived rows are
+    counted through the groups' opening balances, so a window must either
+    start at the beginning and end at or after a group's archive cutoff,
+    or start at or after it; ArchivedHistory is raised otherwise. include_archived reads the
+    archive tables instead. Returns {group_id: {user_id: MemberTotals}}.
+    """
+    group_ids = list(group_ids)
+    totals = defaultdict(lambda: defaultdict(MemberTotals))
+    if not group_ids:
+        return totals
+
+    _add_row_totals(db, totals, HOT, group_ids, after, until)
+    if include_archived:
+        _add_row_totals(db, totals, ARCHIVED, group_ids, after, until)
+        return totals
+
+    for group_id, (cutoff, rows) in opening_balances(db, group_ids).items():
+        if after is not None and after >= cutoff:
+            continue  # The window starts after everything archived
+        if after is not None or (until is not None and until < cutoff):
+            raise ArchivedHistory(group_id, cutoff)
+        for user_id, row in rows.items():
+            member = totals[group_id][user_id]
+            for name in MemberTotals.__slots__:
+                setattr(member, name, getattr(member, name) + getattr(row, name))
+    return totals
+
+
+def net_balance_cents(member: MemberTotals) -> int:
+    """
+    Net position in cents: positive means the user is owed money.
+    """
+    return member.paid - member.owed + member.settlements_made - member.settlements_received
+
+
+def to_balance(user_id: int, user_name: str, member: MemberTotals) -> schemas.Balance:
+    """
+    Turns raw totals in cents into the owes/owed/net figures reported by the API.
+    """
+    # If someone paid you (settlements_received), it reduces what they owe you
+    # If you paid someone (settlements_made), it reduces what you owe them
+    adjusted_owes = (member.owed - member.own_share) - member.settlements_made
+    adjusted_owed = (member.paid - member.own_share) - member.settlements_received
+    net_balance = adjusted_owed - adjusted_owes
+
+    return schemas.Balance(
+        user_id=user_id,
+        user_name=user_name,
+        owes=from_cents(max(0, adjusted_owes)),  # Ensure no negative values
+        owed=from_cents(max(0, adjusted_owed)),
+        net_balance=from_cents(net_balance)
+    )
+
+
+def get_group_balances(db: Session, groups) -> dict:
+    """
+    Builds GroupBalance objects for several groups from the materialized
+    ledger with a single query. Returns {group_id: GroupBalance}.
+    """
+    groups = list(groups)
+    balances = {group.id: [] for group in groups}
+    if not groups:
+        return {}
+
+    rows = db.query(
+        models.GroupMember.group_id, models.User.id, models.User.name, models.GroupMemberBalance
+    ).join(
+        models.User, models.GroupMember.user_id == models.User.id
+    ).outerjoin(
+        models.GroupMemberBalance,
+        (models.GroupMemberBalance.group_id == models.GroupMember.group_id)
+        & (models.GroupMemberBalance.user_id == models.GroupMember.user_id)
+    ).filter(models.GroupMember.group_id.in_(list(balances))).order_by(models.GroupMember.id).all()
+
+    for group_id, user_id, user_name, ledger_row in rows:
+        balances[group_id].append(to_balance(user_id, user_name, ledger_row or MemberTotals()))
+
+    return {
+        group.id: schemas.GroupBalance(group_id=group.id, group_name=group.name, balances=balances[group.id])
+        for group in groups
+    }
+
+
+def get_group_balance(db: Session, group: models.Group) -> schemas.GroupBalance:
+    """
+    Builds the GroupBalance for a single group from the materialized ledger.
+    """
+    return get_group_balances(db, [group])[group.id]
+
+
+def get_user_balance(db: Session, user: models.User) -> schemas.UserBalance:
+    """
+    Builds a user's balances across all of their groups in two queries.
+    """
+    groups = db.query(models.Group).join(
+        models.GroupMember, models.GroupMember.group_id == models.Group.id
+    ).filter(models.GroupMember.user_id == user.id).order_by(models.GroupMember.id).all()
+
+    group_balances = list(get_group_balances(db, groups).values())
+    total_net_cents = 0
+    for group_balance in group_balances:
+        total_net_cents += to_cents(next(
+            (balance.net_balance for balance in group_balance.balances if balance.user_id == user.id),
+            0
+        ))
+
+    return schemas.UserBalance(
+        user_id=user.id,
+        user_name=user.name,
+        group_balances=group_balances,
+        total_net_balance=from_cents(total_net_cents)
+    )
+
+
+def get_user_balance_summary(db: Session, user: models.User) -> schemas.UserBalanceSummary:
+    """
+    Builds only the user's own net per group, reading one ledger row per group.
+    """
+    rows = db.query(models.Group.id, models.Group.name, models.GroupMemberBalance).join(
+        models.GroupMember, models.GroupMember.group_id == models.Group.id
+    ).outerjoin(
+        models.GroupMemberBalance,
+        (models.GroupMemberBalance.group_id == models.GroupMember.group_id)
+        & (models.GroupMemberBalance.user_id == models.GroupMember.user_id)
+    ).filter(models.GroupMember.user_id == user.id).order_by(models.GroupMember.id).all()
+
+    group_nets = []
+    total_net_cents = 0
+    for group_id, group_name, ledger_row in rows:
+        net_cents = net_balance_cents(ledger_row or MemberTotals())
+        total_net_cents += net_cents
+        group_nets.append(schemas.GroupNetBalance(
+            group_id=group_id,
+            group_name=group_name,
+            net_balance=from_cents(net_cents)
+        ))
+
+    return schemas.UserBalanceSummary(
+        user_id=user.id,
+        user_name=user.name,
+        group_balances=group_nets,
+        total_net_balance=from_cents(total_net_cents)
+    )
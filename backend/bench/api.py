@@ -0,0 +1,333 @@
+"""
+Load-tests the API endpoints in-process and compares runs against a
+saved baseline.
+
+The real FastAPI app is driven over ASGI with httpx, so no server or
+network is involved. For each endpoint the benchmark first counts the SQL
+statements one request runs (averaged over --query-samples sequential
+requests), then sends --requests requests from --concurrency concurrent
+clients and records throughput and p50/p95/p99 latency, keeping the
+median of --rounds such rounds. Requests rotate over the seeded groups and
+users, so runs with the same data and options send the same requests.
+
+The response cache is turned off unless --cache is given, so reads
+measure the database work rather than cache hits. On SQLite, which allows
+one writer at a time, write endpoints are always sent one at a time. The
+chatbot isn't benchmarked, since it depends on the external model.
+
+--seed fills an empty database first (see bench/seed.py for the scale
+options); without it the data already in the database is used. --save
+writes the results as JSON, and --compare reads such a file and flags
+endpoints whose latency grew by more than --threshold or that now run
+more queries, exiting non-zero if any did.
+
+Usage (from backend/):
+    python -m bench.api --database-url sqlite:///bench.db --seed --save baseline.json
+    python -m bench.api --database-url sqlite:///bench.db --rounds 3 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from bench.seed import add_arguments, scale_from_args
+
+LATENCY_FIELDS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+class Target:
+    """
+    The seeded ids the scenarios send requests for.
+    """
+
+    def __init__(self, groups, users):
+        self.groups = groups  # [(group_id, [member ids])]
+        self.users = users
+
+    def group(self, i: int):
+        return self.groups[i % len(self.groups)]
+
+    def user(self, i: int):
+        return self.users[i % len(self.users)]
+
+
+def load_target(limit: int = 50) -> Target:
+    import models
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        group_ids = [group_id for group_id, in db.query(models.Group.id).order_by(models.Group.id).limit(limit)]
+        members = {group_id: [] for group_id in group_ids}
+        for group_id, user_id in db.query(models.GroupMember.group_id, models.GroupMember.user_id).filter(
+            models.GroupMember.group_id.in_(group_ids)
+        ).order_by(models.GroupMember.id):
+            members[group_id].append(user_id)
+    finally:
+        db.close()
+
+    groups = [(group_id, member_ids) for group_id, member_ids in members.items() if len(member_ids) > 1]
+    if not groups:
+        raise SystemExit("No group with two or more members found; run with --seed against an empty database")
+    users = sorted({user_id for _, member_ids in groups for user_id in member_ids})
+    return Target(groups, users)
+
+
+def _percentage_splits(member_ids):
+    share = round(100.0 / len(member_ids), 2)
+    percentages = [share] * (len(member_ids) - 1) + [round(100.0 - share * (len(member_ids) - 1), 2)]
+    return [{"user_id": user_id, "percentage": percentage} for user_id, percentage in zip(member_ids, percentages)]
+
+
+# name -> (method, function of (target, i) returning (path, json body))
+SCENARIOS = {
+    "list groups": ("GET", lambda t, i: ("/groups/", None)),
+    "group detail": ("GET", lambda t, i: (f"/groups/{t.group(i)[0]}", None)),
+    "group balances": ("GET", lambda t, i: (f"/groups/{t.group(i)[0]}/balances", None)),
+    "user balances": ("GET", lambda t, i: (f"/users/{t.user(i)}/balances", None)),
+    "expense page": ("GET", lambda t, i: (f"/groups/{t.group(i)[0]}/expenses/?limit=50", None)),
+    "settlements": ("GET", lambda t, i: (f"/groups/{t.group(i)[0]}/settlements/", None)),
+    "settle plan": ("GET", lambda t, i: (f"/groups/{t.group(i)[0]}/settle-plan", None)),
+    "create equal expense": ("POST", lambda t, i: (f"/groups/{t.group(i)[0]}/expenses/", {
+        "description": f"bench {i}", "amount": 12.34 + i % 100, "paid_by": t.group(i)[1][0], "split_type": "equal",
+    })),
+    "create percentage expense": ("POST", lambda t, i: (f"/groups/{t.group(i)[0]}/expenses/", {
+        "description": f"bench {i}", "amount": 56.78 + i % 100, "paid_by": t.group(i)[1][-1],
+        "split_type": "percentage", "splits": _percentage_splits(t.group(i)[1]),
+    })),
+    "create settlement": ("POST", lambda t, i: (f"/groups/{t.group(i)[0]}/settlements/", {
+        "payer_id": t.group(i)[1][0], "payee_id": t.group(i)[1][1], "amount": 1.0 + i % 10,
+    })),
+}
+
+
+class QueryCounter:
+    """
+    Counts statements run on both engines.
+    """
+
+    def __init__(self):
+        from sqlalchemy import event
+        from database import async_engine, engine
+
+        self.count = 0
+        for target in (engine, async_engine.sync_engine):
+            event.listen(target, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run_scenario(client, target: Target, counter: QueryCounter, name: str, args) -> dict:
+    method, build = SCENARIOS[name]
+
+    async def send(i: int) -> int:
+        path, body = build(target, i)
+        response = await client.request(method, path, json=body)
+        return response.status_code
+
+    # Warm up, then count queries one request at a time
+    for i in range(args.warmup):
+        await send(i)
+    counter.count = 0
+    for i in range(args.query_samples):
+        await send(i)
+    queries = counter.count / max(args.query_samples, 1)
+
+    # SQLite allows one writer at a time; concurrent writes only measure lock waits
+    concurrency = args.concurrency
+    if method != "GET" and args.database_url_scheme.startswith("sqlite"):
+        concurrency = 1
+
+    rounds = [await run_round(send, args.requests, concurrency) for _ in range(args.rounds)]
+    # The median round of each figure, which steadies comparisons between runs
+    result = {"requests": args.requests, "concurrency": concurrency}
+    for field in ("errors", "rps") + LATENCY_FIELDS:
+        result[field] = statistics.median_low([round_result[field] for round_result in rounds])
+    result["queries"] = round(queries, 2)
+    return result
+
+
+async def run_round(send, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < requests:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            status = await send(i)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def run(args, names) -> dict:
+    import httpx
+    import main
+
+    target = load_target()
+    counter = QueryCounter()
+    results = {}
+    # Unhandled errors become 500 responses and count as errors
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in names:
+            results[name] = await run_scenario(client, target, counter, name, args)
+            print_row(name, results[name])
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_header():
+    print(f"{'endpoint':<26} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'errors':>7}")
+
+
+def print_row(name: str, result: dict):
+    print(f"{name:<26} {result['rps']:>9.1f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+          f"{result['p99_ms']:>9.2f} {result['queries']:>8.1f} {result['errors']:>7}")
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta_ms: float):
+    """
+    Returns a list of regression descriptions. Latency counts as a
+    regression when it grew by more than threshold (a fraction) and by
+    more than min_delta_ms; query counts and errors when they grew at all.
+    """
+    regressions = []
+    for name, result in current["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        for field in LATENCY_FIELDS:
+            if result[field] > before[field] * (1 + threshold) and result[field] - before[field] > min_delta_ms:
+                regressions.append(f"{name}: {field} {before[field]:.2f} -> {result[field]:.2f}")
+        if result["queries"] > before["queries"]:
+            regressions.append(f"{name}: queries {before['queries']:g} -> {result['queries']:g}")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{name}: errors {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API endpoints in-process.")
+    parser.add_argument("--database-url", help="Database to use (defaults to DATABASE_URL)")
+    parser.add_argument("--seed", action="store_true", help="Seed the (empty) database before running")
+    parser.add_argument("--endpoints", help="Comma-separated endpoint names (default: all)")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent clients")
+    parser.add_argument("--rounds", type=int, default=1, help="Measured rounds per endpoint; the median is kept")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per endpoint")
+    parser.add_argument("--query-samples", type=int, default=10, help="Sequential requests used to count queries")
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache on")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against a JSON file written by --save")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed latency growth as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Ignore latency changes smaller than this")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if not args.endpoints else [name.strip() for name in args.endpoints.split(",")]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)} (choose from: {', '.join(SCENARIOS)})")
+
+    # Configuration is read when the app modules are imported
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+    if not args.cache:
+        os.environ["CACHE_URL"] = "off"
+
+    from database import DATABASE_URL, SessionLocal, create_tables
+    from bench.seed import seed
+
+    args.database_url_scheme = DATABASE_URL.split("://", 1)[0]
+    create_tables()
+    scale = scale_from_args(args)
+    if args.seed:
+        db = SessionLocal()
+        try:
+            counts = seed(db, scale)
+        finally:
+            db.close()
+        print("seeded " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+
+    print(f"{args.requests} requests per endpoint, concurrency {args.concurrency}, "
+          f"cache {'on' if args.cache else 'off'}")
+    print_header()
+    endpoints = asyncio.run(run(args, names))
+
+    current = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "database": args.database_url_scheme,
+            "python": platform.python_version(),
+            "scale": scale.as_dict() if args.seed else None,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "rounds": args.rounds,
+            "cache": args.cache,
+        },
+        "endpoints": endpoints,
+    }
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"saved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for key in ("database", "requests", "concurrency", "cache"):
+            if baseline["meta"].get(key) != current["meta"][key]:
+                print(f"warning: {key} differs from the baseline "
+                      f"({baseline['meta'].get(key)} vs {current['meta'][key]})")
+        regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+        print(f"\ncompared with {args.compare} (revision {baseline['meta'].get('revision', 'unknown')}):")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if not regressions:
+            print("no regressions")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
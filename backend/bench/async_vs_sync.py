@@ -0,0 +1,127 @@
+"""
+Load-tests the async endpoints against the same logic served the old way,
+as sync handlers on Starlette's threadpool with the blocking session.
+
+Both apps are driven in-process over ASGI with the same request mix
+(group balances, user balances, the first expense page and settlements)
+at each concurrency level, and requests per second and latency
+percentiles are reported side by side. Point DATABASE_URL at a PostgreSQL
+database with some data in it; SQLite numbers say little about either path.
+
+Usage (from backend/):
+    python -m bench.async_vs_sync --concurrency 10,50,200 --duration 10 [--group-id ID]
+"""
+import argparse
+import asyncio
+import time
+from typing import List, Union
+import httpx
+from fastapi import Depends, FastAPI, Response
+from sqlalchemy.orm import Session
+from database import SessionLocal, get_db
+import main
+import models
+import schemas
+
+
+def build_sync_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/groups/{group_id}/balances", response_model=schemas.GroupBalance)
+    def get_group_balances(group_id: int, db: Session = Depends(get_db)):
+        return main._get_group_balances(db, group_id)
+
+    @app.get("/users/{user_id}/balances", response_model=Union[schemas.UserBalance, schemas.UserBalanceSummary])
+    def get_user_balances(user_id: int, db: Session = Depends(get_db)):
+        return main._get_user_balances(db, user_id)
+
+    @app.get("/groups/{group_id}/expenses/", response_model=List[schemas.Expense])
+    def get_group_expenses(group_id: int, response: Response, limit: int = 100, db: Session = Depends(get_db)):
+        return main._get_group_expenses(db, group_id, response, limit)
+
+    @app.get("/groups/{group_id}/settlements/", response_model=List[schemas.Settlement])
+    def get_group_settlements(group_id: int, db: Session = Depends(get_db)):
+        return main._get_group_settlements(db, group_id)
+
+    return app
+
+
+def pick_target(group_id=None):
+    db = SessionLocal()
+    try:
+        query = db.query(models.GroupMember)
+        if group_id is not None:
+            query = query.filter(models.GroupMember.group_id == group_id)
+        membership = query.order_by(models.GroupMember.id).first()
+        if membership is None:
+            raise SystemExit("No group with members found; seed the database first")
+        return membership.group_id, membership.user_id
+    finally:
+        db.close()
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def run_load(app: FastAPI, paths, concurrency: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def worker(offset: int):
+            nonlocal errors
+            i = offset
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(paths[i % len(paths)])
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+                i += 1
+
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+
+async def run(args):
+    group_id, user_id = pick_target(args.group_id)
+    paths = [
+        f"/groups/{group_id}/balances",
+        f"/users/{user_id}/balances",
+        f"/groups/{group_id}/expenses/",
+        f"/groups/{group_id}/settlements/",
+    ]
+    apps = [("sync", build_sync_app()), ("async", main.app)]
+
+    print(f"group {group_id}, user {user_id}, {args.duration:g}s per run")
+    print(f"{'app':>6} {'conc':>6} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>7}")
+    for concurrency in [int(value) for value in args.concurrency.split(",")]:
+        for name, app in apps:
+            # Warm up connections and caches before measuring
+            await run_load(app, paths, concurrency, min(1.0, args.duration))
+            result = await run_load(app, paths, concurrency, args.duration)
+            print(f"{name:>6} {concurrency:>6} {result['rps']:>10.1f} {result['p50_ms']:>10.2f} "
+                  f"{result['p99_ms']:>10.2f} {result['errors']:>7}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Compare the async endpoints with the sync threadpool path.")
+    parser.add_argument("--concurrency", default="10,50,200", help="Comma-separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per run")
+    parser.add_argument("--group-id", type=int, help="Group to query (defaults to the first group with members)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
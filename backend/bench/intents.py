@@ -0,0 +1,182 @@
+"""
+Benchmarks chatbot question handling over a corpus of sample questions.
+
+Compares the flattened phrase list in ai_service.classify_question with
+the original chain of substring checks and checks that both pick the
+same intent for every question. With --answers it also times answering
+each question from the database in DATABASE_URL without the model, the
+original way (full data dump, then the rule-based fallback) and the
+current way (direct answers, or a scoped context).
+
+Usage (from backend/):
+    python -m bench.intents [--repeat N] [--answers]
+"""
+import argparse
+import time
+import balance_engine
+import chat_context
+import models
+from ai_service import Intent, classify_question, get_fallback_response
+from database import SessionLocal
+
+CORPUS = [
+    "How many users are there?",
+    "how many users",
+    "What is the number of users in the app?",
+    "How many groups do we have?",
+    "number of groups",
+    "List users",
+    "show users please",
+    "Who are the users?",
+    "list groups",
+    "Show groups I am in",
+    "What groups exist?",
+    "Show me the balances",
+    "What is my balance in Trip to Goa?",
+    "Who owes money to whom?",
+    "How much do I owe Alice?",
+    "Is there any outstanding debt in the flat group?",
+    "help",
+    "What can you do?",
+    "How to add an expense?",
+    "How does the settle up algorithm work for a group?",
+    "Explain how splits are calculated",
+    "Why does Bob have a negative balance?",
+    "Give me a detailed breakdown of every expense and settlement in all of my groups over the last year please",
+    "Tell me about expenses",
+    "Who paid the most?",
+    "Which member paid the electricity bill?",
+    "Split the dinner bill",
+    "What's the weather like today?",
+    "Tell me a joke",
+    "Who won the game last night?",
+    "Translate hello into French",
+    "",
+    "USERS",
+    "how many users and how many groups",
+    "show groups and balances",
+    "I showed the receipt to the group",
+    "payment history for the ski group",
+    "settlement between members",
+    "how to pay back my debt",
+    "complex question about money",
+]
+
+
+def legacy_classify(question: str) -> Intent:
+    """
+    The original keyword chain from get_fallback_response.
+    """
+    question_lower = question.lower()
+    app_keywords = ['user', 'group', 'expense', 'balance', 'settlement', 'owe', 'debt', 'money', 'split', 'bill', 'pay', 'member']
+    if not any(keyword in question_lower for keyword in app_keywords):
+        return Intent.OFF_TOPIC
+    if "how many users" in question_lower or "number of users" in question_lower:
+        return Intent.USER_COUNT
+    elif "how many groups" in question_lower or "number of groups" in question_lower:
+        return Intent.GROUP_COUNT
+    elif "list users" in question_lower or "show users" in question_lower or "who are the users" in question_lower:
+        return Intent.LIST_USERS
+    elif "list groups" in question_lower or "show groups" in question_lower or "what groups" in question_lower:
+        return Intent.LIST_GROUPS
+    elif "balance" in question_lower or "owe" in question_lower or "debt" in question_lower:
+        return Intent.BALANCES
+    elif "help" in question_lower or "what can you do" in question_lower or "how to" in question_lower:
+        return Intent.HELP
+    elif len(question) > 100 or any(word in question_lower for word in ['complex', 'detailed', 'explain', 'algorithm', 'how does', 'why']):
+        return Intent.COMPLEX
+    return Intent.GENERAL
+
+
+def legacy_context(db) -> str:
+    """
+    The context the chatbot originally built for every question.
+    """
+    users = db.query(models.User).all()
+    groups = db.query(models.Group).all()
+    db.query(models.Expense).all()
+    context = "Here is the current state of the Splitwise data:\n\n**Users:**\n"
+    for user in users:
+        context += f"- ID: {user.id}, Name: {user.name}, Email: {user.email}\n"
+    context += "\n**Groups:**\n"
+    for group in groups:
+        member_names = [member.user.name for member in group.members]
+        context += f"- Group ID: {group.id}, Name: {group.name}, Members: {', '.join(member_names)}\n"
+    context += "\n**Expenses & Balances:**\n"
+    for group in groups:
+        context += f"\n*Group: {group.name}*\n"
+        for balance in balance_engine.get_group_balance(db, group).balances:
+            context += f"  - {balance.user_name}: Owes ${balance.owes:.2f}, Is Owed ${balance.owed:.2f}, Net Balance: ${balance.net_balance:.2f}\n"
+    return context
+
+
+def legacy_answer(db, question: str) -> str:
+    return get_fallback_response(legacy_context(db), question)
+
+
+def current_answer(db, question: str) -> str:
+    intent = classify_question(question)
+    if intent in chat_context.DIRECT_INTENTS:
+        return chat_context.direct_answer(db, intent)
+    return get_fallback_response(chat_context.build_context(db, question, intent), question)
+
+
+def time_answers(answer, repeat: int) -> float:
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for question in CORPUS:
+                answer(db, question)
+                # Drop loaded objects so every question reads the database
+                db.expire_all()
+        return (time.perf_counter() - start) / (repeat * len(CORPUS))
+    finally:
+        db.close()
+
+
+def time_classifier(classify, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for question in CORPUS:
+            classify(question)
+    return (time.perf_counter() - start) / (repeat * len(CORPUS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chatbot question handling.")
+    parser.add_argument("--repeat", type=int, default=2000, help="Passes over the corpus")
+    parser.add_argument("--answers", action="store_true", help="Also time answering from the database")
+    parser.add_argument("--answer-repeat", type=int, default=3, help="Passes over the corpus when answering")
+    args = parser.parse_args()
+
+    mismatches = [
+        (question, legacy_classify(question), classify_question(question))
+        for question in CORPUS
+        if legacy_classify(question) != classify_question(question)
+    ]
+    for question, expected, got in mismatches:
+        print(f"MISMATCH {question!r}: legacy={expected.value} current={got.value}")
+
+    legacy = time_classifier(legacy_classify, args.repeat)
+    current = time_classifier(classify_question, args.repeat)
+    print(f"{len(CORPUS)} questions, {args.repeat} passes, {len(mismatches)} mismatches")
+    print(f"{'legacy':>10} {legacy * 1e6:>8.2f} us/question")
+    print(f"{'current':>10} {current * 1e6:>8.2f} us/question ({legacy / current:.2f}x)")
+
+    counts = {}
+    for question in CORPUS:
+        intent = classify_question(question)
+        counts[intent.value] = counts.get(intent.value, 0) + 1
+    print("intents:", ", ".join(f"{name}={count}" for name, count in sorted(counts.items())))
+
+    if args.answers:
+        legacy = time_answers(legacy_answer, args.answer_repeat)
+        current = time_answers(current_answer, args.answer_repeat)
+        print(f"\nAnswering without the model, {args.answer_repeat} passes:")
+        print(f"{'legacy':>10} {legacy * 1000:>8.2f} ms/question")
+        print(f"{'current':>10} {current * 1000:>8.2f} ms/question ({legacy / current:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
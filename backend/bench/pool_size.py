@@ -0,0 +1,124 @@
+"""
+Finds a connection pool size for one uvicorn worker.
+
+Each uvicorn worker is a separate process with its own pool, and sync
+endpoints run on a threadpool (40 threads by default), so one worker can
+have up to that many requests competing for connections. This benchmark
+reproduces that for a single worker: it runs --concurrency threads that
+each check out a connection, run a query, hold the connection for --hold-ms
+to stand in for request work, and release it, once per candidate pool size.
+
+Usage (from backend/, against the database in DATABASE_URL):
+    python -m bench.pool_size --workers 4 --concurrency 40 --sizes 2,5,10,20
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from database import DATABASE_URL
+
+
+def run_one(pool_size: int, args) -> dict:
+    engine = create_engine(
+        DATABASE_URL, pool_size=pool_size, max_overflow=args.max_overflow, pool_timeout=args.timeout
+    )
+    waits = []
+    timeouts = 0
+    completed = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def worker():
+        nonlocal timeouts, completed
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection = engine.connect()
+            except PoolTimeoutError:
+                with lock:
+                    timeouts += 1
+                continue
+            waited = time.perf_counter() - start
+            try:
+                connection.execute(text("SELECT 1"))
+                time.sleep(args.hold_ms / 1000)
+            finally:
+                connection.close()
+            with lock:
+                waits.append(waited)
+                completed += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    waits.sort()
+    return {
+        "pool_size": pool_size,
+        "throughput": completed / args.duration,
+        "p50_wait_ms": statistics.median(waits) * 1000 if waits else 0.0,
+        "p99_wait_ms": waits[int(len(waits) * 0.99) - 1] * 1000 if waits else 0.0,
+        "timeouts": timeouts,
+    }
+
+
+def max_connections():
+    if not DATABASE_URL.startswith("postgresql"):
+        return None
+    engine = create_engine(DATABASE_URL)
+    try:
+        with engine.connect() as connection:
+            return int(connection.execute(text("SHOW max_connections")).scalar())
+    finally:
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pool sizes for one uvicorn worker.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="Number of uvicorn worker processes sharing the database")
+    parser.add_argument("--concurrency", type=int, default=40, help="Concurrent requests per worker")
+    parser.add_argument("--sizes", default="2,5,10,20,40", help="Comma-separated pool sizes to try")
+    parser.add_argument("--max-overflow", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--hold-ms", type=float, default=5, help="How long each request holds its connection")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per pool size")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="Pick the smallest pool within this fraction of the best throughput")
+    args = parser.parse_args()
+
+    limit = max_connections()
+    reserved = 5  # Leave room for migrations, psql and monitoring
+    results = []
+    print(f"{'pool':>6} {'req/s':>10} {'p50 wait ms':>12} {'p99 wait ms':>12} {'timeouts':>9} {'total conns':>12}")
+    for pool_size in [int(size) for size in args.sizes.split(",")]:
+        total = args.workers * (pool_size + args.max_overflow)
+        if limit is not None and total > limit - reserved:
+            print(f"{pool_size:>6} skipped: {total} connections exceeds max_connections={limit} minus {reserved} reserved")
+            continue
+        result = run_one(pool_size, args)
+        results.append(result)
+        print(f"{pool_size:>6} {result['throughput']:>10.1f} {result['p50_wait_ms']:>12.2f} "
+              f"{result['p99_wait_ms']:>12.2f} {result['timeouts']:>9} {total:>12}")
+
+    if not results:
+        return
+    best = max(result["throughput"] for result in results)
+    choice = min(
+        (result for result in results if result["throughput"] >= best * (1 - args.tolerance) and not result["timeouts"]),
+        key=lambda result: result["pool_size"],
+        default=None,
+    )
+    if choice:
+        print(f"\nRecommended for {args.workers} worker(s): DB_POOL_SIZE={choice['pool_size']} "
+              f"({args.workers * choice['pool_size']} connections in total)")
+
+
+if __name__ == "__main__":
+    main()
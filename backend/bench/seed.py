@@ -0,0 +1,184 @@
+"""
+Seeds the database in DATABASE_URL with synthetic users, groups, expenses
+and settlements for benchmarking.
+
+Every group gets --members members drawn from the --users pool, and
+--expenses expenses paid by random members and split with one of the
+requested split types. The same --random-seed always produces the same
+data.
+Rows are bulk-inserted and the balance ledger is rebuilt at the end.
+Refuses to write to a database that already has users in it.
+
+Usage (from backend/):
+    python -m bench.seed --users 1000 --groups 100 --members 8 --expenses 200 [--split-types equal,percentage]
+"""
+import argparse
+import random
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert
+import ledger
+import models
+from split_math import compute_splits
+
+BATCH_SIZE = 5000
+
+
+@dataclass
+class Scale:
+    users: int = 200
+    groups: int = 20
+    members: int = 6
+    expenses: int = 100
+    settlements: int = 10
+    split_types: str = "equal,percentage"
+    seed: int = 42
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the --users, --groups ... options that make up a Scale.
+    """
+    defaults = Scale()
+    parser.add_argument("--users", type=int, default=defaults.users, help="Users in the pool")
+    parser.add_argument("--groups", type=int, default=defaults.groups, help="Groups")
+    parser.add_argument("--members", type=int, default=defaults.members, help="Members per group")
+    parser.add_argument("--expenses", type=int, default=defaults.expenses, help="Expenses per group")
+    parser.add_argument("--settlements", type=int, default=defaults.settlements, help="Settlements per group")
+    parser.add_argument("--split-types", default=defaults.split_types, help="Comma-separated split types to use")
+    parser.add_argument("--random-seed", type=int, default=defaults.seed, help="Random seed for the data")
+
+
+def scale_from_args(args) -> Scale:
+    return Scale(
+        users=args.users, groups=args.groups, members=args.members, expenses=args.expenses,
+        settlements=args.settlements, split_types=args.split_types, seed=args.random_seed,
+    )
+
+
+class _Percentage:
+    # Stands in for ExpenseSplitCreate when computing percentage splits
+    __slots__ = ("user_id", "percentage")
+
+    def __init__(self, user_id: int, percentage: float):
+        self.user_id = user_id
+        self.percentage = percentage
+
+
+def _random_percentages(rng: random.Random, member_ids):
+    weights = [rng.randint(1, 10) for _ in member_ids]
+    percentages = [round(100.0 * weight / sum(weights), 2) for weight in weights]
+    percentages[-1] = round(100.0 - sum(percentages[:-1]), 2)
+    return [_Percentage(user_id, percentage) for user_id, percentage in zip(member_ids, percentages)]
+
+
+def _insert_returning_ids(db, model, rows):
+    ids = []
+    for start in range(0, len(rows), BATCH_SIZE):
+        ids.extend(db.scalars(
+            insert(model).returning(model.id, sort_by_parameter_order=True), rows[start:start + BATCH_SIZE]
+        ).all())
+    return ids
+
+
+def _insert(db, model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def seed(db, scale: Scale) -> dict:
+    """
+    Inserts the synthetic dataset and commits it. Returns row counts.
+    """
+    if scale.members > scale.users:
+        raise SystemExit("--members can't be larger than --users")
+    split_types = [models.SplitType(name.strip()) for name in scale.split_types.split(",") if name.strip()]
+    if not split_types:
+        raise SystemExit("--split-types needs at least one split type")
+    if db.query(func.count(models.User.id)).scalar():
+        raise SystemExit("DATABASE_URL already has users; point it at an empty database to seed")
+
+    rng = random.Random(scale.seed)
+    now = datetime.utcnow()
+
+    user_ids = _insert_returning_ids(db, models.User, [
+        {"name": f"Bench User {i}", "email": f"bench-user-{i}@example.com"} for i in range(scale.users)
+    ])
+    group_ids = _insert_returning_ids(db, models.Group, [
+        {"name": f"Bench Group {i}", "description": "Synthetic benchmark data"} for i in range(scale.groups)
+    ])
+
+    members = {group_id: rng.sample(user_ids, scale.members) for group_id in group_ids}
+    _insert(db, models.GroupMember, [
+        {"group_id": group_id, "user_id": user_id} for group_id, member_ids in members.items() for user_id in member_ids
+    ])
+
+    counts = {"users": len(user_ids), "groups": len(group_ids), "expenses": 0, "splits": 0, "settlements": 0}
+    for group_id, member_ids in members.items():
+        expense_rows, expense_splits = [], []
+        for _ in range(scale.expenses):
+            amount_cents = rng.randint(100, 50_000)
+            split_type = rng.choice(split_types)
+            splits = None
+            if split_type == models.SplitType.PERCENTAGE:
+                splits = _random_percentages(rng, member_ids)
+            expense_rows.append({
+                "description": f"Expense {rng.randint(1, 10_000)}",
+                "amount_cents": amount_cents,
+                "group_id": group_id,
+                "paid_by": rng.choice(member_ids),
+                "split_type": split_type,
+                "created_at": now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+            })
+            expense_splits.append(compute_splits(amount_cents, split_type, member_ids, splits))
+
+        expense_ids = _insert_returning_ids(db, models.Expense, expense_rows)
+        split_rows = [
+            {"expense_id": expense_id, "user_id": user_id, "amount_cents": amount_cents, "percentage": percentage}
+            for expense_id, splits in zip(expense_ids, expense_splits)
+            for user_id, amount_cents, percentage in splits
+        ]
+        _insert(db, models.ExpenseSplit, split_rows)
+
+        settlement_rows = []
+        for _ in range(scale.settlements if len(member_ids) > 1 else 0):
+            payer_id, payee_id = rng.sample(member_ids, 2)
+            settlement_rows.append({
+                "group_id": group_id, "payer_id": payer_id, "payee_id": payee_id,
+                "amount_cents": rng.randint(100, 10_000), "description": "Bench settlement",
+                "settled_at": now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+            })
+        _insert(db, models.Settlement, settlement_rows)
+
+        counts["expenses"] += len(expense_rows)
+        counts["splits"] += len(split_rows)
+        counts["settlements"] += len(settlement_rows)
+
+    ledger.rebuild(db)
+    db.commit()
+    return counts
+
+
+def main():
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Seed synthetic benchmark data.")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        counts = seed(db, scale_from_args(args))
+    finally:
+        db.close()
+    print(", ".join(f"{count} {name}" for name, count in counts.items()) + f" in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmarks the settle-up planners on random balances.
+
+Usage (from backend/):
+    python -m bench.settle_plan [--repeat N] [--seed S]
+"""
+import argparse
+import random
+import time
+import settle_plan
+
+SIZES = [10, 100, 1000]
+
+
+def random_nets(members: int, rng: random.Random):
+    nets = {user_id: rng.randint(-50_000, 50_000) for user_id in range(1, members)}
+    nets[members] = -sum(nets.values())
+    return nets
+
+
+def check_plan(nets, transfers):
+    remaining = dict(nets)
+    for payer_id, payee_id, cents in transfers:
+        remaining[payer_id] += cents
+        remaining[payee_id] -= cents
+    assert not any(remaining.values()), "plan does not settle every balance"
+
+
+def time_plan(planner, nets, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        transfers = planner(nets)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    check_plan(nets, transfers)
+    return best, len(transfers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark settle-up planners.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'members':>8} {'mode':>7} {'best ms':>10} {'transfers':>10}")
+    for members in SIZES:
+        nets = random_nets(members, rng)
+        seconds, count = time_plan(settle_plan.greedy_plan, nets, args.repeat)
+        print(f"{members:>8} {'greedy':>7} {seconds * 1000:>10.3f} {count:>10}")
+        if members <= settle_plan.EXACT_MAX_MEMBERS:
+            seconds, count = time_plan(settle_plan.exact_plan, nets, args.repeat)
+            print(f"{members:>8} {'exact':>7} {seconds * 1000:>10.3f} {count:>10}")
+
+
+if __name__ == "__main__":
+    main()
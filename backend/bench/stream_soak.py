@@ -0,0 +1,223 @@
+"""
+Soak test for the balance streams.
+
+Opens --subscribers idle SSE streams (GET /groups/{id}/stream) spread over
+the first --stream-groups groups of the database, in-process over ASGI like
+bench/api.py, and holds them for --hold seconds. It then sends --writes
+expenses one at a time, each to the next group, and measures how long the
+change takes to reach every subscriber of that group. Finally it
+disconnects every stream.
+
+Reports the memory each idle subscriber costs, delivery latency
+percentiles and the streams that missed a change. It checks that every
+stream ended with the same balances as GET /groups/{id}/balances, and that
+no subscription is left behind after the disconnects. Exits non-zero if
+any check fails.
+
+Usage (from backend/):
+    python -m bench.stream_soak --database-url sqlite:///soak.db --seed --subscribers 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import time
+from bench.seed import add_arguments, scale_from_args
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stream:
+    """
+    One SSE request driven straight through the ASGI app.
+    """
+
+    def __init__(self, app, group_id: int):
+        self.app = app
+        self.group_id = group_id
+        self.status = None
+        self.messages = []  # (arrival time, event, data)
+        self.received = asyncio.Event()
+        self._disconnect = asyncio.Event()
+        self._buffer = ""
+        self._requested = False
+        self.task = None
+
+    def open(self):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": f"/groups/{self.group_id}/stream",
+            "raw_path": f"/groups/{self.group_id}/stream".encode(), "root_path": "", "query_string": b"",
+            "headers": [(b"host", b"soak"), (b"accept", b"text/event-stream")],
+            "client": ("127.0.0.1", 0), "server": ("soak", 80),
+        }
+        self.task = asyncio.ensure_future(self.app(scope, self._receive, self._send))
+
+    def close(self):
+        self._disconnect.set()
+
+    async def _receive(self):
+        if not self._requested:
+            self._requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await self._disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            return
+        self._buffer += message.get("body", b"").decode()
+        while "\n\n" in self._buffer:
+            block, self._buffer = self._buffer.split("\n\n", 1)
+            fields = dict(line.split(": ", 1) for line in block.split("\n") if line and not line.startswith(":"))
+            if "event" in fields:
+                self.messages.append((time.perf_counter(), fields["event"], fields.get("data")))
+                self.received.set()
+
+    def messages_since(self, moment: float):
+        return [message for message in self.messages if message[0] >= moment]
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+async def soak(args, groups):
+    import httpx
+    import streams
+    from main import app
+
+    await app.router.startup()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://soak")
+    failures = []
+    try:
+        group_ids = [group_id for group_id, _ in groups]
+        by_group = {group_id: [] for group_id in group_ids}
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        for i in range(args.subscribers):
+            stream = Stream(app, group_ids[i % len(group_ids)])
+            by_group[stream.group_id].append(stream)
+            stream.open()
+            # Let the new streams send their first message in batches
+            if i % 200 == 199:
+                await asyncio.sleep(0)
+        all_streams = [stream for streams_of_group in by_group.values() for stream in streams_of_group]
+        await asyncio.wait_for(asyncio.gather(*(stream.received.wait() for stream in all_streams)), args.timeout)
+        opened = time.perf_counter() - start
+        rss_open = rss_bytes()
+        bad = [stream for stream in all_streams if stream.status != 200]
+        if bad:
+            failures.append(f"{len(bad)} streams did not open (status {bad[0].status})")
+        print(f"opened {len(all_streams)} streams on {len(group_ids)} groups in {opened:.1f}s, "
+              f"{streams.broker.subscriber_count()} subscribed, "
+              f"{(rss_open - rss_before) / max(1, len(all_streams)) / 1024:.1f} KiB each")
+
+        await asyncio.sleep(args.hold)
+        print(f"held idle for {args.hold:.0f}s, {streams.broker.subscriber_count()} still subscribed")
+
+        latencies, missed = [], 0
+        for i in range(args.writes):
+            group_id, member_ids = groups[i % len(groups)]
+            subscribers = by_group[group_id]
+            for stream in subscribers:
+                stream.received.clear()
+            written = time.perf_counter()
+            response = await client.post(f"/groups/{group_id}/expenses/", json={
+                "description": f"soak {i}", "amount": 10 + i % 90, "paid_by": member_ids[i % len(member_ids)],
+                "split_type": "equal",
+            })
+            if response.status_code != 200:
+                failures.append(f"write {i} failed with {response.status_code}: {response.text}")
+                break
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(stream.received.wait() for stream in subscribers)), args.timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+            for stream in subscribers:
+                arrivals = stream.messages_since(written)
+                if arrivals:
+                    latencies.append((arrivals[0][0] - written) * 1000)
+                else:
+                    missed += 1
+        if latencies:
+            print(f"{args.writes} writes: delivery p50 {percentile(latencies, 0.5):.1f} ms, "
+                  f"p99 {percentile(latencies, 0.99):.1f} ms, max {max(latencies):.1f} ms, "
+                  f"mean {statistics.fmean(latencies):.1f} ms over {len(latencies)} deliveries")
+        if missed:
+            failures.append(f"{missed} deliveries missed")
+
+        stale = 0
+        for group_id, subscribers in by_group.items():
+            expected = (await client.get(f"/groups/{group_id}/balances")).json()
+            stale += sum(1 for stream in subscribers if json.loads(stream.messages[-1][2]) != expected)
+        if stale:
+            failures.append(f"{stale} streams did not end with the current balances")
+        else:
+            print("every stream ends with the current balances")
+
+        for stream in all_streams:
+            stream.close()
+        await asyncio.wait_for(asyncio.gather(*(stream.task for stream in all_streams)), args.timeout)
+        left = streams.broker.subscriber_count()
+        print(f"disconnected all streams, {left} subscriptions left")
+        if left:
+            failures.append(f"{left} subscriptions leaked")
+    finally:
+        await client.aclose()
+        await app.router.shutdown()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak-test the balance streams in-process.")
+    parser.add_argument("--database-url", help="Database to use (defaults to DATABASE_URL)")
+    parser.add_argument("--seed", action="store_true", help="Seed the (empty) database before running")
+    parser.add_argument("--subscribers", type=int, default=2000, help="Streams to open")
+    parser.add_argument("--stream-groups", type=int, default=20, help="Groups to spread the streams over")
+    parser.add_argument("--hold", type=float, default=5, help="Seconds to keep the streams idle")
+    parser.add_argument("--writes", type=int, default=20, help="Expenses to write while subscribed")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for deliveries")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+        os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["CACHE_URL"] = "off"
+    os.environ.setdefault("STREAM_MAX_SUBSCRIBERS", str(max(args.subscribers, 10000)))
+
+    from database import SessionLocal, create_tables
+    from bench.api import load_target
+    from bench.seed import seed
+
+    create_tables()
+    if args.seed:
+        db = SessionLocal()
+        try:
+            counts = seed(db, scale_from_args(args))
+        finally:
+            db.close()
+        print("seeded " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+
+    groups = load_target(args.stream_groups).groups
+    failures = asyncio.run(soak(args, groups))
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,260 @@
+"""
+Streaming bulk import of expenses from CSV or JSON Lines.
+
+The importer runs in a worker thread and pulls the request body from the
+event loop chunk by chunk, so the upload is never held in memory. Rows are
+validated against a member set loaded once, written with batched
+executemany INSERTs, and the ledger is updated once at the end.
+
+CSV uploads need a header row with the columns description, amount,
+paid_by, split_type and optionally splits and created_at. Percentage splits
+are written as "user_id:percentage" pairs separated by semicolons, e.g.
+"1:40;2:30;3:30". JSON Lines uploads carry one ExpenseImportRow per line.
+"""
+import codecs
+import csv
+import json
+from collections import defaultdict
+import anyio
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+import journal
+import ledger
+import membership
+import models
+import schemas
+import snapshots
+from money import to_cents
+from split_math import SplitError, compute_splits
+
+CSV_CONTENT_TYPES = {"text/csv", "application/csv"}
+JSONL_CONTENT_TYPES = {"application/x-ndjson", "application/jsonl", "application/json-lines", "application/x-jsonlines"}
+
+
+class ImportFormatError(ValueError):
+    """
+    Raised when the upload format can't be determined or parsed.
+    """
+
+
+def detect_format(content_type, requested=None) -> schemas.ImportFormat:
+    if requested is not None:
+        return requested
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in CSV_CONTENT_TYPES:
+        return schemas.ImportFormat.CSV
+    if media_type in JSONL_CONTENT_TYPES:
+        return schemas.ImportFormat.JSONL
+    raise ImportFormatError("Unsupported content type; send text/csv or application/x-ndjson, or pass ?format=")
+
+
+def iter_lines(stream):
+    """
+    Yields decoded lines (with their line endings) from an ASGI body stream.
+    Must be called from a worker thread started by anyio.
+    """
+    async def next_chunk():
+        return await stream.__anext__()
+
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    while True:
+        try:
+            chunk = anyio.from_thread.run(next_chunk)
+        except StopAsyncIteration:
+            break
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(keepends=True)
+        # The last piece may be an incomplete line; keep it for the next chunk
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _parse_csv_splits(value: str):
+    splits = []
+    for part in value.split(";"):
+        part = part.strip()
+        if not part:
+            continue
+        user_id, _, percentage = part.partition(":")
+        splits.append({"user_id": user_id.strip(), "percentage": percentage.strip() or None})
+    return splits or None
+
+
+def iter_records(lines, import_format: schemas.ImportFormat):
+    """
+    Yields (row_number, record) pairs, where record is a dict or an
+    ImportFormatError for rows that couldn't be parsed at all.
+    """
+    if import_format == schemas.ImportFormat.CSV:
+        reader = csv.DictReader(lines)
+        if reader.fieldnames is None:
+            return
+        missing = {"description", "amount", "paid_by", "split_type"} - {name.strip() for name in reader.fieldnames}
+        if missing:
+            raise ImportFormatError(f"CSV header is missing columns: {', '.join(sorted(missing))}")
+        for row_number, row in enumerate(reader, start=1):
+            record = {key.strip(): (value.strip() if isinstance(value, str) else value)
+                      for key, value in row.items() if key is not None}
+            record = {key: value for key, value in record.items() if value not in (None, "")}
+            if "splits" in record:
+                record["splits"] = _parse_csv_splits(record["splits"])
+            yield row_number, record
+        return
+
+    row_number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, ImportFormatError(f"Invalid JSON: {e.msg}")
+            continue
+        if not isinstance(record, dict):
+            yield row_number, ImportFormatError("Each line must be a JSON object")
+            continue
+        yield row_number, record
+
+
+class ExpenseImporter:
+    """
+    Validates and writes imported expenses for one group in a single
+    transaction.
+    """
+
+    def __init__(self, db: Session, group: models.Group, chunk_size: int):
+        self.db = db
+        self.group = group
+        self.chunk_size = chunk_size
+        # Insertion order matters for equal splits, so keep a list as well
+        members = membership.member_ids(db, group.id)
+        self.member_ids = list(members.ids)
+        self.member_set = members.id_set
+        self.pending = []
+        self.deltas = defaultdict(dict)
+        self.earliest = None  # Oldest created_at given, in UTC
+        self.total_rows = 0
+        self.imported = 0
+        self.errors = []
+
+    def add(self, row_number: int, record):
+        self.total_rows += 1
+        if isinstance(record, Exception):
+            self.errors.append(schemas.BulkImportError(row=row_number, error=str(record)))
+            return
+
+        try:
+            row = schemas.ExpenseImportRow.model_validate(record)
+        except ValidationError as e:
+            message = "; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            )
+            self.errors.append(schemas.BulkImportError(row=row_number, error=message))
+            return
+
+        if to_cents(row.amount) <= 0:
+            self.errors.append(schemas.BulkImportError(row=row_number, error="Amount must be positive"))
+            return
+        if row.paid_by not in self.member_set:
+            self.errors.append(schemas.BulkImportError(row=row_number, error="Paying user is not a member of this group"))
+            return
+        try:
+            splits = compute_splits(to_cents(row.amount), row.split_type, self.member_ids, row.splits)
+        except SplitError as e:
+            self.errors.append(schemas.BulkImportError(row=row_number, error=str(e)))
+            return
+
+        self.pending.append((row, splits))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        expense_rows = []
+        for row, _ in self.pending:
+            expense_row = {
+                "description": row.description,
+                "amount_cents": to_cents(row.amount),
+                "group_id": self.group.id,
+                "paid_by": row.paid_by,
+                "split_type": row.split_type,
+            }
+            if row.created_at is not None:
+                # Stored as naive UTC, like every other timestamp
+                created_at = expense_row["created_at"] = snapshots.to_utc(row.created_at)
+                if self.earliest is None or created_at < self.earliest:
+                    self.earliest = created_at
+            expense_rows.append(expense_row)
+
+        # Rows with and without created_at need separate statements
+        expense_ids = [None] * len(expense_rows)
+        for has_created_at in (False, True):
+            positions = [i for i, expense_row in enumerate(expense_rows) if ("created_at" in expense_row) == has_created_at]
+            if not positions:
+                continue
+            ids = self.db.scalars(
+                insert(models.Expense).returning(models.Expense.id, sort_by_parameter_order=True),
+                [expense_rows[i] for i in positions]
+            ).all()
+            for position, expense_id in zip(positions, ids):
+                expense_ids[position] = expense_id
+
+        split_rows = []
+        for expense_id, expense_row, (row, splits) in zip(expense_ids, expense_rows, self.pending):
+            for user_id, amount_cents, percentage in splits:
+                split_rows.append({
+                    "expense_id": expense_id,
+                    "user_id": user_id,
+                    "amount_cents": amount_cents,
+                    "percentage": percentage,
+                })
+            ledger.expense_deltas(
+                row.paid_by, to_cents(row.amount), [(user_id, amount_cents) for user_id, amount_cents, _ in splits],
+                deltas=self.deltas
+            )
+            journal.record(self.db, self.group.id, journal.EXPENSE_CREATED, expense_id, journal.expense_state(
+                expense_id, row.description, to_cents(row.amount), row.paid_by, row.split_type, splits,
+                expense_row.get("created_at")
+            ))
+        self.db.execute(insert(models.ExpenseSplit), split_rows)
+
+        self.imported += len(self.pending)
+        self.pending = []
+
+    def finish(self) -> schemas.BulkImportReport:
+        self.flush()
+        ledger.apply_deltas(self.db, self.group.id, self.deltas)
+        # Backdated rows change balances the checkpoints since then recorded
+        if self.earliest is not None:
+            snapshots.invalidate(self.db, self.group.id, self.earliest)
+        self.db.commit()
+        return schemas.BulkImportReport(
+            group_id=self.group.id,
+            total_rows=self.total_rows,
+            imported=self.imported,
+            failed=len(self.errors),
+            errors=self.errors,
+        )
+
+
+def run_import(db: Session, group: models.Group, stream, import_format: schemas.ImportFormat, chunk_size: int):
+    """
+    Imports every row of the stream. Runs in a worker thread; the whole
+    import is committed once, or rolled back on a database error.
+    """
+    importer = ExpenseImporter(db, group, chunk_size)
+    try:
+        for row_number, record in iter_records(iter_lines(stream), import_format):
+            importer.add(row_number, record)
+        return importer.finish()
+    except Exception:
+        db.rollback()
+        raise
@@ -0,0 +1,271 @@
+"""
+Response cache for the read endpoints, invalidated by version counters.
+
+Every cached response depends on one or more scopes: a group, a user, or
+the group listing. Each scope has a version counter in the backend, and
+the versions are part of the cache key, so bumping a scope makes every
+response that depends on it miss. Writes call touch() inside their
+transaction, and ledger changes are picked up through ledger.on_commit;
+either way the counters are bumped only after the commit succeeds.
+Commits made on the event loop (in AsyncSession.run_sync) leave the bump
+of a network backend to deferring_bumps(), which does it in a worker
+thread before the response is sent.
+
+Responses carry an ETag of their body, and a matching If-None-Match gets
+a 304 straight from the cache.
+
+CACHE_URL selects the backend: "memory" (the default) keeps an LRU in each
+process, which is only correct with a single worker; a redis:// URL shares
+the cache and counters between workers and needs the redis package; "off"
+serves every request from the database.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import anyio
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import ledger
+import metrics
+from lru import TTLCache
+
+CACHE_URL = os.getenv("CACHE_URL", "memory")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+
+PENDING_SCOPES = "cache_pending_scopes"
+LISTING = "groups"
+
+CACHE_REQUESTS = metrics.Counter(
+    "http_cache_requests_total", "Cached endpoint requests by outcome", labelnames=("route", "result")
+)
+
+
+def group_scope(group_id: int) -> str:
+    return f"group:{group_id}"
+
+
+def user_scope(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+class MemoryBackend:
+    """
+    Per-process LRU of responses with in-memory version counters.
+    """
+    blocking = False
+
+    def __init__(self, max_entries: int, ttl: int):
+        self._entries = TTLCache(max_entries, ttl)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def versions(self, scopes):
+        with self._lock:
+            return [self._versions.get(scope, 0) for scope in scopes]
+
+    def bump(self, scopes):
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def get(self, key: str):
+        return self._entries.get(key)
+
+    def set(self, key: str, entry: dict):
+        self._entries.set(key, entry)
+
+
+class NullBackend:
+    """
+    Caches nothing; responses still get ETags.
+    """
+    blocking = False
+
+    def versions(self, scopes):
+        return [0] * len(scopes)
+
+    def bump(self, scopes):
+        pass
+
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, entry: dict):
+        pass
+
+
+class RedisBackend:
+    """
+    Responses and version counters in Redis (or anything speaking its
+    protocol), shared by every worker.
+    """
+    blocking = True
+    prefix = "splitwise:cache:"
+
+    def __init__(self, url: str, ttl: int):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_URL points at Redis but the redis package is not installed") from e
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def versions(self, scopes):
+        values = self.client.mget([f"{self.prefix}v:{scope}" for scope in scopes])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def bump(self, scopes):
+        pipeline = self.client.pipeline(transaction=False)
+        for scope in scopes:
+            pipeline.incr(f"{self.prefix}v:{scope}")
+        pipeline.execute()
+
+    def get(self, key: str):
+        value = self.client.get(f"{self.prefix}r:{key}")
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, entry: dict):
+        self.client.set(f"{self.prefix}r:{key}", json.dumps(entry), ex=self.ttl)
+
+
+def _make_backend(url: str):
+    if url == "memory":
+        return MemoryBackend(CACHE_MAX_ENTRIES, CACHE_TTL)
+    if url == "off":
+        return NullBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url, CACHE_TTL)
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+backend = _make_backend(CACHE_URL)
+
+
+# Scopes committed on the event loop, collected by deferring_bumps()
+_deferred_scopes = contextvars.ContextVar("cache_deferred_scopes", default=None)
+
+
+async def _call(method, *args):
+    # Network backends run in a worker thread to keep the event loop free
+    if backend.blocking:
+        return await anyio.to_thread.run_sync(method, *args)
+    return method(*args)
+
+
+def _bump(scopes):
+    if backend.blocking:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None  # Committed in a worker thread, which may block
+        if loop is not None:
+            deferred = _deferred_scopes.get()
+            if deferred is not None:
+                deferred.update(scopes)
+            else:
+                loop.run_in_executor(None, backend.bump, scopes)
+            return
+    backend.bump(scopes)
+
+
+async def deferring_bumps(awaitable):
+    """
+    Awaits awaitable, then bumps the versions of the scopes its commits
+    changed in a worker thread, so a network backend doesn't block the
+    event loop.
+    """
+    scopes = set()
+    token = _deferred_scopes.set(scopes)
+    try:
+        return await awaitable
+    finally:
+        _deferred_scopes.reset(token)
+        if scopes:
+            await anyio.to_thread.run_sync(backend.bump, scopes)
+
+
+def touch(db: Session, *scopes: str):
+    """
+    Marks scopes as changed by this transaction; their versions are bumped
+    after it commits.
+    """
+    db.info.setdefault(PENDING_SCOPES, set()).update(scopes)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_pending(session):
+    scopes = session.info.pop(PENDING_SCOPES, None)
+    if scopes:
+        _bump(scopes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(PENDING_SCOPES, None)
+
+
+@ledger.on_commit
+def _bump_ledger_changes(changes):
+    scopes = set()
+    for group_id, user_ids in changes.items():
+        scopes.add(group_scope(group_id))
+        scopes.update(user_scope(user_id) for user_id in user_ids)
+    _bump(scopes)
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def _to_response(request: Request, entry: dict, result: str) -> Response:
+    headers = dict(entry["headers"], ETag=entry["etag"])
+    headers["Cache-Control"] = "private, no-cache"
+    headers["X-Cache"] = result.upper()
+    if _etag_matches(request, entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+
+async def cached_response(request: Request, scopes, produce) -> Response:
+    """
+    Serves a JSON response from the cache, or from `await produce(response)`
+    on a miss. produce may set headers on the response it is given; those
+    are cached with the body.
+    """
+    route = request.scope["route"].path if "route" in request.scope else request.url.path
+    versions = await _call(backend.versions, scopes)
+    key = "|".join(
+        [request.url.path, str(sorted(request.query_params.multi_items()))]
+        + [f"{scope}={version}" for scope, version in zip(scopes, versions)]
+    )
+
+    entry = await _call(backend.get, key)
+    if entry is not None:
+        result = "not_modified" if _etag_matches(request, entry["etag"]) else "hit"
+        CACHE_REQUESTS.inc(route=route, result=result)
+        return _to_response(request, entry, "hit")
+
+    response = Response()
+    body = json.dumps(jsonable_encoder(await produce(response)), separators=(",", ":"))
+    headers = {
+        name: value for name, value in response.headers.items()
+        if name.lower() not in ("content-length", "content-type")
+    }
+    entry = {
+        "etag": '"' + hashlib.blake2b(body.encode("utf-8"), digest_size=16).hexdigest() + '"',
+        "headers": headers,
+        "body": body,
+    }
+    await _call(backend.set, key, entry)
+    CACHE_REQUESTS.inc(route=route, result="miss")
+    return _to_response(request, entry, "miss")
@@ -0,0 +1,210 @@
+"""
+Builds the data context the chatbot answers from.
+
+The question is classified with ai_service.classify_question and only the
+data its intent needs is loaded: counts come from COUNT queries, lists are
+read in id order until the token budget runs out, and balance questions
+that name a group only load that group. Formatted balance sections are
+cached per group and dropped when a commit changes that group's ledger.
+
+Counts, help and off-topic questions don't need a context at all;
+direct_answer replies to them without the model.
+"""
+import os
+from sqlalchemy import func, literal
+from sqlalchemy.orm import Session, selectinload
+import balance_engine
+import ledger
+import models
+from lru import TTLCache
+from ai_service import (
+    AI_REQUESTS, HELP_RESPONSE, OFF_TOPIC_RESPONSE, Intent, classify_question, count_response
+)
+
+# Rough context size limit; tokens are estimated at four characters each
+CHATBOT_CONTEXT_TOKENS = int(os.getenv("CHATBOT_CONTEXT_TOKENS", "1500"))
+CHARS_PER_TOKEN = 4
+# Cached group sections also expire, which bounds how long changes made by
+# other worker processes can go unseen
+SECTION_CACHE_SIZE = int(os.getenv("CHATBOT_SECTION_CACHE_SIZE", "1024"))
+SECTION_CACHE_TTL = float(os.getenv("CHATBOT_SECTION_CACHE_TTL", "60"))
+BATCH_SIZE = 100
+
+CONTEXT_HEADER = "Here is the current state of the Splitwise data:\n\n"
+
+# Intents answered by direct_answer
+DIRECT_INTENTS = {Intent.USER_COUNT, Intent.GROUP_COUNT, Intent.HELP, Intent.OFF_TOPIC}
+
+_group_sections = TTLCache(SECTION_CACHE_SIZE, SECTION_CACHE_TTL)
+
+
+@ledger.on_commit
+def invalidate_groups(changes):
+    for group_id in changes:
+        _group_sections.pop(group_id)
+
+
+class _Budget:
+    def __init__(self, tokens: int):
+        self.remaining = tokens * CHARS_PER_TOKEN
+
+    def take(self, text: str) -> bool:
+        if len(text) > self.remaining:
+            return False
+        self.remaining -= len(text)
+        return True
+
+
+def _in_batches(query, id_column, size: int = BATCH_SIZE):
+    # Keyset batches, so a list that stops early never reads the whole table
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else query.filter(id_column > last_id)
+        batch = batch_query.order_by(id_column).limit(size).all()
+        yield from batch
+        if len(batch) < size:
+            return
+        last_id = batch[-1].id
+
+
+def _listed(header: str, lines, budget: _Budget, total: int, noun: str) -> str:
+    section = header
+    budget.take(header)
+    shown = 0
+    for line in lines:
+        if not budget.take(line):
+            break
+        section += line
+        shown += 1
+    if shown < total:
+        section += f"- ... {total - shown} more {noun} not shown\n"
+    return section + "\n"
+
+
+def _users_section(db: Session, budget: _Budget, with_rows: bool) -> str:
+    total = db.query(func.count(models.User.id)).scalar()
+    header = f"**Users ({total}):**\n"
+    if not with_rows:
+        return header + "\n"
+    query = db.query(models.User.id, models.User.name, models.User.email)
+    lines = (
+        f"- ID: {user.id}, Name: {user.name}, Email: {user.email}\n"
+        for user in _in_batches(query, models.User.id)
+    )
+    return _listed(header, lines, budget, total, "users")
+
+
+def _groups_section(db: Session, budget: _Budget, with_rows: bool) -> str:
+    total = db.query(func.count(models.Group.id)).scalar()
+    header = f"**Groups ({total}):**\n"
+    if not with_rows:
+        return header + "\n"
+    query = db.query(models.Group).options(
+        selectinload(models.Group.members).joinedload(models.GroupMember.user)
+    )
+    lines = (
+        f"- Group ID: {group.id}, Name: {group.name}, "
+        f"Members: {', '.join(member.user.name for member in group.members)}\n"
+        for group in _in_batches(query, models.Group.id)
+    )
+    return _listed(header, lines, budget, total, "groups")
+
+
+def _format_group_balance(group_balance) -> str:
+    section = f"\n*Group: {group_balance.group_name}*\n"
+    for balance in group_balance.balances:
+        section += (f"  - {balance.user_name}: Owes ${balance.owes:.2f}, Is Owed ${balance.owed:.2f}, "
+                    f"Net Balance: ${balance.net_balance:.2f}\n")
+    return section
+
+
+def _group_balance_sections(db: Session, groups):
+    """
+    Yields the formatted balance section of each group, loading the ones
+    missing from the cache with one ledger query per batch.
+    """
+    batch = []
+    for group in groups:
+        batch.append(group)
+        if len(batch) == BATCH_SIZE:
+            yield from _load_sections(db, batch)
+            batch = []
+    if batch:
+        yield from _load_sections(db, batch)
+
+
+def _load_sections(db: Session, groups):
+    sections = {group.id: _group_sections.get(group.id) for group in groups}
+    missing = [group for group in groups if sections[group.id] is None]
+    if missing:
+        for group_id, group_balance in balance_engine.get_group_balances(db, missing).items():
+            sections[group_id] = _format_group_balance(group_balance)
+            _group_sections.set(group_id, sections[group_id])
+    for group in groups:
+        yield sections[group.id]
+
+
+def _like_escaped(column):
+    # The column's value with LIKE wildcards escaped, so it matches literally
+    for char in ("/", "%", "_"):
+        column = func.replace(column, char, "/" + char)
+    return column
+
+
+def _balances_section(db: Session, budget: _Budget, question: str) -> str:
+    query = db.query(models.Group.id, models.Group.name)
+    # Only the groups named in the question, when it names any
+    named = query.filter(
+        func.length(models.Group.name) >= 3,
+        literal(question.lower()).contains(_like_escaped(func.lower(models.Group.name)), escape="/")
+    )
+    if named.first() is not None:
+        query = named
+    total = query.count()
+
+    header = "**Expenses & Balances:**\n"
+    return _listed(header, _group_balance_sections(db, _in_batches(query, models.Group.id)), budget, total, "groups")
+
+
+def direct_answer(db: Session, intent: Intent) -> str:
+    """
+    Answers one of DIRECT_INTENTS from a COUNT query or a canned reply.
+    """
+    AI_REQUESTS.inc(result="direct")
+    if intent == Intent.USER_COUNT:
+        return count_response("users", db.query(func.count(models.User.id)).scalar())
+    if intent == Intent.GROUP_COUNT:
+        return count_response("groups", db.query(func.count(models.Group.id)).scalar())
+    if intent == Intent.HELP:
+        return HELP_RESPONSE
+    return OFF_TOPIC_RESPONSE
+
+
+def build_context(db: Session, question: str, intent: Intent = None) -> str:
+    """
+    Returns the context for a question, loading only what its intent needs.
+    """
+    if intent is None:
+        intent = classify_question(question)
+    if intent in (Intent.OFF_TOPIC, Intent.HELP):
+        return ""
+
+    if intent == Intent.USER_COUNT:
+        sections = [_users_section(db, _Budget(CHATBOT_CONTEXT_TOKENS), with_rows=False)]
+    elif intent == Intent.GROUP_COUNT:
+        sections = [_groups_section(db, _Budget(CHATBOT_CONTEXT_TOKENS), with_rows=False)]
+    elif intent == Intent.LIST_USERS:
+        sections = [_users_section(db, _Budget(CHATBOT_CONTEXT_TOKENS), with_rows=True)]
+    elif intent == Intent.LIST_GROUPS:
+        sections = [_groups_section(db, _Budget(CHATBOT_CONTEXT_TOKENS), with_rows=True)]
+    elif intent == Intent.BALANCES:
+        sections = [_balances_section(db, _Budget(CHATBOT_CONTEXT_TOKENS), question)]
+    else:
+        # Open questions get a share of the budget for each kind of data
+        share = CHATBOT_CONTEXT_TOKENS // 3
+        sections = [
+            _users_section(db, _Budget(share), with_rows=True),
+            _groups_section(db, _Budget(share), with_rows=True),
+            _balances_section(db, _Budget(share), question),
+        ]
+    return CONTEXT_HEADER + "".join(sections)
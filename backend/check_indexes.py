@@ -0,0 +1,188 @@
+"""
+Checks with EXPLAIN that the hot queries use their indexes.
+
+Each check compiles one of the queries the balance, listing and membership
+paths run, asks the database for its plan, and passes if the plan uses one
+of the indexes the query was given. With --seed, a synthetic dataset is
+inserted and analyzed first, inside a transaction that is rolled back at
+the end, so the check can run against an empty database without leaving
+anything behind. PostgreSQL and SQLite plans are supported.
+
+Usage (from backend/):
+    python check_indexes.py [--seed] [--groups N] [--verbose]
+"""
+import argparse
+import random
+from sqlalchemy import case, func, insert, select, text
+from database import create_tables, engine
+import models
+
+SEED_BASE_ID = 1_000_000_000
+
+
+def checks(group_id: int, user_id: int, expense_ids):
+    """
+    Returns (name, statement, indexes) for each hot query, where the plan
+    should use any one of indexes.
+    """
+    return [
+        (
+            "split sums per member",
+            select(
+                models.Expense.group_id, models.ExpenseSplit.user_id, func.sum(models.ExpenseSplit.amount_cents),
+                func.sum(case(
+                    (models.Expense.paid_by == models.ExpenseSplit.user_id, models.ExpenseSplit.amount_cents), else_=0
+                ))
+            ).join(models.Expense, models.ExpenseSplit.expense_id == models.Expense.id).where(
+                models.Expense.group_id.in_([group_id])
+            ).group_by(models.Expense.group_id, models.ExpenseSplit.user_id),
+            ["ix_expense_splits_expense_user_amount"],
+        ),
+        (
+            "paid sums per member",
+            select(models.Expense.group_id, models.Expense.paid_by, func.sum(models.Expense.amount_cents)).where(
+                models.Expense.group_id.in_([group_id])
+            ).group_by(models.Expense.group_id, models.Expense.paid_by),
+            ["ix_expenses_group_payer_amount"],
+        ),
+        (
+            "settlements made per member",
+            select(models.Settlement.group_id, models.Settlement.payer_id, func.sum(models.Settlement.amount_cents)).where(
+                models.Settlement.group_id.in_([group_id])
+            ).group_by(models.Settlement.group_id, models.Settlement.payer_id),
+            ["ix_settlements_group_payer_amount"],
+        ),
+        (
+            "settlements received per member",
+            select(models.Settlement.group_id, models.Settlement.payee_id, func.sum(models.Settlement.amount_cents)).where(
+                models.Settlement.group_id.in_([group_id])
+            ).group_by(models.Settlement.group_id, models.Settlement.payee_id),
+            ["ix_settlements_group_payee_amount"],
+        ),
+        (
+            "group members",
+            select(models.GroupMember.user_id).where(models.GroupMember.group_id == group_id),
+            # SQLite names the index behind a unique constraint itself
+            ["uq_group_members_group_user", "sqlite_autoindex_group_members"],
+        ),
+        (
+            "groups of a user",
+            select(models.GroupMember.group_id).where(models.GroupMember.user_id == user_id),
+            ["ix_group_members_user_group"],
+        ),
+        (
+            "expense page",
+            select(models.Expense.id).where(models.Expense.group_id == group_id).order_by(
+                models.Expense.created_at.desc(), models.Expense.id.desc()
+            ).limit(100),
+            ["ix_expenses_group_created"],
+        ),
+        (
+            "splits of expenses",
+            select(models.ExpenseSplit.id).where(models.ExpenseSplit.expense_id.in_(expense_ids)),
+            ["ix_expense_splits_expense_user_amount"],
+        ),
+        (
+            "expenses a user takes part in",
+            select(models.ExpenseSplit.expense_id).where(models.ExpenseSplit.user_id == user_id),
+            ["ix_expense_splits_user_expense"],
+        ),
+    ]
+
+
+def seed(connection, groups: int, members: int = 8, expenses: int = 200, settlements: int = 20):
+    """
+    Inserts a synthetic dataset with ids well above any real ones, and
+    refreshes the planner statistics.
+    """
+    rng = random.Random(17)
+    users = groups * members
+    base = SEED_BASE_ID
+    connection.execute(insert(models.User), [
+        {"id": base + i, "name": f"user {i}", "email": f"check-{i}@example.com"} for i in range(users)
+    ])
+    connection.execute(insert(models.Group), [{"id": base + g, "name": f"group {g}"} for g in range(groups)])
+    connection.execute(insert(models.GroupMember), [
+        {"group_id": base + g, "user_id": base + g * members + m} for g in range(groups) for m in range(members)
+    ])
+
+    expense_rows, split_rows, settlement_rows = [], [], []
+    for g in range(groups):
+        member_ids = [base + g * members + m for m in range(members)]
+        for e in range(expenses):
+            expense_id = base + g * expenses + e
+            expense_rows.append({
+                "id": expense_id, "description": "check", "amount_cents": members * 100,
+                "group_id": base + g, "paid_by": rng.choice(member_ids), "split_type": models.SplitType.EQUAL,
+            })
+            split_rows.extend({"expense_id": expense_id, "user_id": user_id, "amount_cents": 100} for user_id in member_ids)
+        for _ in range(settlements):
+            payer, payee = rng.sample(member_ids, 2)
+            settlement_rows.append({"group_id": base + g, "payer_id": payer, "payee_id": payee, "amount_cents": 100})
+    connection.execute(insert(models.Expense), expense_rows)
+    connection.execute(insert(models.ExpenseSplit), split_rows)
+    connection.execute(insert(models.Settlement), settlement_rows)
+    connection.execute(text("ANALYZE"))
+
+
+def explain(connection, statement) -> str:
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "sqlite":
+        return "\n".join(row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    return "\n".join(row[0] for row in connection.execute(text("EXPLAIN " + sql)))
+
+
+def pick_target(connection, group_id=None):
+    """
+    Returns a group, one of its members and a few of its expenses to query.
+    """
+    query = select(models.GroupMember.group_id, models.GroupMember.user_id)
+    if group_id is not None:
+        query = query.where(models.GroupMember.group_id == group_id)
+    row = connection.execute(query.order_by(models.GroupMember.id).limit(1)).first()
+    if row is None:
+        raise SystemExit("No group with members found; seed the database or pass --seed")
+    expense_ids = connection.scalars(
+        select(models.Expense.id).where(models.Expense.group_id == row.group_id).limit(3)
+    ).all()
+    return row.group_id, row.user_id, expense_ids or [0]
+
+
+def run_checks(connection, verbose: bool, group_id=None) -> int:
+    group_id, user_id, expense_ids = pick_target(connection, group_id)
+    failures = 0
+    for name, statement, indexes in checks(group_id, user_id, expense_ids):
+        plan = explain(connection, statement)
+        used = next((index for index in indexes if index in plan), None)
+        if used is None:
+            failures += 1
+        print(f"{'ok' if used else 'FAIL':>4}  {name}: {used or 'expected ' + ' or '.join(indexes)}")
+        if verbose or used is None:
+            print("      " + plan.replace("\n", "\n      "))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the hot queries use their indexes.")
+    parser.add_argument("--seed", action="store_true", help="Insert a throwaway dataset first (rolled back)")
+    parser.add_argument("--groups", type=int, default=200, help="Groups to seed")
+    parser.add_argument("--verbose", action="store_true", help="Print every plan")
+    args = parser.parse_args()
+
+    create_tables()
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            group_id = None
+            if args.seed:
+                seed(connection, args.groups)
+                group_id = SEED_BASE_ID
+            failures = run_checks(connection, args.verbose, group_id)
+        finally:
+            transaction.rollback()
+    print(f"{failures} of the queries did not use their indexes" if failures else "All queries use their indexes")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+"""
+Per-request SQL instrumentation.
+
+instrument_engine() hooks an engine's cursor events so every statement is
+timed. Statements run while a request is being handled are added to that
+request's RequestStats, which RequestStatsMiddleware creates and keeps in
+a context variable (it follows the request into the threadpool and into
+AsyncSession.run_sync). When the response starts, the middleware adds a
+Server-Timing header with the query count, total database time and the
+slowest statement's time, and once it finishes it logs a JSON summary and
+records per-route Prometheus metrics.
+
+Statements slower than SLOW_QUERY_MS are logged with their normalized SQL
+(literals and parameters replaced by ?, IN lists collapsed) whether or not
+they ran inside a request.
+"""
+import json
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+import metrics
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))  # Negative disables the slow query log
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+MAX_LOGGED_SQL = 1000
+
+request_log = logging.getLogger("splitwise.requests")
+slow_query_log = logging.getLogger("splitwise.slow_queries")
+
+HTTP_REQUESTS = metrics.Counter(
+    "http_requests_total", "HTTP requests by route, method and status", labelnames=("route", "method", "status")
+)
+HTTP_DURATION = metrics.Histogram(
+    "http_request_duration_seconds", "Time to handle a request", labelnames=("route", "method")
+)
+REQUEST_QUERIES = metrics.Histogram(
+    "http_request_db_queries", "SQL statements run per request", labelnames=("route",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 500, 1000),
+)
+REQUEST_DB_SECONDS = metrics.Histogram(
+    "http_request_db_seconds", "Time spent in SQL statements per request", labelnames=("route",)
+)
+SLOW_QUERIES = metrics.Counter(
+    "db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", labelnames=("route",)
+)
+
+_current = ContextVar("request_stats", default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """
+    Reduces a statement to its shape, so the same query with different
+    values normalizes to the same text.
+    """
+    sql = _STRING.sub("?", statement)
+    sql = _PARAMETER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(?)", sql)
+    sql = _SPACE.sub(" ", sql).strip()
+    if len(sql) > MAX_LOGGED_SQL:
+        sql = sql[:MAX_LOGGED_SQL] + "..."
+    return sql
+
+
+class RequestStats:
+    """
+    SQL statements run while handling one request.
+    """
+    __slots__ = ("scope", "queries", "db_seconds", "slowest_seconds", "slowest_statement")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    @property
+    def route(self) -> str:
+        return _route_label(self.scope)
+
+    def record(self, statement: str, seconds: float):
+        self.queries += 1
+        self.db_seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def server_timing(self, total_seconds: float) -> str:
+        noun = "query" if self.queries == 1 else "queries"
+        return (
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.queries} {noun}", '
+            f"db-slowest;dur={self.slowest_seconds * 1000:.2f}, "
+            f"app;dur={total_seconds * 1000:.2f}"
+        )
+
+
+def current_stats():
+    """
+    Returns the RequestStats of the request being handled, if any.
+    """
+    return _current.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+
+    if 0 <= SLOW_QUERY_MS <= seconds * 1000:
+        route = stats.route if stats is not None else "none"
+        SLOW_QUERIES.inc(route=route)
+        slow_query_log.warning(json.dumps({
+            "event": "slow_query",
+            "route": route,
+            "duration_ms": round(seconds * 1000, 2),
+            "sql": normalize_sql(statement),
+        }))
+
+
+def _handle_error(exception_context):
+    # Failed statements never reach after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    """
+    Times every statement run on a sync Engine (for an AsyncEngine, pass
+    its sync_engine).
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    # Unmatched paths share a label so scanners can't blow up the series count
+    return route.path if route is not None else "unmatched"
+
+
+class RequestStatsMiddleware:
+    """
+    ASGI middleware that collects RequestStats for each HTTP request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    timing = stats.server_timing(time.perf_counter() - start)
+                    headers = list(message.get("headers", [])) + [(b"server-timing", timing.encode("latin-1"))]
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            self._finish(scope, stats, status, time.perf_counter() - start)
+
+    def _finish(self, scope, stats: RequestStats, status: int, seconds: float):
+        route = stats.route
+        method = scope["method"]
+        HTTP_REQUESTS.inc(route=route, method=method, status=status)
+        HTTP_DURATION.observe(seconds, route=route, method=method)
+        REQUEST_QUERIES.observe(stats.queries, route=route)
+        REQUEST_DB_SECONDS.observe(stats.db_seconds, route=route)
+
+        if request_log.isEnabledFor(logging.INFO):
+            request_log.info(json.dumps({
+                "event": "request",
+                "method": method,
+                "route": route,
+                "path": scope["path"],
+                "status": status,
+                "duration_ms": round(seconds * 1000, 2),
+                "queries": stats.queries,
+                "db_ms": round(stats.db_seconds * 1000, 2),
+                "slowest_ms": round(stats.slowest_seconds * 1000, 2),
+                "slowest_sql": normalize_sql(stats.slowest_statement) if stats.slowest_statement else None,
+            }))
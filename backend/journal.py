@@ -0,0 +1,139 @@
+"""
+Append-only journal of ledger events.
+
+The write endpoints describe what they change as typed events, recorded
+with record() in the same transaction as the rows themselves. The events
+of a transaction are inserted with one statement just before it commits,
+so a write that rolls back leaves none behind. An event's id is its offset
+in the journal. Consumers tail it with events_after() (or
+GET /groups/{group_id}/events?after=) and remember the last offset they
+saw, and projections.py builds read models from it the same way.
+
+On PostgreSQL the append takes a transaction-level advisory lock, so
+offsets become visible in commit order and a consumer that has read up to
+an offset can't miss a smaller one committed later. SQLite serializes
+writers already.
+
+Payloads:
+    ExpenseCreated, ExpenseDeleted         expense state (see expense_state)
+    ExpenseUpdated                         {"before": state, "after": state}
+    SettlementRecorded, SettlementDeleted  settlement state (see settlement_state)
+    GroupCreated                           {"name", "description", "member_ids"}
+    GroupDeleted                           {}
+    GroupArchived                          {}
+    HistoryArchived                        {"before", "expense_count", "settlement_count"}
+    ExpensesPurged                         {"before", "count", "amount_cents", "deltas"}
+    MemberRemoved                          {"user_id"}
+
+ExpensesPurged stands for all of a group's expenses created before
+"before", removed at once; "deltas" holds the resulting ledger changes as
+{user_id: {field: delta}}. HistoryArchived moves a group's expenses and
+settlements dated up to "before" to the archive without changing any
+balance (see archive.py); GroupArchived follows it when the whole group is
+archived and closed to new writes.
+
+ExpenseCreated and SettlementRecorded states have no created_at or
+settled_at when the row got the database's default; it is then the
+event's own created_at.
+"""
+from sqlalchemy import event, insert, text
+from sqlalchemy.orm import Session
+import models
+
+EXPENSE_CREATED = "ExpenseCreated"
+EXPENSE_UPDATED = "ExpenseUpdated"
+EXPENSE_DELETED = "ExpenseDeleted"
+SETTLEMENT_RECORDED = "SettlementRecorded"
+SETTLEMENT_DELETED = "SettlementDeleted"
+GROUP_CREATED = "GroupCreated"
+GROUP_DELETED = "GroupDeleted"
+GROUP_ARCHIVED = "GroupArchived"
+HISTORY_ARCHIVED = "HistoryArchived"
+EXPENSES_PURGED = "ExpensesPurged"
+MEMBER_REMOVED = "MemberRemoved"
+
+PENDING_EVENTS = "journal_pending_events"
+ADVISORY_LOCK_KEY = 0x5e77_1e00  # Any constant shared by every writer
+
+
+def _timestamp(moment):
+    return moment.isoformat() if moment is not None else None
+
+
+def expense_state(expense_id: int, description: str, amount_cents: int, paid_by: int, split_type, splits,
+                  created_at=None) -> dict:
+    """
+    Builds the payload describing an expense. splits is an iterable of
+    (user_id, amount_cents, percentage).
+    """
+    return {
+        "id": expense_id,
+        "description": description,
+        "amount_cents": amount_cents,
+        "paid_by": paid_by,
+        "split_type": getattr(split_type, "value", split_type),
+        "created_at": _timestamp(created_at),
+        "splits": [[user_id, share, percentage] for user_id, share, percentage in splits],
+    }
+
+
+def expense_state_of(expense: models.Expense) -> dict:
+    """
+    Builds the payload of a loaded expense from its current attributes and splits.
+    """
+    return expense_state(
+        expense.id, expense.description, expense.amount_cents, expense.paid_by, expense.split_type,
+        [(split.user_id, split.amount_cents, split.percentage) for split in expense.splits],
+        expense.created_at,
+    )
+
+
+def settlement_state(settlement: models.Settlement, settled_at=None) -> dict:
+    """
+    Builds the payload describing a settlement; settled_at is only read
+    from it when given, since a new settlement's is set by the database.
+    """
+    return {
+        "id": settlement.id,
+        "payer_id": settlement.payer_id,
+        "payee_id": settlement.payee_id,
+        "amount_cents": settlement.amount_cents,
+        "description": settlement.description,
+        "settled_at": _timestamp(settled_at),
+    }
+
+
+def record(db: Session, group_id: int, event_type: str, entity_id, payload: dict):
+    """
+    Queues an event; it is appended when the transaction commits.
+    """
+    db.info.setdefault(PENDING_EVENTS, []).append({
+        "group_id": group_id,
+        "type": event_type,
+        "entity_id": entity_id,
+        "payload": payload,
+    })
+
+
+def events_after(db: Session, group_id: int, after: int = 0, limit: int = 100):
+    """
+    Returns up to limit events of a group with offsets above after, oldest first.
+    """
+    return db.query(models.LedgerEvent).filter(
+        models.LedgerEvent.group_id == group_id, models.LedgerEvent.id > after
+    ).order_by(models.LedgerEvent.id).limit(limit).all()
+
+
+@event.listens_for(Session, "before_commit")
+def _append_pending(session):
+    rows = session.info.pop(PENDING_EVENTS, None)
+    if not rows:
+        return
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+    session.execute(insert(models.LedgerEvent), rows)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(PENDING_EVENTS, None)
@@ -0,0 +1,249 @@
+"""
+Materialized per-member balance ledger.
+
+The write endpoints call record_expense/record_settlement inside their own
+transaction so group_member_balances always mirrors the raw expense and
+settlement rows. rebuild() and verify() recompute the ledger from those rows.
+
+Every group whose balances change is remembered on the session together
+with the affected users, and the hooks registered with on_commit are called
+with {group_id: user_ids} once the transaction commits, so derived caches
+can drop their copies.
+
+Usage:
+    python ledger.py verify [--group-id ID]
+    python ledger.py rebuild [--group-id ID]
+"""
+import argparse
+from collections import defaultdict
+from sqlalchemy import case, event, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+import models
+from balance_engine import MemberTotals, compute_member_totals
+from money import from_cents
+
+LEDGER_FIELDS = MemberTotals.__slots__
+CHANGED_GROUPS = "ledger_changed_groups"
+
+# Insert constructs with ON CONFLICT support, by dialect
+_DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+_commit_hooks = []
+
+
+def on_commit(hook):
+    """
+    Registers hook(changes) to run after a commit that changed balances,
+    where changes is {group_id: set of affected user ids}. Usable as a
+    decorator.
+    """
+    _commit_hooks.append(hook)
+    return hook
+
+
+def mark_changed(db: Session, group_id: int, user_ids=()):
+    """
+    Records that a group's balances or members change in this transaction,
+    for the given users.
+    """
+    db.info.setdefault(CHANGED_GROUPS, defaultdict(set))[group_id].update(user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _run_commit_hooks(session):
+    changes = session.info.pop(CHANGED_GROUPS, None)
+    if changes:
+        for hook in _commit_hooks:
+            hook(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(session):
+    session.info.pop(CHANGED_GROUPS, None)
+
+
+def apply_deltas(db: Session, group_id: int, deltas):
+    """
+    Adds the given {user_id: {field: delta}} to the ledger rows of a group,
+    creating missing rows, with one INSERT ... ON CONFLICT DO UPDATE. Two
+    transactions adding a member's first row can't both insert it.
+    """
+    mark_changed(db, group_id, deltas.keys())
+    rows = []
+    for user_id, fields in deltas.items():
+        if any(fields.values()):
+            rows.append({"group_id": group_id, "user_id": user_id, **{name: fields.get(name, 0) for name in LEDGER_FIELDS}})
+    if not rows:
+        return
+    table = models.GroupMemberBalance.__table__
+    statement = _DIALECT_INSERTS[db.get_bind().dialect.name](table)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.group_id, table.c.user_id],
+        set_={
+            **{name: table.c[name] + statement.excluded[name] for name in LEDGER_FIELDS},
+            "updated_at": func.now(),
+        },
+    ), rows)
+
+
+def expense_deltas(paid_by: int, amount_cents: int, splits, sign: int = 1, deltas=None):
+    """
+    Accumulates the ledger changes of one expense into deltas
+    ({user_id: {field: delta}}), creating it if needed. splits is an
+    iterable of (user_id, amount_cents) pairs.
+    """
+    if deltas is None:
+        deltas = defaultdict(dict)
+    payer = deltas[paid_by]
+    payer["paid"] = payer.get("paid", 0) + sign * amount_cents
+    for user_id, split_cents in splits:
+        member = deltas[user_id]
+        member["owed"] = member.get("owed", 0) + sign * split_cents
+        if user_id == paid_by:
+            member["own_share"] = member.get("own_share", 0) + sign * split_cents
+    return deltas
+
+
+def bulk_expense_deltas(db: Session, group_id: int, conditions, sign: int = 1):
+    """
+    Sums the ledger changes of every expense of a group that matches the
+    given filter conditions with two grouped queries, without loading the
+    expenses. Returns (deltas, number of expenses, their total in cents).
+    """
+    expense, split = models.Expense, models.ExpenseSplit
+    deltas = defaultdict(dict)
+    count = total = 0
+    for paid_by, paid, expenses in db.query(
+        expense.paid_by, func.sum(expense.amount_cents), func.count(expense.id)
+    ).filter(expense.group_id == group_id, *conditions).group_by(expense.paid_by):
+        deltas[paid_by]["paid"] = sign * int(paid)
+        count += expenses
+        total += int(paid)
+    for user_id, owed, own_share in db.query(
+        split.user_id,
+        func.sum(split.amount_cents),
+        func.sum(case((expense.paid_by == split.user_id, split.amount_cents), else_=0))
+    ).join(expense, split.expense_id == expense.id).filter(
+        expense.group_id == group_id, *conditions
+    ).group_by(split.user_id):
+        deltas[user_id]["owed"] = sign * int(owed)
+        deltas[user_id]["own_share"] = sign * int(own_share)
+    return deltas, count, total
+
+
+def record_expense(db: Session, expense: models.Expense, splits, sign: int = 1):
+    """
+    Applies an expense and its splits to the ledger. Use sign=-1 to reverse it
+    before the expense is changed or deleted.
+    """
+    deltas = expense_deltas(
+        expense.paid_by, expense.amount_cents, [(split.user_id, split.amount_cents) for split in splits], sign
+    )
+    apply_deltas(db, expense.group_id, deltas)
+
+
+def record_settlement(db: Session, settlement: models.Settlement, sign: int = 1):
+    """
+    Applies a settlement to the ledger. Use sign=-1 to reverse it.
+    """
+    record_settlements(db, settlement.group_id, [settlement], sign)
+
+
+def record_settlements(db: Session, group_id: int, settlements, sign: int = 1):
+    """
+    Applies several settlements of one group with a single update per member.
+    """
+    deltas = defaultdict(lambda: {"settlements_made": 0, "settlements_received": 0})
+    for settlement in settlements:
+        deltas[settlement.payer_id]["settlements_made"] += sign * settlement.amount_cents
+        deltas[settlement.payee_id]["settlements_received"] += sign * settlement.amount_cents
+    apply_deltas(db, group_id, deltas)
+
+
+def _group_ids(db: Session, group_ids=None):
+    if group_ids is not None:
+        return list(group_ids)
+    return [group_id for (group_id,) in db.query(models.Group.id).all()]
+
+
+def verify(db: Session, group_ids=None):
+    """
+    Recomputes totals from the raw rows and returns a list of drift entries
+    (group_id, user_id, field, ledger value, expected value).
+    """
+    group_ids = _group_ids(db, group_ids)
+    expected = compute_member_totals(db, group_ids)
+    stored = defaultdict(dict)
+    for row in db.query(models.GroupMemberBalance).filter(
+        models.GroupMemberBalance.group_id.in_(group_ids)
+    ).all():
+        stored[row.group_id][row.user_id] = row
+
+    drift = []
+    for group_id in group_ids:
+        user_ids = set(expected[group_id]) | set(stored[group_id])
+        for user_id in sorted(user_ids):
+            want = expected[group_id].get(user_id) or MemberTotals()
+            have = stored[group_id].get(user_id) or MemberTotals()
+            for name in LEDGER_FIELDS:
+                if getattr(have, name) != getattr(want, name):
+                    drift.append((group_id, user_id, name, getattr(have, name), getattr(want, name)))
+    return drift
+
+
+def rebuild(db: Session, group_ids=None):
+    """
+    Replaces the ledger rows of the given groups (all groups by default) with
+    totals recomputed from the raw rows. The caller commits.
+    """
+    group_ids = _group_ids(db, group_ids)
+    totals = compute_member_totals(db, group_ids)
+    for group_id, user_id in db.query(models.GroupMemberBalance.group_id, models.GroupMemberBalance.user_id).filter(
+        models.GroupMemberBalance.group_id.in_(group_ids)
+    ).all():
+        mark_changed(db, group_id, [user_id])
+    db.query(models.GroupMemberBalance).filter(
+        models.GroupMemberBalance.group_id.in_(group_ids)
+    ).delete(synchronize_session=False)
+    for group_id in group_ids:
+        mark_changed(db, group_id, totals[group_id].keys())
+        for user_id, member in totals[group_id].items():
+            db.add(models.GroupMemberBalance(
+                group_id=group_id,
+                user_id=user_id,
+                **{name: getattr(member, name) for name in LEDGER_FIELDS}
+            ))
+    db.flush()
+    return len(group_ids)
+
+
+def main():
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Verify or rebuild the group balance ledger.")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--group-id", type=int, action="append", dest="group_ids",
+                        help="Limit to this group (may be repeated)")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            count = rebuild(db, args.group_ids)
+            db.commit()
+            print(f"Rebuilt ledger for {count} group(s)")
+            return 0
+
+        drift = verify(db, args.group_ids)
+        for group_id, user_id, name, have, want in drift:
+            print(f"group {group_id} user {user_id}: {name} is {from_cents(have):.2f}, expected {from_cents(want):.2f}")
+        print(f"{len(drift)} drifted value(s)")
+        return 1 if drift else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
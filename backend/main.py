@@ -1,12 +1,35 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
-from database import get_db, create_tables
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import and_, delete, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
+from typing import List, Optional, Union
+from contextlib import contextmanager
+from datetime import datetime
+import os
+from database import async_engine, get_async_db, get_db, create_tables
 import models
 import schemas
 from collections import defaultdict
-from ai_service import get_ai_response
+import ai_service
+import chat_context
+import balance_engine
+import journal
+import ledger
+import settle_plan
+import pagination
+import bulk_import
+import archive
+import cache
+import membership
+import snapshots
+import streams
+from money import from_cents, to_cents
+from split_math import SplitError, compute_splits
+import metrics
+import instrumentation
 
 app = FastAPI(title="Splitwise Clone API", version="1.0.0")
 
@@ -17,12 +40,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag", "Server-Timing"],
 )
+# Outermost, so it times everything including CORS handling
+app.add_middleware(instrumentation.RequestStatsMiddleware)
+
+# Bring the schema up to date on startup; deployments that run
+# `alembic upgrade head` before starting workers can turn this off
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
 
-# Create tables on startup
 @app.on_event("startup")
 async def startup_event():
-    create_tables()
+    if MIGRATE_ON_STARTUP:
+        create_tables()
+    streams.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await streams.stop()
+    await async_engine.dispose()
+    await ai_service.close()
+
+# Metrics endpoint (Prometheus text format)
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+async def run_in_session(db: AsyncSession, fn, *args, schema=None):
+    """
+    Runs sync endpoint logic on an async session without blocking the event
+    loop. ORM results are converted to the response schema inside the call,
+    since lazy loads can't run once it returns.
+    """
+    def call(session: Session):
+        result = fn(session, *args)
+        if schema is None:
+            return result
+        if isinstance(result, list):
+            return [schema.model_validate(item) for item in result]
+        return schema.model_validate(result)
+
+    return await cache.deferring_bumps(db.run_sync(call))
 
 # User endpoints
 @app.post("/users/", response_model=schemas.User)
@@ -37,6 +95,39 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
 def get_users(db: Session = Depends(get_db)):
     return db.query(models.User).all()
 
+# Batch reads take ?ids=1,2,3 or repeated ?ids=1&ids=2
+BATCH_MAX_IDS = 100
+
+def _batch_ids(values: Optional[List[str]]) -> List[int]:
+    ids = []
+    for value in values or []:
+        for part in value.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                ids.append(int(part))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid id: {part}")
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No ids given")
+    if len(ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IDS} ids per request")
+    return ids
+
+def _missing(ids, found, detail: str) -> dict:
+    return {item_id: schemas.BatchError(status_code=404, detail=detail) for item_id in ids if item_id not in found}
+
+@app.get("/users/batch", response_model=schemas.UserBatch)
+def get_users_batch(ids: Optional[List[str]] = Query(None, description="User ids, comma-separated or repeated"), db: Session = Depends(get_db)):
+    user_ids = _batch_ids(ids)
+    users = {user.id: user for user in db.query(models.User).filter(models.User.id.in_(user_ids)).all()}
+    return schemas.UserBatch(
+        results={user_id: users[user_id] for user_id in user_ids if user_id in users},
+        errors=_missing(user_ids, users, "User not found")
+    )
+
 @app.get("/users/{user_id}", response_model=schemas.User)
 def get_user(user_id: int, db: Session = Depends(get_db)):
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -51,117 +142,143 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Check if user has any outstanding balances or is part of groups with expenses
-    memberships = db.query(models.GroupMember).filter(models.GroupMember.user_id == user_id).all()
-    
-    for membership in memberships:
-        # Check if there are any expenses in this group
-        expenses = db.query(models.Expense).filter(models.Expense.group_id == membership.group_id).count()
-        if expenses > 0:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Cannot delete user. User is part of group '{membership.group.name}' which has expenses. Please settle all expenses first."
-            )
+    # Check with one query if the user is part of a group with expenses, or
+    # made or received settlements in one, which would still name them
+    group_has_expenses = db.query(models.Expense.id).filter(models.Expense.group_id == models.GroupMember.group_id).exists()
+    group_has_settlements = db.query(models.Settlement.id).filter(
+        models.Settlement.group_id == models.GroupMember.group_id,
+        or_(models.Settlement.payer_id == user_id, models.Settlement.payee_id == user_id)
+    ).exists()
+    group_has_archive = db.query(models.GroupOpeningBalance.user_id).filter(
+        models.GroupOpeningBalance.group_id == models.GroupMember.group_id
+    ).exists()
+    blocking = db.query(models.Group.name, or_(group_has_expenses, group_has_archive)).join(
+        models.GroupMember, models.GroupMember.group_id == models.Group.id
+    ).filter(
+        models.GroupMember.user_id == user_id, or_(group_has_expenses, group_has_settlements, group_has_archive)
+    ).first()
+    if blocking:
+        group_name, has_expenses = blocking
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Cannot delete user. User is part of group '{group_name}' which has {'expenses' if has_expenses else 'settlements'}. Please settle all expenses first."
+        )
     
-    # Delete user's group memberships first
-    db.query(models.GroupMember).filter(models.GroupMember.user_id == user_id).delete()
+    group_ids = [group_id for (group_id,) in db.query(models.GroupMember.group_id).filter(models.GroupMember.user_id == user_id).all()]
+    for group_id in group_ids:
+        ledger.mark_changed(db, group_id, [user_id])
+        membership.changed(db, group_id)
+        journal.record(db, group_id, journal.MEMBER_REMOVED, user_id, {"user_id": user_id})
+    cache.touch(db, cache.LISTING, cache.user_scope(user_id))
     
-    # Delete the user
-    db.delete(user)
+    # Delete the user; memberships, ledger rows and snapshots go with it (ON DELETE CASCADE)
+    name = user.name
+    db.execute(delete(models.User).where(models.User.id == user_id))
     db.commit()
     
-    return {"message": f"User '{user.name}' deleted successfully"}
+    return {"message": f"User '{name}' deleted successfully"}
 
 # Group endpoints
+def _group_response(group: models.Group, members=None) -> dict:
+    # Build the response from already-loaded data; members=None means the
+    # caller chose not to load them
+    return {
+        "id": group.id,
+        "name": group.name,
+        "description": group.description,
+        "created_at": group.created_at,
+        "archived_at": group.archived_at,
+        "members": members if members is not None else []
+    }
+
+def _with_members():
+    return selectinload(models.Group.members).joinedload(models.GroupMember.user)
+
+def _with_splits(expense=models.Expense, split=models.ExpenseSplit):
+    return (
+        joinedload(expense.paid_by_user),
+        selectinload(expense.splits).joinedload(split.user)
+    )
+
+def _load_expense(db: Session, expense_id: int):
+    # Reloads a written expense for the response with its splits and users
+    return db.query(models.Expense).options(*_with_splits()).filter(models.Expense.id == expense_id).one()
+
 @app.post("/groups/", response_model=schemas.Group)
 def create_group(group: schemas.GroupCreate, db: Session = Depends(get_db)):
-    # Create the group
-    db_group = models.Group(name=group.name, description=group.description)
-    db.add(db_group)
-    db.commit()
-    db.refresh(db_group)
-    
-    # Add members to the group
+    # Check that every user exists with a single query
+    users = {user.id: user for user in db.query(models.User).filter(models.User.id.in_(group.user_ids)).all()}
     for user_id in group.user_ids:
-        # Check if user exists
-        user = db.query(models.User).filter(models.User.id == user_id).first()
-        if not user:
+        if user_id not in users:
             raise HTTPException(status_code=404, detail=f"User with id {user_id} not found")
-        
-        # Create group membership
-        membership = models.GroupMember(group_id=db_group.id, user_id=user_id)
-        db.add(membership)
     
-    db.commit()
+    # Create the group and its memberships together
+    db_group = models.Group(name=group.name, description=group.description)
+    db.add(db_group)
+    db.flush()
     
-    # Get group with proper member data
-    group_with_members = db.query(models.Group).filter(models.Group.id == db_group.id).first()
-    
-    # Manually construct the response with user data
-    members = []
-    for membership in group_with_members.members:
-        members.append(membership.user)
-    
-    # Create response object manually
-    response_data = {
-        "id": group_with_members.id,
-        "name": group_with_members.name,
-        "description": group_with_members.description,
-        "created_at": group_with_members.created_at,
-        "members": members
-    }
+    member_ids = list(dict.fromkeys(group.user_ids))
+    db.add_all([models.GroupMember(group_id=db_group.id, user_id=user_id) for user_id in member_ids])
+    ledger.mark_changed(db, db_group.id, member_ids)
+    membership.changed(db, db_group.id)
+    cache.touch(db, cache.LISTING)
+    journal.record(db, db_group.id, journal.GROUP_CREATED, db_group.id, {
+        "name": db_group.name, "description": db_group.description, "member_ids": member_ids
+    })
+    db.commit()
+    db.refresh(db_group)
     
-    return response_data
+    return _group_response(db_group, [users[user_id] for user_id in member_ids])
 
-@app.get("/groups/{group_id}", response_model=schemas.GroupDetails)
-def get_group(group_id: int, db: Session = Depends(get_db)):
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+def _get_group(db: Session, group_id: int):
+    group = db.query(models.Group).options(_with_members()).filter(models.Group.id == group_id).first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    # Calculate total expenses
-    total_expenses = db.query(models.Expense).filter(models.Expense.group_id == group_id).with_entities(
-        models.Expense.amount
-    ).all()
-    total_amount = sum(expense.amount for expense in total_expenses)
+    # Calculate total expenses; what the members paid in archived expenses
+    # is in their opening balances
+    total_cents = db.query(func.coalesce(func.sum(models.Expense.amount_cents), 0)).filter(
+        models.Expense.group_id == group_id
+    ).scalar() + db.query(func.coalesce(func.sum(models.GroupOpeningBalance.paid), 0)).filter(
+        models.GroupOpeningBalance.group_id == group_id
+    ).scalar()
     
-    # Get members for the group
-    members = []
-    for membership in group.members:
-        members.append(membership.user)
+    response = _group_response(group, [membership.user for membership in group.members])
+    response["total_expenses"] = from_cents(total_cents)
+    return response
+
+@app.get("/groups/{group_id}", response_model=schemas.GroupDetails)
+async def get_group(group_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    return await cache.cached_response(
+        request, [cache.group_scope(group_id)],
+        lambda response: run_in_session(db, _get_group, group_id, schema=schemas.GroupDetails)
+    )
+
+def _get_groups(db: Session, limit: int, offset: int, include: schemas.GroupInclude):
+    query = db.query(models.Group)
+    if include == schemas.GroupInclude.MEMBERS:
+        query = query.options(_with_members())
+    groups = query.order_by(models.Group.id).offset(offset).limit(limit).all()
     
-    # Create response object manually
-    return {
-        "id": group.id,
-        "name": group.name,
-        "description": group.description,
-        "created_at": group.created_at,
-        "members": members,
-        "total_expenses": total_amount
-    }
+    if include == schemas.GroupInclude.NONE:
+        return [_group_response(group) for group in groups]
+    return [
+        _group_response(group, [membership.user for membership in group.members])
+        for group in groups
+    ]
 
 @app.get("/groups/", response_model=List[schemas.Group])
-def get_groups(db: Session = Depends(get_db)):
-    groups = db.query(models.Group).all()
-    result = []
-    
-    for group in groups:
-        # Get members for each group
-        members = []
-        for membership in group.members:
-            members.append(membership.user)
-        
-        # Create response object manually
-        group_data = {
-            "id": group.id,
-            "name": group.name,
-            "description": group.description,
-            "created_at": group.created_at,
-            "members": members
-        }
-        result.append(group_data)
-    
-    return result
+async def get_groups(
+    request: Request,
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    include: schemas.GroupInclude = schemas.GroupInclude.MEMBERS,
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await cache.cached_response(
+        request, [cache.LISTING],
+        lambda response: run_in_session(db, _get_groups, limit, offset, include, schema=schemas.Group)
+    )
 
 @app.delete("/groups/{group_id}")
 def delete_group(group_id: int, db: Session = Depends(get_db)):
@@ -170,423 +287,800 @@ def delete_group(group_id: int, db: Session = Depends(get_db)):
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    # Check if there are any expenses in this group
-    expenses_count = db.query(models.Expense).filter(models.Expense.group_id == group_id).count()
-    if expenses_count > 0:
+    # Check if there are any expenses in this group; they are only counted
+    # for the error message
+    if db.query(db.query(models.Expense.id).filter(models.Expense.group_id == group_id).exists()).scalar():
+        expenses_count = db.query(func.count(models.Expense.id)).filter(models.Expense.group_id == group_id).scalar()
         raise HTTPException(
             status_code=400, 
             detail=f"Cannot delete group '{group.name}'. Group has {expenses_count} expenses. Please delete all expenses first or settle all balances."
         )
     
-    # Delete settlements first (before group memberships)
-    db.query(models.Settlement).filter(models.Settlement.group_id == group_id).delete()
+    # Archived history isn't deleted with the group (ON DELETE RESTRICT),
+    # so a group with any is kept
+    group_has_archive = or_(
+        db.query(models.ArchivedExpense.id).filter(models.ArchivedExpense.group_id == group_id).exists(),
+        db.query(models.ArchivedSettlement.id).filter(models.ArchivedSettlement.group_id == group_id).exists(),
+        db.query(models.GroupOpeningBalance.user_id).filter(models.GroupOpeningBalance.group_id == group_id).exists()
+    )
+    if db.query(group_has_archive).scalar():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot delete group '{group.name}'. Group has archived history."
+        )
     
-    # Delete group memberships
-    db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).delete()
+    member_ids = [user_id for (user_id,) in db.query(models.GroupMember.user_id).filter(models.GroupMember.group_id == group_id).all()]
+    ledger.mark_changed(db, group_id, member_ids)
+    membership.changed(db, group_id)
+    cache.touch(db, cache.LISTING)
+    journal.record(db, group_id, journal.GROUP_DELETED, group_id, {})
     
-    # Delete the group
-    db.delete(group)
+    # Delete the group; settlements, memberships, ledger rows and snapshots
+    # go with it (ON DELETE CASCADE)
+    name = group.name
+    db.execute(delete(models.Group).where(models.Group.id == group_id))
     db.commit()
     
-    return {"message": f"Group '{group.name}' deleted successfully"}
+    return {"message": f"Group '{name}' deleted successfully"}
 
-# Expense endpoints
-@app.post("/groups/{group_id}/expenses/", response_model=schemas.Expense)
-def create_expense(group_id: int, expense: schemas.ExpenseCreate, db: Session = Depends(get_db)):
-    # Check if group exists
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+@app.post("/groups/{group_id}/archive", response_model=schemas.GroupArchiveReport)
+def archive_group(
+    group_id: int,
+    before: Optional[datetime] = Query(None, description="Only archive the history up to this time (UTC unless an offset is given)"),
+    db: Session = Depends(get_db)
+):
+    """
+    Moves the group's expenses and settlements up to before to the archive
+    tables. Without before, the whole group is archived and takes no new
+    expenses or settlements. The group must be settled at the cutoff.
+    """
+    # Check if group exists; the row lock keeps two archive requests apart
+    group = db.query(models.Group).filter(models.Group.id == group_id).with_for_update().first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
+    if group.archived_at is not None:
+        raise HTTPException(status_code=400, detail=f"Group '{group.name}' is already archived")
+    
+    cutoff = snapshots.to_utc(before) if before is not None else datetime.utcnow()
+    try:
+        expenses_archived, settlements_archived = archive.archive(db, group, cutoff)
+    except archive.ArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    archived_at = None
+    if before is None:
+        archived_at = group.archived_at = cutoff
+        membership.changed(db, group_id)
+        cache.touch(db, cache.LISTING)
+        journal.record(db, group_id, journal.GROUP_ARCHIVED, group_id, {})
+    db.commit()
+    
+    return schemas.GroupArchiveReport(
+        group_id=group_id, before=cutoff, archived_at=archived_at,
+        expenses_archived=expenses_archived, settlements_archived=settlements_archived
+    )
+
+# Expense endpoints
+def _require_user(db: Session, user_id: int, detail: str):
+    # Only reached on the error path, to tell unknown users from non-members
+    if not db.query(models.User.id).filter(models.User.id == user_id).first():
+        raise HTTPException(status_code=404, detail=detail)
+
+@contextmanager
+def _members_still_exist(db: Session, group_id: int):
+    """
+    Writes validated against a cached member list fail on a foreign key if
+    another worker deleted one of the users meanwhile; report those as not
+    found rather than as a server error.
+    """
+    try:
+        yield
+    except IntegrityError:
+        db.rollback()
+        membership.forget(group_id)
+        raise HTTPException(status_code=404, detail="User not found")
+
+def _insert_splits(db: Session, expense_id: int, splits):
+    """
+    Inserts (user_id, amount_cents, percentage) splits of an expense in one statement.
+    """
+    if splits:
+        db.execute(insert(models.ExpenseSplit), [
+            {"expense_id": expense_id, "user_id": user_id, "amount_cents": amount_cents, "percentage": percentage}
+            for user_id, amount_cents, percentage in splits
+        ])
+
+def _create_expense(db: Session, group_id: int, expense: schemas.ExpenseCreate):
+    # Check if group exists; its member ids are loaded with it
+    members = membership.member_ids(db, group_id)
+    if members is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if members.archived:
+        raise HTTPException(status_code=400, detail="Group is archived")
     
     # Check if paid_by user exists and is in the group
-    paid_by_user = db.query(models.User).filter(models.User.id == expense.paid_by).first()
-    if not paid_by_user:
-        raise HTTPException(status_code=404, detail="Paying user not found")
-    
-    # Check if user is in the group
-    membership = db.query(models.GroupMember).filter(
-        models.GroupMember.group_id == group_id,
-        models.GroupMember.user_id == expense.paid_by
-    ).first()
-    if not membership:
+    if expense.paid_by not in members:
+        _require_user(db, expense.paid_by, "Paying user not found")
         raise HTTPException(status_code=400, detail="Paying user is not a member of this group")
     
-    # Create expense
-    db_expense = models.Expense(
-        description=expense.description,
-        amount=expense.amount,
-        group_id=group_id,
-        paid_by=expense.paid_by,
-        split_type=expense.split_type
-    )
-    db.add(db_expense)
-    db.commit()
-    db.refresh(db_expense)
+    # Work out the splits before writing anything, so a bad request leaves no expense behind
+    amount_cents = to_cents(expense.amount)
+    try:
+        splits = compute_splits(amount_cents, expense.split_type, members.ids, expense.splits)
+    except SplitError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Create expense splits
-    if expense.split_type == models.SplitType.EQUAL:
-        # Split equally among all group members
-        members = db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).all()
-        split_amount = expense.amount / len(members)
+    # Create the expense and its splits in one transaction; flush assigns the id
+    with _members_still_exist(db, group_id):
+        db_expense = models.Expense(
+            description=expense.description,
+            amount_cents=amount_cents,
+            group_id=group_id,
+            paid_by=expense.paid_by,
+            split_type=expense.split_type
+        )
+        db.add(db_expense)
+        db.flush()
+        _insert_splits(db, db_expense.id, splits)
         
-        for member in members:
-            split = models.ExpenseSplit(
-                expense_id=db_expense.id,
-                user_id=member.user_id,
-                amount=split_amount
-            )
-            db.add(split)
+        ledger.apply_deltas(db, group_id, ledger.expense_deltas(
+            expense.paid_by, amount_cents, [(user_id, share) for user_id, share, _ in splits]
+        ))
+        journal.record(db, group_id, journal.EXPENSE_CREATED, db_expense.id, journal.expense_state(
+            db_expense.id, expense.description, amount_cents, expense.paid_by, expense.split_type, splits
+        ))
+        db.commit()
+    return _load_expense(db, db_expense.id)
+
+@app.post("/groups/{group_id}/expenses/", response_model=schemas.Expense)
+async def create_expense(group_id: int, expense: schemas.ExpenseCreate, db: AsyncSession = Depends(get_async_db)):
+    return await run_in_session(db, _create_expense, group_id, expense, schema=schemas.Expense)
+
+@app.post("/groups/{group_id}/expenses/bulk", response_model=schemas.BulkImportReport)
+def bulk_import_expenses(
+    group_id: int,
+    request: Request,
+    format: Optional[schemas.ImportFormat] = None,
+    chunk_size: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db)
+):
+    """
+    Imports expenses streamed as CSV or JSON Lines. Invalid rows are skipped
+    and reported; valid rows are committed together. Runs in a worker
+    thread, like the other sync endpoints, and pulls the body from the
+    event loop as it goes.
+    """
+    try:
+        import_format = bulk_import.detect_format(request.headers.get("content-type"), format)
+    except bulk_import.ImportFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     
-    elif expense.split_type == models.SplitType.PERCENTAGE:
-        # Split based on percentages
-        if not expense.splits:
-            raise HTTPException(status_code=400, detail="Percentage splits must be provided for percentage split type")
-        
-        # Validate percentages sum to 100
-        total_percentage = sum(split.percentage for split in expense.splits)
-        if abs(total_percentage - 100.0) > 0.01:  # Allow small floating point differences
-            raise HTTPException(status_code=400, detail="Percentages must sum to 100")
-        
-        for split_data in expense.splits:
-            # Check if user is in the group
-            membership = db.query(models.GroupMember).filter(
-                models.GroupMember.group_id == group_id,
-                models.GroupMember.user_id == split_data.user_id
-            ).first()
-            if not membership:
-                raise HTTPException(status_code=400, detail=f"User {split_data.user_id} is not a member of this group")
-            
-            split_amount = (split_data.percentage / 100.0) * expense.amount
-            split = models.ExpenseSplit(
-                expense_id=db_expense.id,
-                user_id=split_data.user_id,
-                amount=split_amount,
-                percentage=split_data.percentage
-            )
-            db.add(split)
+    # Check if group exists
+    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    if group.archived_at is not None:
+        raise HTTPException(status_code=400, detail="Group is archived")
     
-    db.commit()
-    db.refresh(db_expense)
-    return db_expense
+    try:
+        with _members_still_exist(db, group_id):
+            return bulk_import.run_import(db, group, request.stream(), import_format, chunk_size)
+    except bulk_import.ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@app.put("/expenses/{expense_id}", response_model=schemas.Expense)
-def update_expense(expense_id: int, expense_update: schemas.ExpenseCreate, db: Session = Depends(get_db)):
+def _requested_splits(amount_cents: int, expense_update: schemas.ExpenseCreate, members):
+    """
+    Validates the splits of an expense update and returns them as
+    (user_id, amount_cents, percentage) tuples. The expense is split
+    between the listed users, with the same rules as on create.
+    """
+    user_ids = [split.user_id for split in expense_update.splits]
+    missing = members.missing(user_ids)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"User {missing[0]} is not a member of this group")
+    try:
+        return compute_splits(amount_cents, expense_update.split_type, user_ids, expense_update.splits)
+    except SplitError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _rescaled_splits(db_expense: models.Expense, amount_cents: int):
+    """
+    Divides a new amount between the expense's current splits the way it
+    was divided before, so the splits keep adding up to the amount.
+    """
+    current = sorted(db_expense.splits, key=lambda split: split.id)
+    try:
+        return compute_splits(amount_cents, db_expense.split_type, [split.user_id for split in current], current)
+    except SplitError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _sync_splits(db: Session, db_expense: models.Expense, splits):
+    """
+    Brings the split rows of an expense in line with splits. Rows of users
+    who keep a split are updated in place, the rest are deleted and
+    inserted with one statement each.
+    """
+    existing = defaultdict(list)
+    for split in db_expense.splits:
+        existing[split.user_id].append(split)
+    
+    added = []
+    for user_id, amount_cents, percentage in splits:
+        if existing[user_id]:
+            split = existing[user_id].pop(0)
+            split.amount_cents = amount_cents
+            split.percentage = percentage
+        else:
+            added.append((user_id, amount_cents, percentage))
+    
+    removed = [split.id for user_splits in existing.values() for split in user_splits]
+    if removed:
+        db.execute(delete(models.ExpenseSplit).where(models.ExpenseSplit.id.in_(removed)))
+    _insert_splits(db, db_expense.id, added)
+    db.expire(db_expense, ["splits"])
+
+def _update_expense(db: Session, expense_id: int, expense_update: schemas.ExpenseCreate):
     # Get the existing expense
     db_expense = db.query(models.Expense).filter(models.Expense.id == expense_id).first()
     if not db_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     
     # Check if the new paid_by user is in the group
-    if expense_update.paid_by:
-        membership = db.query(models.GroupMember).filter(
-            models.GroupMember.group_id == db_expense.group_id,
-            models.GroupMember.user_id == expense_update.paid_by
-        ).first()
-        if not membership:
-            raise HTTPException(status_code=400, detail="The user who paid is not a member of this group")
+    members = membership.member_ids(db, db_expense.group_id)
+    if expense_update.paid_by and expense_update.paid_by not in members:
+        raise HTTPException(status_code=400, detail="The user who paid is not a member of this group")
+    
+    # Validate the new splits before changing anything
+    amount_cents = db_expense.amount_cents if expense_update.amount is None else to_cents(expense_update.amount)
+    split_type = db_expense.split_type
+    splits = None
+    if expense_update.splits:
+        split_type = expense_update.split_type
+        splits = _requested_splits(amount_cents, expense_update, members)
+    elif expense_update.split_type != db_expense.split_type:
+        # A new split type without splits divides the expense as on create
+        split_type = expense_update.split_type
+        try:
+            splits = compute_splits(amount_cents, split_type, members.ids)
+        except SplitError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif amount_cents != db_expense.amount_cents:
+        splits = _rescaled_splits(db_expense, amount_cents)
+    
+    # Take the current state of the expense out of the ledger
+    before = journal.expense_state_of(db_expense)
+    current_splits = [(split.user_id, split.amount_cents) for split in db_expense.splits]
+    deltas = ledger.expense_deltas(db_expense.paid_by, db_expense.amount_cents, current_splits, sign=-1)
     
     # Update basic expense fields
     if expense_update.description is not None:
         db_expense.description = expense_update.description
-    if expense_update.amount is not None:
-        db_expense.amount = expense_update.amount
+    db_expense.amount_cents = amount_cents
     if expense_update.paid_by is not None:
         db_expense.paid_by = expense_update.paid_by
     
-    # If splits are provided, update them
-    if expense_update.splits:
-        # Delete existing splits
-        db.query(models.ExpenseSplit).filter(models.ExpenseSplit.expense_id == expense_id).delete()
+    with _members_still_exist(db, db_expense.group_id):
+        # If the splits changed, update the rows that did
+        new_splits = before["splits"]
+        if splits is not None:
+            db_expense.split_type = split_type
+            _sync_splits(db, db_expense, splits)
+            current_splits = [(user_id, share) for user_id, share, _ in splits]
+            new_splits = splits
         
-        # Validate and create new splits
-        if expense_update.split_type == "equal":
-            # Equal split among all specified users
-            split_amount = expense_update.amount / len(expense_update.splits)
-            for split_data in expense_update.splits:
-                # Check if user is in the group
-                membership = db.query(models.GroupMember).filter(
-                    models.GroupMember.group_id == db_expense.group_id,
-                    models.GroupMember.user_id == split_data.user_id
-                ).first()
-                if not membership:
-                    raise HTTPException(status_code=400, detail=f"User {split_data.user_id} is not a member of this group")
-                
-                split = models.ExpenseSplit(
-                    expense_id=expense_id,
-                    user_id=split_data.user_id,
-                    amount=split_amount,
-                    percentage=100.0 / len(expense_update.splits)
-                )
-                db.add(split)
+        # Put the updated expense back into the ledger; members whose totals
+        # didn't change aren't written
+        ledger.expense_deltas(db_expense.paid_by, db_expense.amount_cents, current_splits, deltas=deltas)
+        ledger.apply_deltas(db, db_expense.group_id, deltas)
+        snapshots.invalidate(db, db_expense.group_id, db_expense.created_at)
+        journal.record(db, db_expense.group_id, journal.EXPENSE_UPDATED, expense_id, {
+            "before": before,
+            "after": journal.expense_state(
+                expense_id, db_expense.description, db_expense.amount_cents, db_expense.paid_by,
+                db_expense.split_type, new_splits, db_expense.created_at
+            ),
+        })
         
-        elif expense_update.split_type == "percentage":
-            # Validate percentages sum to 100
-            total_percentage = sum(split.percentage for split in expense_update.splits)
-            if abs(total_percentage - 100.0) > 0.01:
-                raise HTTPException(status_code=400, detail="Percentages must sum to 100")
-            
-            for split_data in expense_update.splits:
-                # Check if user is in the group
-                membership = db.query(models.GroupMember).filter(
-                    models.GroupMember.group_id == db_expense.group_id,
-                    models.GroupMember.user_id == split_data.user_id
-                ).first()
-                if not membership:
-                    raise HTTPException(status_code=400, detail=f"User {split_data.user_id} is not a member of this group")
-                
-                split_amount = (split_data.percentage / 100.0) * expense_update.amount
-                split = models.ExpenseSplit(
-                    expense_id=expense_id,
-                    user_id=split_data.user_id,
-                    amount=split_amount,
-                    percentage=split_data.percentage
-                )
-                db.add(split)
-    
-    db.commit()
-    db.refresh(db_expense)
-    return db_expense
+        db.commit()
+    return _load_expense(db, expense_id)
 
-@app.delete("/expenses/{expense_id}")
-def delete_expense(expense_id: int, db: Session = Depends(get_db)):
+@app.put("/expenses/{expense_id}", response_model=schemas.Expense)
+async def update_expense(expense_id: int, expense_update: schemas.ExpenseCreate, db: AsyncSession = Depends(get_async_db)):
+    return await run_in_session(db, _update_expense, expense_id, expense_update, schema=schemas.Expense)
+
+def _delete_expense(db: Session, expense_id: int):
     # Get the expense
     db_expense = db.query(models.Expense).filter(models.Expense.id == expense_id).first()
     if not db_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     
-    # Delete expense splits first
-    db.query(models.ExpenseSplit).filter(models.ExpenseSplit.expense_id == expense_id).delete()
+    ledger.record_expense(db, db_expense, db_expense.splits, sign=-1)
+    snapshots.invalidate(db, db_expense.group_id, db_expense.created_at)
+    journal.record(db, db_expense.group_id, journal.EXPENSE_DELETED, expense_id, journal.expense_state_of(db_expense))
     
-    # Delete the expense
-    db.delete(db_expense)
+    # Delete the expense; its splits go with it (ON DELETE CASCADE)
+    db.execute(delete(models.Expense).where(models.Expense.id == expense_id))
     db.commit()
     
     return {"detail": "Expense deleted successfully"}
 
-@app.get("/groups/{group_id}/expenses/", response_model=List[schemas.Expense])
-def get_group_expenses(group_id: int, db: Session = Depends(get_db)):
+@app.delete("/expenses/{expense_id}")
+async def delete_expense(expense_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await run_in_session(db, _delete_expense, expense_id)
+
+def _delete_expenses_before(db: Session, group_id: int, before: datetime):
     # Check if group exists
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
-    if not group:
+    if membership.member_ids(db, group_id) is None:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    return db.query(models.Expense).filter(models.Expense.group_id == group_id).all()
+    # Expenses written from here on, even backdated ones, have higher ids
+    # and are left alone
+    last_id = db.query(func.max(models.Expense.id)).filter(
+        models.Expense.group_id == group_id, models.Expense.created_at < before
+    ).scalar()
+    if last_id is None:
+        return schemas.ExpensePurgeReport(group_id=group_id, before=before, deleted=0, total_amount=0)
+    conditions = [models.Expense.created_at < before, models.Expense.id <= last_id]
+    
+    # Take the expenses out of the ledger with grouped sums, then delete them
+    # with one statement; their splits go with them (ON DELETE CASCADE)
+    deltas, count, total_cents = ledger.bulk_expense_deltas(db, group_id, conditions, sign=-1)
+    db.execute(delete(models.Expense).where(models.Expense.group_id == group_id, *conditions))
+    ledger.apply_deltas(db, group_id, deltas)
+    snapshots.invalidate(db, group_id, None)
+    journal.record(db, group_id, journal.EXPENSES_PURGED, None, {
+        "before": before.isoformat(), "count": count, "amount_cents": total_cents, "deltas": deltas
+    })
+    db.commit()
+    
+    return schemas.ExpensePurgeReport(group_id=group_id, before=before, deleted=count, total_amount=from_cents(total_cents))
 
-# Balance endpoints
-@app.get("/groups/{group_id}/balances", response_model=schemas.GroupBalance)
-def get_group_balances(group_id: int, db: Session = Depends(get_db)):
+@app.delete("/groups/{group_id}/expenses/", response_model=schemas.ExpensePurgeReport)
+async def delete_expenses_before(
+    group_id: int,
+    before: datetime = Query(..., description="Delete every expense created before this time (UTC unless an offset is given)"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await run_in_session(db, _delete_expenses_before, group_id, snapshots.to_utc(before))
+
+def _get_group_expenses(
+    db: Session,
+    group_id: int,
+    response: Response,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    paid_by: Optional[int] = None,
+    participant_id: Optional[int] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    include_archived: bool = False
+):
     # Check if group exists
     group = db.query(models.Group).filter(models.Group.id == group_id).first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
-      # Get all group members
-    members = db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).all()
-    balances = []
-    for member in members:
-        user = member.user
-        
-        # Calculate how much this user owes (sum of their expense splits)
-        owes = db.query(models.ExpenseSplit).join(models.Expense).filter(
-            models.Expense.group_id == group_id,
-            models.ExpenseSplit.user_id == user.id
-        ).with_entities(models.ExpenseSplit.amount).all()
-        total_owes = sum(split.amount for split in owes)
-        
-        # Calculate how much is owed to this user (expenses they paid minus their share)
-        paid_expenses = db.query(models.Expense).filter(
-            models.Expense.group_id == group_id,
-            models.Expense.paid_by == user.id
-        ).all()
-        
-        total_paid = sum(expense.amount for expense in paid_expenses)
-        
-        # Their share of expenses they paid
-        their_share_of_paid = db.query(models.ExpenseSplit).join(models.Expense).filter(
-            models.Expense.group_id == group_id,
-            models.Expense.paid_by == user.id,
-            models.ExpenseSplit.user_id == user.id
-        ).with_entities(models.ExpenseSplit.amount).all()
-        total_their_share = sum(split.amount for split in their_share_of_paid)
-        
-        owed_to_user = total_paid - total_their_share
-        
-        # Calculate settlements (payments made/received)
-        settlements_made = db.query(models.Settlement).filter(
-            models.Settlement.group_id == group_id,
-            models.Settlement.payer_id == user.id
-        ).with_entities(models.Settlement.amount).all()
-        total_settlements_made = sum(settlement.amount for settlement in settlements_made)
-        
-        settlements_received = db.query(models.Settlement).filter(
-            models.Settlement.group_id == group_id,
-            models.Settlement.payee_id == user.id
-        ).with_entities(models.Settlement.amount).all()
-        total_settlements_received = sum(settlement.amount for settlement in settlements_received)
+    
+    # Archived expenses, when asked for, are read with the same filters and
+    # merged in
+    tables = [(models.Expense, models.ExpenseSplit)]
+    if include_archived:
+        tables.append((models.ArchivedExpense, models.ArchivedExpenseSplit))
+    if cursor:
+        cursor_created_at, cursor_id = pagination.decode_cursor(cursor)
+        # Compare against the stored timestamp of the cursor row when it still
+        # exists, so the comparison doesn't depend on how datetimes round-trip
+        cursor_created_at = func.coalesce(*[
+            select(expense.created_at).where(expense.id == cursor_id).scalar_subquery() for expense, _ in tables
+        ], cursor_created_at)
+    
+    expenses = []
+    for expense, split in tables:
+        # Newest first, paginated on (created_at, id); splits and users are loaded
+        # up front so a page costs the same number of queries however big it is
+        query = db.query(expense).options(*_with_splits(expense, split)).filter(expense.group_id == group_id)
         
-        # Adjust balances for settlements
-        # If someone paid you (settlements_received), it reduces what they owe you
-        # If you paid someone (settlements_made), it reduces what you owe them
-        adjusted_owes = (total_owes - total_their_share) - total_settlements_made
-        adjusted_owed = owed_to_user - total_settlements_received
-        net_balance = adjusted_owed - adjusted_owes
+        if paid_by is not None:
+            query = query.filter(expense.paid_by == paid_by)
+        if participant_id is not None:
+            query = query.filter(expense.splits.any(split.user_id == participant_id))
+        if min_amount is not None:
+            query = query.filter(expense.amount_cents >= to_cents(min_amount))
+        if max_amount is not None:
+            query = query.filter(expense.amount_cents <= to_cents(max_amount))
+        if created_after is not None:
+            query = query.filter(expense.created_at >= created_after)
+        if created_before is not None:
+            query = query.filter(expense.created_at < created_before)
+        if cursor:
+            query = query.filter(or_(
+                expense.created_at < cursor_created_at,
+                and_(expense.created_at == cursor_created_at, expense.id < cursor_id)
+            ))
         
-        balance = schemas.Balance(
-            user_id=user.id,
-            user_name=user.name,
-            owes=max(0, adjusted_owes),  # Ensure no negative values
-            owed=max(0, adjusted_owed),
-            net_balance=net_balance
+        expenses.extend(query.order_by(expense.created_at.desc(), expense.id.desc()).limit(limit + 1).all())
+    if include_archived:
+        expenses.sort(key=lambda row: (row.created_at, row.id), reverse=True)
+    
+    if len(expenses) > limit:
+        expenses = expenses[:limit]
+        last = expenses[-1]
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last.created_at, last.id)
+    
+    return expenses
+
+@app.get("/groups/{group_id}/expenses/", response_model=List[schemas.Expense])
+async def get_group_expenses(
+    group_id: int,
+    request: Request,
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    paid_by: Optional[int] = None,
+    participant_id: Optional[int] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    include_archived: bool = False,
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await cache.cached_response(
+        request, [cache.group_scope(group_id)],
+        lambda response: run_in_session(
+            db, _get_group_expenses, group_id, response, limit, cursor, paid_by, participant_id,
+            min_amount, max_amount, created_after, created_before, include_archived, schema=schemas.Expense
         )
-        balances.append(balance)
+    )
+
+# Balance endpoints
+def _get_group_balances(db: Session, group_id: int, as_of: Optional[datetime] = None, include_archived: bool = False):
+    # Check if group exists
+    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
     
-    return schemas.GroupBalance(
-        group_id=group_id,
-        group_name=group.name,
-        balances=balances
+    # Historical balances start from the nearest checkpoint
+    if as_of is not None:
+        try:
+            return snapshots.get_group_balance_as_of(db, group, snapshots.to_utc(as_of), include_archived)
+        except balance_engine.ArchivedHistory as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"History up to {e.cutoff.isoformat()} is archived; pass include_archived=true to read it"
+            )
+    
+    return balance_engine.get_group_balance(db, group)
+
+@app.get("/groups/{group_id}/balances", response_model=schemas.GroupBalance)
+async def get_group_balances(
+    group_id: int,
+    request: Request,
+    as_of: Optional[datetime] = Query(None, description="Balances as they stood at this time (UTC unless an offset is given)"),
+    include_archived: bool = Query(False, description="Read archived history for an as_of before the archive cutoff"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await cache.cached_response(
+        request, [cache.group_scope(group_id)],
+        lambda response: run_in_session(db, _get_group_balances, group_id, as_of, include_archived)
     )
 
-@app.get("/users/{user_id}/balances", response_model=schemas.UserBalance)
-def get_user_balances(user_id: int, db: Session = Depends(get_db)):
+def _get_balances_batch(db: Session, group_ids: List[int]):
+    # One query for the groups and one for all of their ledger rows
+    groups = db.query(models.Group).filter(models.Group.id.in_(group_ids)).all()
+    balances = balance_engine.get_group_balances(db, groups)
+    return schemas.GroupBalanceBatch(
+        results={group_id: balances[group_id] for group_id in group_ids if group_id in balances},
+        errors=_missing(group_ids, balances, "Group not found")
+    )
+
+@app.get("/balances", response_model=schemas.GroupBalanceBatch)
+async def get_balances_batch(
+    request: Request,
+    group_ids: Optional[List[str]] = Query(None, description="Group ids, comma-separated or repeated"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    ids = _batch_ids(group_ids)
+    return await cache.cached_response(
+        request, [cache.group_scope(group_id) for group_id in ids],
+        lambda response: run_in_session(db, _get_balances_batch, ids)
+    )
+
+def _get_user_balances(db: Session, user_id: int, summary_only: bool = False):
     # Check if user exists
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get all groups the user is part of
-    memberships = db.query(models.GroupMember).filter(models.GroupMember.user_id == user_id).all()
+    # Summary mode skips the member lists and only reads this user's ledger rows
+    if summary_only:
+        return balance_engine.get_user_balance_summary(db, user)
     
-    group_balances = []
-    total_net_balance = 0.0
-    
-    for membership in memberships:
-        group_balance = get_group_balances(membership.group_id, db)
-        
-        # Find this user's balance in the group
-        user_balance_in_group = next(
-            (balance for balance in group_balance.balances if balance.user_id == user_id),
-            None
-        )
-        
-        if user_balance_in_group:
-            total_net_balance += user_balance_in_group.net_balance
-            group_balances.append(group_balance)
-    
-    return schemas.UserBalance(
-        user_id=user_id,
-        user_name=user.name,
-        group_balances=group_balances,
-        total_net_balance=total_net_balance
+    return balance_engine.get_user_balance(db, user)
+
+def _user_group_ids(db: Session, user_id: int):
+    return [group_id for group_id, in db.query(models.GroupMember.group_id).filter(
+        models.GroupMember.user_id == user_id
+    ).all()]
+
+@app.get("/users/{user_id}/balances", response_model=Union[schemas.UserBalance, schemas.UserBalanceSummary])
+async def get_user_balances(user_id: int, request: Request, summary_only: bool = False, db: AsyncSession = Depends(get_async_db)):
+    # The response shows every member of the user's groups, so it depends on
+    # those groups as well as on the user
+    group_ids = await run_in_session(db, _user_group_ids, user_id)
+    return await cache.cached_response(
+        request, [cache.user_scope(user_id)] + [cache.group_scope(group_id) for group_id in group_ids],
+        lambda response: run_in_session(db, _get_user_balances, user_id, summary_only)
     )
 
 # Settlement endpoints
-@app.post("/groups/{group_id}/settlements/", response_model=schemas.Settlement)
-def create_settlement(group_id: int, settlement: schemas.SettlementCreate, db: Session = Depends(get_db)):
-    # Check if group exists
-    group = db.query(models.Group).filter(models.Group.id == group_id).first()
-    if not group:
+def _create_settlement(db: Session, group_id: int, settlement: schemas.SettlementCreate):
+    # Check if group exists; its member ids are loaded with it
+    members = membership.member_ids(db, group_id)
+    if members is None:
         raise HTTPException(status_code=404, detail="Group not found")
+    if members.archived:
+        raise HTTPException(status_code=400, detail="Group is archived")
     
     # Check if both users exist and are in the group
-    payer = db.query(models.User).filter(models.User.id == settlement.payer_id).first()
-    payee = db.query(models.User).filter(models.User.id == settlement.payee_id).first()
-    
-    if not payer:
-        raise HTTPException(status_code=404, detail="Payer not found")
-    if not payee:
-        raise HTTPException(status_code=404, detail="Payee not found")
-    
-    # Check if both users are in the group
-    payer_membership = db.query(models.GroupMember).filter(
-        models.GroupMember.group_id == group_id,
-        models.GroupMember.user_id == settlement.payer_id
-    ).first()
-    payee_membership = db.query(models.GroupMember).filter(
-        models.GroupMember.group_id == group_id,
-        models.GroupMember.user_id == settlement.payee_id
-    ).first()
-    
-    if not payer_membership:
+    if settlement.payer_id not in members:
+        _require_user(db, settlement.payer_id, "Payer not found")
+    if settlement.payee_id not in members:
+        _require_user(db, settlement.payee_id, "Payee not found")
+    if settlement.payer_id not in members:
         raise HTTPException(status_code=400, detail="Payer is not a member of this group")
-    if not payee_membership:
+    if settlement.payee_id not in members:
         raise HTTPException(status_code=400, detail="Payee is not a member of this group")
     
     if settlement.payer_id == settlement.payee_id:
         raise HTTPException(status_code=400, detail="Payer and payee cannot be the same person")
     
-    if settlement.amount <= 0:
+    amount_cents = to_cents(settlement.amount)
+    if amount_cents <= 0:
         raise HTTPException(status_code=400, detail="Settlement amount must be positive")
     
-    # Create settlement record
-    db_settlement = models.Settlement(
-        group_id=group_id,
-        payer_id=settlement.payer_id,
-        payee_id=settlement.payee_id,
-        amount=settlement.amount,
-        description=settlement.description or f"{payer.name} paid {payee.name}"
-    )
+    # Default description names both users
+    description = settlement.description
+    if not description:
+        names = dict(db.query(models.User.id, models.User.name).filter(
+            models.User.id.in_([settlement.payer_id, settlement.payee_id])
+        ).all())
+        if len(names) < 2:
+            membership.forget(group_id)
+            raise HTTPException(status_code=404, detail="User not found")
+        description = f"{names[settlement.payer_id]} paid {names[settlement.payee_id]}"
     
-    db.add(db_settlement)
-    db.commit()
+    # Create settlement record
+    with _members_still_exist(db, group_id):
+        db_settlement = models.Settlement(
+            group_id=group_id,
+            payer_id=settlement.payer_id,
+            payee_id=settlement.payee_id,
+            amount_cents=amount_cents,
+            description=description
+        )
+        
+        db.add(db_settlement)
+        db.flush()
+        ledger.record_settlement(db, db_settlement)
+        journal.record(db, group_id, journal.SETTLEMENT_RECORDED, db_settlement.id, journal.settlement_state(db_settlement))
+        db.commit()
     db.refresh(db_settlement)
     
     return db_settlement
 
-@app.get("/groups/{group_id}/settlements/", response_model=List[schemas.Settlement])
-def get_group_settlements(group_id: int, db: Session = Depends(get_db)):
+@app.post("/groups/{group_id}/settlements/", response_model=schemas.Settlement)
+async def create_settlement(group_id: int, settlement: schemas.SettlementCreate, db: AsyncSession = Depends(get_async_db)):
+    return await run_in_session(db, _create_settlement, group_id, settlement, schema=schemas.Settlement)
+
+def _get_group_settlements(db: Session, group_id: int, include_archived: bool = False):
     # Check if group exists
     group = db.query(models.Group).filter(models.Group.id == group_id).first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    return db.query(models.Settlement).filter(models.Settlement.group_id == group_id).all()
+    settlements = db.query(models.Settlement).options(
+        joinedload(models.Settlement.payer), joinedload(models.Settlement.payee)
+    ).filter(models.Settlement.group_id == group_id).all()
+    if not include_archived:
+        return settlements
+    
+    # Archived settlements are older, so they come first
+    archived = db.query(models.ArchivedSettlement).options(
+        joinedload(models.ArchivedSettlement.payer), joinedload(models.ArchivedSettlement.payee)
+    ).filter(models.ArchivedSettlement.group_id == group_id).order_by(
+        models.ArchivedSettlement.settled_at, models.ArchivedSettlement.id
+    ).all()
+    return archived + settlements
 
-@app.delete("/settlements/{settlement_id}")
-def delete_settlement(settlement_id: int, db: Session = Depends(get_db)):
+@app.get("/groups/{group_id}/settlements/", response_model=List[schemas.Settlement])
+async def get_group_settlements(
+    group_id: int, request: Request, include_archived: bool = False, db: AsyncSession = Depends(get_async_db)
+):
+    return await cache.cached_response(
+        request, [cache.group_scope(group_id)],
+        lambda response: run_in_session(db, _get_group_settlements, group_id, include_archived, schema=schemas.Settlement)
+    )
+
+def _delete_settlement(db: Session, settlement_id: int):
     # Find the settlement
     settlement = db.query(models.Settlement).filter(models.Settlement.id == settlement_id).first()
     if not settlement:
         raise HTTPException(status_code=404, detail="Settlement not found")
     
+    ledger.record_settlement(db, settlement, sign=-1)
+    snapshots.invalidate(db, settlement.group_id, settlement.settled_at)
+    journal.record(
+        db, settlement.group_id, journal.SETTLEMENT_DELETED, settlement_id,
+        journal.settlement_state(settlement, settlement.settled_at)
+    )
+    
     # Delete the settlement
-    db.delete(settlement)
+    db.execute(delete(models.Settlement).where(models.Settlement.id == settlement_id))
     db.commit()
     
     return {"message": "Settlement deleted successfully"}
 
+@app.delete("/settlements/{settlement_id}")
+async def delete_settlement(settlement_id: int, db: AsyncSession = Depends(get_async_db)):
+    return await run_in_session(db, _delete_settlement, settlement_id)
+
+# Journal endpoints
+def _get_group_events(db: Session, group_id: int, after: int, limit: int):
+    events = journal.events_after(db, group_id, after, limit)
+    # A deleted group still has its events
+    if not events and not db.query(models.Group.id).filter(models.Group.id == group_id).first():
+        if not db.query(models.LedgerEvent.id).filter(models.LedgerEvent.group_id == group_id).first():
+            raise HTTPException(status_code=404, detail="Group not found")
+    
+    return [
+        schemas.LedgerEvent(
+            offset=event.id,
+            group_id=event.group_id,
+            type=event.type,
+            entity_id=event.entity_id,
+            payload=event.payload,
+            created_at=event.created_at
+        )
+        for event in events
+    ]
+
+@app.get("/groups/{group_id}/events", response_model=List[schemas.LedgerEvent])
+async def get_group_events(
+    group_id: int,
+    after: int = Query(0, ge=0, description="Return events with offsets above this one"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await run_in_session(db, _get_group_events, group_id, after, limit)
+
+# Push endpoints
+async def _open_stream(group_id: int):
+    # Subscribe before loading, so a change committed in between is still sent
+    try:
+        subscription = streams.subscribe(group_id)
+    except streams.TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many open streams, try again later")
+    first = await streams.current(group_id)
+    if first.event == streams.DELETED:
+        streams.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail="Group not found")
+    return subscription, first
+
+@app.get("/groups/{group_id}/stream")
+async def stream_group_balances(group_id: int):
+    """
+    Server-Sent Events with the group's balances, sent now and after every change.
+    """
+    subscription, first = await _open_stream(group_id)
+    return StreamingResponse(
+        streams.sse_events(subscription, first),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def group_balances_websocket(websocket: WebSocket, group_id: int):
+    # Same messages as the SSE stream, as JSON text frames
+    try:
+        subscription, first = await _open_stream(group_id)
+    except HTTPException as e:
+        await websocket.close(code=4000 + e.status_code)
+        return
+    await websocket.accept()
+    await streams.pump_websocket(websocket, subscription, first)
+
+if streams.STREAM_WEBSOCKET:
+    app.add_api_websocket_route("/groups/{group_id}/ws", group_balances_websocket)
+
+# Settle-up plan endpoints
+def _build_settle_plan(db: Session, group: models.Group, mode: schemas.SettlePlanMode) -> schemas.SettlePlan:
+    group_balance = balance_engine.get_group_balance(db, group)
+    names = {balance.user_id: balance.user_name for balance in group_balance.balances}
+    nets = {balance.user_id: to_cents(balance.net_balance) for balance in group_balance.balances}
+    
+    if mode == schemas.SettlePlanMode.EXACT:
+        try:
+            transfers = settle_plan.exact_plan(nets)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        transfers = settle_plan.greedy_plan(nets)
+    
+    return schemas.SettlePlan(
+        group_id=group.id,
+        mode=mode,
+        transfers=[
+            schemas.Transfer(
+                payer_id=payer_id,
+                payer_name=names[payer_id],
+                payee_id=payee_id,
+                payee_name=names[payee_id],
+                amount=from_cents(cents)
+            )
+            for payer_id, payee_id, cents in transfers
+        ]
+    )
+
+@app.get("/groups/{group_id}/settle-plan", response_model=schemas.SettlePlan)
+def get_settle_plan(group_id: int, mode: schemas.SettlePlanMode = schemas.SettlePlanMode.GREEDY, db: Session = Depends(get_db)):
+    # Check if group exists
+    group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    return _build_settle_plan(db, group, mode)
+
+@app.post("/groups/{group_id}/settle-plan/apply", response_model=List[schemas.Settlement])
+def apply_settle_plan(group_id: int, mode: schemas.SettlePlanMode = schemas.SettlePlanMode.GREEDY, db: Session = Depends(get_db)):
+    # Check if group exists; the row lock makes a second apply wait and plan
+    # from the balances the first one left
+    group = db.query(models.Group).filter(models.Group.id == group_id).with_for_update().first()
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    
+    plan = _build_settle_plan(db, group, mode)
+    
+    # Record every transfer as a settlement in one transaction
+    settlements = [
+        models.Settlement(
+            group_id=group_id,
+            payer_id=transfer.payer_id,
+            payee_id=transfer.payee_id,
+            amount_cents=to_cents(transfer.amount),
+            description=f"{transfer.payer_name} paid {transfer.payee_name}"
+        )
+        for transfer in plan.transfers
+    ]
+    db.add_all(settlements)
+    ledger.record_settlements(db, group_id, settlements)
+    db.flush()
+    settlement_ids = [settlement.id for settlement in settlements]
+    for settlement in settlements:
+        journal.record(db, group_id, journal.SETTLEMENT_RECORDED, settlement.id, journal.settlement_state(settlement))
+    db.commit()
+    
+    return db.query(models.Settlement).options(
+        joinedload(models.Settlement.payer), joinedload(models.Settlement.payee)
+    ).filter(models.Settlement.id.in_(settlement_ids)).order_by(models.Settlement.id).all()
+
 # Chatbot endpoint
 @app.post("/chatbot/", response_model=schemas.ChatbotResponse)
-async def chatbot_endpoint(request: schemas.ChatbotRequest, db: Session = Depends(get_db)):
+async def chatbot_endpoint(request: schemas.ChatbotRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Processes a user's natural language query about their Splitwise data.
     """
-    # 1. Gather all relevant data from the database
-    users = db.query(models.User).all()
-    groups = db.query(models.Group).all()
-    expenses = db.query(models.Expense).all()
-
-    # 2. Format the data into a comprehensive context string
-    context = "Here is the current state of the Splitwise data:\n\n"
-    
-    context += "**Users:**\n"
-    for user in users:
-        context += f"- ID: {user.id}, Name: {user.name}, Email: {user.email}\n"
-    context += "\n"
-
-    context += "**Groups:**\n"
-    for group in groups:
-        member_names = [member.user.name for member in group.members]
-        context += f"- Group ID: {group.id}, Name: {group.name}, Members: {', '.join(member_names)}\n"
-    context += "\n"
-
-    context += "**Expenses & Balances:**\n"
-    for group in groups:
-        group_balance = get_group_balances(group.id, db)
-        context += f"\n*Group: {group.name}*\n"
-        for balance in group_balance.balances:
-            context += f"  - {balance.user_name}: Owes ${balance.owes:.2f}, Is Owed ${balance.owed:.2f}, Net Balance: ${balance.net_balance:.2f}\n"
-
-    # 3. Call the AI service with the context and question
-    ai_response = get_ai_response(context, request.query)
+    intent = ai_service.classify_question(request.query)
+    
+    # Counts, help and off-topic questions are answered without the model
+    if intent in chat_context.DIRECT_INTENTS:
+        answer = await db.run_sync(chat_context.direct_answer, intent)
+        return schemas.ChatbotResponse(response=answer)
+    
+    # Only the data this kind of question needs
+    context = await db.run_sync(chat_context.build_context, request.query, intent)
+
+    # Call the AI service with the context and question
+    ai_response = await ai_service.get_ai_response(context, request.query)
 
     return schemas.ChatbotResponse(response=ai_response)
 
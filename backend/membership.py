@@ -0,0 +1,107 @@
+"""
+Group membership lookups for write validation.
+
+member_ids() loads a group's member ids with one query and keeps them on the
+session for the rest of the request, and in a small per-process cache shared
+between requests. Endpoints that add or remove members call changed() in
+their transaction; the cached entry is dropped once it commits. Entries
+also expire after MEMBERSHIP_CACHE_TTL seconds, which bounds how long other
+worker processes can see a stale member list. A cached list is only
+trusted after the group row itself has been read in the caller's
+transaction, so groups deleted or archived by another worker are noticed
+at once; a member deleted meanwhile makes the write fail on its foreign
+key, and the caller drops the entry with forget().
+"""
+import os
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import models
+from lru import TTLCache
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "1024"))
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "30"))
+
+LOADED = "membership_loaded"
+PENDING = "membership_pending"
+
+_members = TTLCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+
+
+class Members:
+    """
+    Member ids of one group, in the order they joined, and whether the
+    group is archived.
+    """
+    __slots__ = ("ids", "id_set", "archived")
+
+    def __init__(self, ids, archived: bool = False):
+        self.ids = tuple(ids)
+        self.id_set = frozenset(ids)
+        self.archived = archived
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self.id_set
+
+    def missing(self, user_ids):
+        """
+        Returns the given user ids that are not members, in order.
+        """
+        return [user_id for user_id in user_ids if user_id not in self.id_set]
+
+
+def member_ids(db: Session, group_id: int):
+    """
+    Returns the group's Members, or None if the group doesn't exist.
+    """
+    loaded = db.info.setdefault(LOADED, {})
+    if group_id in loaded:
+        return loaded[group_id]
+
+    members = None if group_id in db.info.get(PENDING, ()) else _members.get(group_id)
+    if members is not None:
+        # Another worker may have deleted or archived the group since
+        row = db.query(models.Group.archived_at).filter(models.Group.id == group_id).first()
+        if row is None or (row[0] is not None) != members.archived:
+            _members.pop(group_id)
+            members = None
+    if members is None:
+        rows = db.query(models.Group.archived_at, models.GroupMember.user_id).outerjoin(
+            models.GroupMember, models.GroupMember.group_id == models.Group.id
+        ).filter(models.Group.id == group_id).order_by(models.GroupMember.id).all()
+        if rows:
+            members = Members([user_id for _, user_id in rows if user_id is not None], rows[0][0] is not None)
+            # Don't share a list this transaction is still changing
+            if group_id not in db.info.get(PENDING, ()):
+                _members.set(group_id, members)
+    loaded[group_id] = members
+    return members
+
+
+def changed(db: Session, group_id: int):
+    """
+    Records that this transaction adds or removes members of the group,
+    or archives it.
+    """
+    db.info.setdefault(PENDING, set()).add(group_id)
+    db.info.get(LOADED, {}).pop(group_id, None)
+
+
+def forget(group_id: int):
+    """
+    Drops the group's cached member list, e.g. after a write failed on a
+    member that no longer exists.
+    """
+    _members.pop(group_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_changed(session):
+    for group_id in session.info.pop(PENDING, ()):
+        _members.pop(group_id)
+    session.info.pop(LOADED, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget(session):
+    session.info.pop(PENDING, None)
+    session.info.pop(LOADED, None)
@@ -0,0 +1,132 @@
+"""Money in integer cents
+
+Converts databases that still store amounts as floats. The float amount
+columns of expenses, expense_splits and settlements are replaced with
+amount_cents, and split rounding is nudged so every expense's splits add
+up to its total. The balance ledger is then recreated in cents from the
+converted rows. Databases without float amounts are left as they are.
+
+This runs before 0001, which indexes amount_cents.
+
+Revision ID: 0000
+Revises:
+Create Date: 2026-10-17
+"""
+from collections import defaultdict
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0000"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+MONEY_TABLES = ["expenses", "expense_splits", "settlements"]
+LEDGER_FIELDS = ["paid", "owed", "own_share", "settlements_made", "settlements_received"]
+
+expenses = sa.table(
+    "expenses", sa.column("id", sa.Integer), sa.column("group_id", sa.Integer),
+    sa.column("paid_by", sa.Integer), sa.column("amount_cents", sa.BigInteger),
+)
+expense_splits = sa.table(
+    "expense_splits", sa.column("id", sa.Integer), sa.column("expense_id", sa.Integer),
+    sa.column("user_id", sa.Integer), sa.column("amount_cents", sa.BigInteger),
+)
+settlements = sa.table(
+    "settlements", sa.column("group_id", sa.Integer), sa.column("payer_id", sa.Integer),
+    sa.column("payee_id", sa.Integer), sa.column("amount_cents", sa.BigInteger),
+)
+
+
+def _convert(table: str):
+    op.add_column(table, sa.Column("amount_cents", sa.BigInteger()))
+    op.execute(f"UPDATE {table} SET amount_cents = CAST(ROUND(amount * 100) AS BIGINT)")
+    with op.batch_alter_table(table) as batch:
+        batch.alter_column("amount_cents", existing_type=sa.BigInteger(), nullable=False)
+        batch.drop_column("amount")
+
+
+def _fix_split_rounding(connection):
+    # Rounding each split separately can leave an expense a cent or two
+    # off; give the difference to the expense's largest split
+    split_sum = sa.func.sum(expense_splits.c.amount_cents)
+    mismatched = connection.execute(
+        sa.select(expenses.c.id, expenses.c.amount_cents - split_sum)
+        .join(expense_splits, expense_splits.c.expense_id == expenses.c.id)
+        .group_by(expenses.c.id, expenses.c.amount_cents)
+        .having(expenses.c.amount_cents != split_sum)
+    ).all()
+    for expense_id, difference in mismatched:
+        split_id = connection.execute(
+            sa.select(expense_splits.c.id).where(expense_splits.c.expense_id == expense_id)
+            .order_by(expense_splits.c.amount_cents.desc(), expense_splits.c.id).limit(1)
+        ).scalar()
+        connection.execute(
+            sa.update(expense_splits).where(expense_splits.c.id == split_id)
+            .values(amount_cents=expense_splits.c.amount_cents + int(difference))
+        )
+
+
+def _ledger_rows(connection):
+    totals = defaultdict(lambda: dict.fromkeys(LEDGER_FIELDS, 0))
+    for group_id, user_id, owed, own_share in connection.execute(
+        sa.select(
+            expenses.c.group_id, expense_splits.c.user_id, sa.func.sum(expense_splits.c.amount_cents),
+            sa.func.sum(sa.case((expenses.c.paid_by == expense_splits.c.user_id, expense_splits.c.amount_cents), else_=0)),
+        ).join(expenses, expense_splits.c.expense_id == expenses.c.id)
+        .group_by(expenses.c.group_id, expense_splits.c.user_id)
+    ):
+        totals[group_id, user_id]["owed"] += int(owed or 0)
+        totals[group_id, user_id]["own_share"] += int(own_share or 0)
+    sums = [
+        ("paid", expenses.c.paid_by, expenses),
+        ("settlements_made", settlements.c.payer_id, settlements),
+        ("settlements_received", settlements.c.payee_id, settlements),
+    ]
+    for name, user_column, table in sums:
+        for group_id, user_id, amount in connection.execute(
+            sa.select(table.c.group_id, user_column, sa.func.sum(table.c.amount_cents))
+            .group_by(table.c.group_id, user_column)
+        ):
+            totals[group_id, user_id][name] += int(amount or 0)
+    return [{"group_id": group_id, "user_id": user_id, **fields} for (group_id, user_id), fields in totals.items()]
+
+
+def upgrade():
+    connection = op.get_bind()
+    inspector = sa.inspect(connection)
+    existing = set(inspector.get_table_names())
+    legacy = [
+        table for table in MONEY_TABLES
+        if table in existing and "amount" in {column["name"] for column in inspector.get_columns(table)}
+    ]
+    if not legacy:
+        return
+    for table in legacy:
+        _convert(table)
+    if set(MONEY_TABLES) - existing:
+        return  # Nothing to rebuild the ledger from; 0001 creates the rest
+
+    _fix_split_rounding(connection)
+    # The ledger is derived data; recreate it with integer columns
+    if "group_member_balances" in existing:
+        op.drop_table("group_member_balances")
+    ledger = op.create_table(
+        "group_member_balances",
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("paid", sa.BigInteger(), nullable=False),
+        sa.Column("owed", sa.BigInteger(), nullable=False),
+        sa.Column("own_share", sa.BigInteger(), nullable=False),
+        sa.Column("settlements_made", sa.BigInteger(), nullable=False),
+        sa.Column("settlements_received", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+    rows = _ledger_rows(connection)
+    if rows:
+        op.bulk_insert(ledger, rows)
+
+
+def downgrade():
+    # Float amounts aren't restored
+    pass
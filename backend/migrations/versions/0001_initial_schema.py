@@ -0,0 +1,125 @@
+"""Initial schema
+
+The tables and indexes as they were created by Base.metadata.create_all
+before migrations were introduced. Databases created that way already
+have some or all of them, so only the missing ones are created; that lets
+existing deployments upgrade from an empty revision history. Those that
+still store float amounts are converted to cents by 0000 first.
+
+Revision ID: 0001
+Revises: 0000
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = "0000"
+branch_labels = None
+depends_on = None
+
+split_type = sa.Enum("EQUAL", "PERCENTAGE", name="splittype")
+
+INDEXES = [
+    ("ix_users_id", "users", ["id"], False),
+    ("ix_users_email", "users", ["email"], True),
+    ("ix_groups_id", "groups", ["id"], False),
+    ("ix_group_members_id", "group_members", ["id"], False),
+    ("ix_expenses_id", "expenses", ["id"], False),
+    ("ix_expenses_group_created", "expenses", ["group_id", "created_at", "id"], False),
+    ("ix_expenses_group_payer_created", "expenses", ["group_id", "paid_by", "created_at", "id"], False),
+    ("ix_expenses_group_amount", "expenses", ["group_id", "amount_cents"], False),
+    ("ix_expense_splits_id", "expense_splits", ["id"], False),
+    ("ix_expense_splits_expense", "expense_splits", ["expense_id"], False),
+    ("ix_expense_splits_user_expense", "expense_splits", ["user_id", "expense_id"], False),
+    ("ix_settlements_id", "settlements", ["id"], False),
+]
+
+
+def _create_tables(existing):
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("email", sa.String(), nullable=False),
+            sa.Column("created_at", sa.DateTime()),
+        )
+    if "groups" not in existing:
+        op.create_table(
+            "groups",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("description", sa.Text()),
+            sa.Column("created_at", sa.DateTime()),
+        )
+    if "group_members" not in existing:
+        op.create_table(
+            "group_members",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("joined_at", sa.DateTime()),
+        )
+    if "expenses" not in existing:
+        op.create_table(
+            "expenses",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("description", sa.String(), nullable=False),
+            sa.Column("amount_cents", sa.BigInteger(), nullable=False),
+            sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), nullable=False),
+            sa.Column("paid_by", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("split_type", split_type, nullable=False),
+            sa.Column("created_at", sa.DateTime()),
+        )
+    if "expense_splits" not in existing:
+        op.create_table(
+            "expense_splits",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("expense_id", sa.Integer(), sa.ForeignKey("expenses.id"), nullable=False),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("amount_cents", sa.BigInteger(), nullable=False),
+            sa.Column("percentage", sa.Float()),
+        )
+    if "settlements" not in existing:
+        op.create_table(
+            "settlements",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), nullable=False),
+            sa.Column("payer_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("payee_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("amount_cents", sa.BigInteger(), nullable=False),
+            sa.Column("description", sa.String()),
+            sa.Column("settled_at", sa.DateTime()),
+        )
+    if "group_member_balances" not in existing:
+        op.create_table(
+            "group_member_balances",
+            sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+            sa.Column("paid", sa.BigInteger(), nullable=False),
+            sa.Column("owed", sa.BigInteger(), nullable=False),
+            sa.Column("own_share", sa.BigInteger(), nullable=False),
+            sa.Column("settlements_made", sa.BigInteger(), nullable=False),
+            sa.Column("settlements_received", sa.BigInteger(), nullable=False),
+            sa.Column("updated_at", sa.DateTime()),
+        )
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    _create_tables(set(inspector.get_table_names()))
+
+    inspector = sa.inspect(op.get_bind())
+    existing = set()
+    for table in {table for _, table, _, _ in INDEXES}:
+        existing.update(index["name"] for index in inspector.get_indexes(table))
+    for name, table, columns, unique in INDEXES:
+        if name not in existing:
+            op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    for table in ["group_member_balances", "settlements", "expense_splits", "expenses", "group_members", "groups", "users"]:
+        op.drop_table(table)
+    split_type.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,48 @@
+"""Hot query indexes and unique group memberships
+
+Adds covering indexes for the balance aggregates and membership lookups,
+and makes (group_id, user_id) unique in group_members. Duplicate
+memberships left by older versions are removed first, keeping the oldest.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "DELETE FROM group_members WHERE id NOT IN "
+        "(SELECT MIN(id) FROM group_members GROUP BY group_id, user_id)"
+    )
+    with op.batch_alter_table("group_members") as batch:
+        batch.create_unique_constraint("uq_group_members_group_user", ["group_id", "user_id"])
+    op.create_index("ix_group_members_user_group", "group_members", ["user_id", "group_id"])
+
+    op.create_index("ix_expenses_group_payer_amount", "expenses", ["group_id", "paid_by", "amount_cents"])
+
+    # The covering index starts with expense_id, so the old one is redundant
+    op.create_index(
+        "ix_expense_splits_expense_user_amount", "expense_splits", ["expense_id", "user_id", "amount_cents"]
+    )
+    op.drop_index("ix_expense_splits_expense", table_name="expense_splits")
+
+    op.create_index("ix_settlements_group_payer_amount", "settlements", ["group_id", "payer_id", "amount_cents"])
+    op.create_index("ix_settlements_group_payee_amount", "settlements", ["group_id", "payee_id", "amount_cents"])
+
+
+def downgrade():
+    op.drop_index("ix_settlements_group_payee_amount", table_name="settlements")
+    op.drop_index("ix_settlements_group_payer_amount", table_name="settlements")
+    op.create_index("ix_expense_splits_expense", "expense_splits", ["expense_id"])
+    op.drop_index("ix_expense_splits_expense_user_amount", table_name="expense_splits")
+    op.drop_index("ix_expenses_group_payer_amount", table_name="expenses")
+    op.drop_index("ix_group_members_user_group", table_name="group_members")
+    with op.batch_alter_table("group_members") as batch:
+        batch.drop_constraint("uq_group_members_group_user", type_="unique")
@@ -0,0 +1,35 @@
+"""Balance snapshots
+
+Adds balance_snapshots, per-member totals of a group as of a point in
+time, used as checkpoints by the historical balance queries.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "balance_snapshots",
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), primary_key=True),
+        sa.Column("as_of", sa.DateTime(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("paid", sa.BigInteger(), nullable=False),
+        sa.Column("owed", sa.BigInteger(), nullable=False),
+        sa.Column("own_share", sa.BigInteger(), nullable=False),
+        sa.Column("settlements_made", sa.BigInteger(), nullable=False),
+        sa.Column("settlements_received", sa.BigInteger(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+    )
+
+
+def downgrade():
+    op.drop_table("balance_snapshots")
@@ -0,0 +1,162 @@
+"""Ledger event journal and projections
+
+Adds ledger_events, the append-only journal, along with the checkpoints
+and read models of the projections built from it. The journal is seeded
+with the history that already exists. Each group gets a GroupCreated event,
+then its expenses and settlements in time order, so projections built from
+the start match the ledger.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 200
+
+groups = sa.table(
+    "groups", sa.column("id", sa.Integer), sa.column("name", sa.String), sa.column("description", sa.Text),
+    sa.column("created_at", sa.DateTime),
+)
+group_members = sa.table(
+    "group_members", sa.column("id", sa.Integer), sa.column("group_id", sa.Integer), sa.column("user_id", sa.Integer)
+)
+expenses = sa.table(
+    "expenses", sa.column("id", sa.Integer), sa.column("group_id", sa.Integer),
+    sa.column("description", sa.String), sa.column("amount_cents", sa.BigInteger),
+    sa.column("paid_by", sa.Integer), sa.column("split_type", sa.String), sa.column("created_at", sa.DateTime),
+)
+expense_splits = sa.table(
+    "expense_splits", sa.column("id", sa.Integer), sa.column("expense_id", sa.Integer),
+    sa.column("user_id", sa.Integer), sa.column("amount_cents", sa.BigInteger), sa.column("percentage", sa.Float),
+)
+settlements = sa.table(
+    "settlements", sa.column("id", sa.Integer), sa.column("group_id", sa.Integer),
+    sa.column("payer_id", sa.Integer), sa.column("payee_id", sa.Integer), sa.column("amount_cents", sa.BigInteger),
+    sa.column("description", sa.String), sa.column("settled_at", sa.DateTime),
+)
+ledger_events = sa.table(
+    "ledger_events", sa.column("group_id", sa.Integer), sa.column("type", sa.String),
+    sa.column("entity_id", sa.Integer), sa.column("payload", sa.JSON), sa.column("created_at", sa.DateTime),
+)
+
+
+def _timestamp(moment):
+    return moment.isoformat() if moment is not None else None
+
+
+def _group_events(connection, group_ids):
+    members = {group_id: [] for group_id in group_ids}
+    for group_id, user_id in connection.execute(
+        sa.select(group_members.c.group_id, group_members.c.user_id)
+        .where(group_members.c.group_id.in_(group_ids)).order_by(group_members.c.id)
+    ):
+        members[group_id].append(user_id)
+
+    splits = {}
+    for expense_id, user_id, amount_cents, percentage in connection.execute(
+        sa.select(expense_splits.c.expense_id, expense_splits.c.user_id, expense_splits.c.amount_cents,
+                  expense_splits.c.percentage)
+        .join(expenses, expenses.c.id == expense_splits.c.expense_id)
+        .where(expenses.c.group_id.in_(group_ids)).order_by(expense_splits.c.id)
+    ):
+        splits.setdefault(expense_id, []).append([user_id, amount_cents, percentage])
+
+    history = {group_id: ([], []) for group_id in group_ids}
+    for row in connection.execute(
+        sa.select(expenses).where(expenses.c.group_id.in_(group_ids)).order_by(expenses.c.created_at, expenses.c.id)
+    ):
+        history[row.group_id][0].append((row.created_at, 0, row.id, {
+            "group_id": row.group_id, "type": "ExpenseCreated", "entity_id": row.id, "created_at": row.created_at,
+            "payload": {
+                "id": row.id, "description": row.description, "amount_cents": row.amount_cents,
+                "paid_by": row.paid_by, "split_type": row.split_type.lower(),
+                "created_at": _timestamp(row.created_at), "splits": splits.get(row.id, []),
+            },
+        }))
+    for row in connection.execute(
+        sa.select(settlements).where(settlements.c.group_id.in_(group_ids))
+        .order_by(settlements.c.settled_at, settlements.c.id)
+    ):
+        history[row.group_id][1].append((row.settled_at, 1, row.id, {
+            "group_id": row.group_id, "type": "SettlementRecorded", "entity_id": row.id, "created_at": row.settled_at,
+            "payload": {
+                "id": row.id, "payer_id": row.payer_id, "payee_id": row.payee_id, "amount_cents": row.amount_cents,
+                "description": row.description, "settled_at": _timestamp(row.settled_at),
+            },
+        }))
+    return members, history
+
+
+def _backfill(connection):
+    group_rows = connection.execute(sa.select(groups).order_by(groups.c.id)).all()
+    for start in range(0, len(group_rows), BATCH_SIZE):
+        batch = group_rows[start:start + BATCH_SIZE]
+        members, history = _group_events(connection, [group.id for group in batch])
+        rows = []
+        for group in batch:
+            rows.append({
+                "group_id": group.id, "type": "GroupCreated", "entity_id": group.id, "created_at": group.created_at,
+                "payload": {"name": group.name, "description": group.description, "member_ids": members[group.id]},
+            })
+            # Rows without a timestamp sort first
+            expense_events, settlement_events = history[group.id]
+            rows.extend(entry[3] for entry in sorted(
+                expense_events + settlement_events,
+                key=lambda entry: (entry[0] is not None, entry[0] or 0, entry[1], entry[2])
+            ))
+        connection.execute(sa.insert(ledger_events), rows)
+
+
+def upgrade():
+    op.create_table(
+        "ledger_events",
+        sa.Column("id", sa.BigInteger().with_variant(sa.Integer(), "sqlite"), primary_key=True),
+        sa.Column("group_id", sa.Integer(), nullable=False),
+        sa.Column("type", sa.String(40), nullable=False),
+        sa.Column("entity_id", sa.Integer()),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.create_index("ix_ledger_events_group_id", "ledger_events", ["group_id", "id"])
+    op.create_table(
+        "projection_checkpoints",
+        sa.Column("name", sa.String(40), primary_key=True),
+        sa.Column("position", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.DateTime()),
+    )
+    op.create_table(
+        "projected_balances",
+        sa.Column("group_id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), primary_key=True),
+        sa.Column("paid", sa.BigInteger(), nullable=False),
+        sa.Column("owed", sa.BigInteger(), nullable=False),
+        sa.Column("own_share", sa.BigInteger(), nullable=False),
+        sa.Column("settlements_made", sa.BigInteger(), nullable=False),
+        sa.Column("settlements_received", sa.BigInteger(), nullable=False),
+    )
+    op.create_table(
+        "group_activity",
+        sa.Column("group_id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("expense_count", sa.Integer(), nullable=False),
+        sa.Column("settlement_count", sa.Integer(), nullable=False),
+        sa.Column("total_expense_cents", sa.BigInteger(), nullable=False),
+        sa.Column("last_event_id", sa.BigInteger(), nullable=False),
+        sa.Column("last_activity_at", sa.DateTime()),
+    )
+    _backfill(op.get_bind())
+
+
+def downgrade():
+    op.drop_table("group_activity")
+    op.drop_table("projected_balances")
+    op.drop_table("projection_checkpoints")
+    op.drop_index("ix_ledger_events_group_id", table_name="ledger_events")
+    op.drop_table("ledger_events")
@@ -0,0 +1,59 @@
+"""Foreign key delete rules and group archiving
+
+Recreates the foreign keys with ON DELETE rules, so deleting a user, group
+or expense removes the rows that only exist for it in the same statement:
+memberships, ledger rows, snapshots, splits and a group's settlements
+cascade, while expenses, splits and settlements restrict deleting the users
+they name and expenses restrict deleting their group. Also adds
+groups.archived_at.
+
+On SQLite the tables are rebuilt in batch mode; the unnamed foreign keys
+they have are matched through the naming convention below, which gives
+them the names PostgreSQL gives by default.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+# table: [(column, referred table, ON DELETE rule)]
+FOREIGN_KEYS = {
+    "group_members": [("group_id", "groups", "CASCADE"), ("user_id", "users", "CASCADE")],
+    "expenses": [("group_id", "groups", "RESTRICT"), ("paid_by", "users", "RESTRICT")],
+    "expense_splits": [("expense_id", "expenses", "CASCADE"), ("user_id", "users", "RESTRICT")],
+    "settlements": [
+        ("group_id", "groups", "CASCADE"), ("payer_id", "users", "RESTRICT"), ("payee_id", "users", "RESTRICT")
+    ],
+    "group_member_balances": [("group_id", "groups", "CASCADE"), ("user_id", "users", "CASCADE")],
+    "balance_snapshots": [("group_id", "groups", "CASCADE"), ("user_id", "users", "CASCADE")],
+}
+
+
+def _recreate_foreign_keys(with_rules: bool):
+    for table, foreign_keys in FOREIGN_KEYS.items():
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch:
+            for column, referred, rule in foreign_keys:
+                name = f"{table}_{column}_fkey"
+                batch.drop_constraint(name, type_="foreignkey")
+                batch.create_foreign_key(name, referred, [column], ["id"], ondelete=rule if with_rules else None)
+
+
+def upgrade():
+    _recreate_foreign_keys(True)
+    with op.batch_alter_table("groups") as batch:
+        batch.add_column(sa.Column("archived_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("groups") as batch:
+        batch.drop_column("archived_at")
+    _recreate_foreign_keys(False)
@@ -0,0 +1,93 @@
+"""History archive
+
+Adds the archive tables that settled expenses, splits and settlements move
+to, and group_opening_balances, which stands in for them in balance
+aggregates. On SQLite, expenses, expense_splits and settlements are rebuilt
+with AUTOINCREMENT so the ids of archived rows are never handed out again.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+HOT_TABLES = ["expenses", "expense_splits", "settlements"]
+
+# The type already exists on PostgreSQL, created with expenses
+split_type = sa.Enum("EQUAL", "PERCENTAGE", name="splittype").with_variant(
+    postgresql.ENUM("EQUAL", "PERCENTAGE", name="splittype", create_type=False), "postgresql"
+)
+
+
+def _set_autoincrement(enabled: bool):
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    for table in HOT_TABLES:
+        with op.batch_alter_table(table, recreate="always", table_kwargs={"sqlite_autoincrement": enabled}):
+            pass
+
+
+def upgrade():
+    _set_autoincrement(True)
+    op.create_table(
+        "group_opening_balances",
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id", ondelete="RESTRICT"), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="RESTRICT"), primary_key=True),
+        sa.Column("as_of", sa.DateTime(), nullable=False),
+        sa.Column("paid", sa.BigInteger(), nullable=False),
+        sa.Column("owed", sa.BigInteger(), nullable=False),
+        sa.Column("own_share", sa.BigInteger(), nullable=False),
+        sa.Column("settlements_made", sa.BigInteger(), nullable=False),
+        sa.Column("settlements_received", sa.BigInteger(), nullable=False),
+    )
+    op.create_table(
+        "archived_expenses",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("description", sa.String(), nullable=False),
+        sa.Column("amount_cents", sa.BigInteger(), nullable=False),
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id", ondelete="RESTRICT"), nullable=False),
+        sa.Column("paid_by", sa.Integer(), sa.ForeignKey("users.id", ondelete="RESTRICT"), nullable=False),
+        sa.Column("split_type", split_type, nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("archived_at", sa.DateTime()),
+    )
+    op.create_index("ix_archived_expenses_group_created", "archived_expenses", ["group_id", "created_at", "id"])
+    op.create_table(
+        "archived_expense_splits",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("expense_id", sa.Integer(), sa.ForeignKey("archived_expenses.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="RESTRICT"), nullable=False),
+        sa.Column("amount_cents", sa.BigInteger(), nullable=False),
+        sa.Column("percentage", sa.Float()),
+    )
+    op.create_index("ix_archived_expense_splits_expense", "archived_expense_splits", ["expense_id"])
+    op.create_table(
+        "archived_settlements",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id", ondelete="RESTRICT"), nullable=False),
+        sa.Column("payer_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="RESTRICT"), nullable=False),
+        sa.Column("payee_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="RESTRICT"), nullable=False),
+        sa.Column("amount_cents", sa.BigInteger(), nullable=False),
+        sa.Column("description", sa.String()),
+        sa.Column("settled_at", sa.DateTime()),
+        sa.Column("archived_at", sa.DateTime()),
+    )
+    op.create_index("ix_archived_settlements_group_settled", "archived_settlements", ["group_id", "settled_at", "id"])
+
+
+def downgrade():
+    op.drop_index("ix_archived_settlements_group_settled", table_name="archived_settlements")
+    op.drop_table("archived_settlements")
+    op.drop_index("ix_archived_expense_splits_expense", table_name="archived_expense_splits")
+    op.drop_table("archived_expense_splits")
+    op.drop_index("ix_archived_expenses_group_created", table_name="archived_expenses")
+    op.drop_table("archived_expenses")
+    op.drop_table("group_opening_balances")
+    _set_autoincrement(False)
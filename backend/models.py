@@ -1,9 +1,10 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, DateTime, ForeignKey, Enum, Text, Index, UniqueConstraint, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.sql import func
 import enum
 from datetime import datetime
+from money import from_cents
 
 Base = declarative_base()
 
@@ -19,10 +20,11 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     created_at = Column(DateTime, default=func.now())
     
-    # Relationships
-    group_memberships = relationship("GroupMember", back_populates="user")
-    expenses_paid = relationship("Expense", back_populates="paid_by_user")
-    expense_splits = relationship("ExpenseSplit", back_populates="user")
+    # Relationships. Deleting a user cascades to their memberships in the
+    # database; expenses and splits restrict it, so the ORM leaves them alone
+    group_memberships = relationship("GroupMember", back_populates="user", passive_deletes=True)
+    expenses_paid = relationship("Expense", back_populates="paid_by_user", passive_deletes="all")
+    expense_splits = relationship("ExpenseSplit", back_populates="user", passive_deletes="all")
 
 class Group(Base):
     __tablename__ = "groups"
@@ -31,61 +33,96 @@ class Group(Base):
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
     created_at = Column(DateTime, default=func.now())
+    archived_at = Column(DateTime, nullable=True)  # Set once the group is archived; it then takes no new writes
     
-    # Relationships
-    members = relationship("GroupMember", back_populates="group")
-    expenses = relationship("Expense", back_populates="group")
-    settlements = relationship("Settlement", back_populates="group")
+    # Relationships. Deleting a group cascades to its members and settlements
+    # in the database and is restricted while it has expenses
+    members = relationship("GroupMember", back_populates="group", passive_deletes=True)
+    expenses = relationship("Expense", back_populates="group", passive_deletes="all")
+    settlements = relationship("Settlement", back_populates="group", passive_deletes=True)
 
 class GroupMember(Base):
     __tablename__ = "group_members"
     
     id = Column(Integer, primary_key=True, index=True)
-    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     joined_at = Column(DateTime, default=func.now())
     
     # Relationships
     group = relationship("Group", back_populates="members")
     user = relationship("User", back_populates="group_memberships")
+    
+    # A user is in a group at most once; the constraint's index also serves
+    # lookups by group, and the second index the groups of a user
+    __table_args__ = (
+        UniqueConstraint("group_id", "user_id", name="uq_group_members_group_user"),
+        Index("ix_group_members_user_group", "user_id", "group_id"),
+    )
 
 class Expense(Base):
     __tablename__ = "expenses"
     
     id = Column(Integer, primary_key=True, index=True)
     description = Column(String, nullable=False)
-    amount = Column(Float, nullable=False)
-    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
-    paid_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="RESTRICT"), nullable=False)
+    paid_by = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)
     split_type = Column(Enum(SplitType), nullable=False)
     created_at = Column(DateTime, default=func.now())
     
     # Relationships
     group = relationship("Group", back_populates="expenses")
     paid_by_user = relationship("User", back_populates="expenses_paid")
-    splits = relationship("ExpenseSplit", back_populates="expense")
+    splits = relationship("ExpenseSplit", back_populates="expense", passive_deletes=True)
+    
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+    
+    # Keyset pagination and the listing filters walk (group_id, created_at, id)
+    __table_args__ = (
+        Index("ix_expenses_group_created", "group_id", "created_at", "id"),
+        Index("ix_expenses_group_payer_created", "group_id", "paid_by", "created_at", "id"),
+        Index("ix_expenses_group_amount", "group_id", "amount_cents"),
+        # Covers the per-payer sum when balances are recomputed
+        Index("ix_expenses_group_payer_amount", "group_id", "paid_by", "amount_cents"),
+        # Ids must not be reused once the newest rows move to the archive
+        {"sqlite_autoincrement": True},
+    )
 
 class ExpenseSplit(Base):
     __tablename__ = "expense_splits"
     
     id = Column(Integer, primary_key=True, index=True)
-    expense_id = Column(Integer, ForeignKey("expenses.id"), nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    amount = Column(Float, nullable=False)  # Amount this user owes for this expense
+    expense_id = Column(Integer, ForeignKey("expenses.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)  # Amount this user owes for this expense
     percentage = Column(Float, nullable=True)  # Only used for percentage splits
     
     # Relationships
     expense = relationship("Expense", back_populates="splits")
     user = relationship("User", back_populates="expense_splits")
+    
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+    
+    __table_args__ = (
+        # Covers the per-user split sums joined from expenses
+        Index("ix_expense_splits_expense_user_amount", "expense_id", "user_id", "amount_cents"),
+        Index("ix_expense_splits_user_expense", "user_id", "expense_id"),
+        {"sqlite_autoincrement": True},
+    )
 
 class Settlement(Base):
     __tablename__ = "settlements"
     
     id = Column(Integer, primary_key=True, index=True)
-    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
-    payer_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Who paid
-    payee_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Who received payment
-    amount = Column(Float, nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), nullable=False)
+    payer_id = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)  # Who paid
+    payee_id = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)  # Who received payment
+    amount_cents = Column(BigInteger, nullable=False)
     description = Column(String, nullable=True)
     settled_at = Column(DateTime, default=func.now())
     
@@ -93,3 +130,179 @@ class Settlement(Base):
     group = relationship("Group")
     payer = relationship("User", foreign_keys=[payer_id])
     payee = relationship("User", foreign_keys=[payee_id])
+    
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+    
+    # Cover the settlements made and received sums per group member
+    __table_args__ = (
+        Index("ix_settlements_group_payer_amount", "group_id", "payer_id", "amount_cents"),
+        Index("ix_settlements_group_payee_amount", "group_id", "payee_id", "amount_cents"),
+        {"sqlite_autoincrement": True},
+    )
+
+# Running per-member totals in cents, kept up to date by the write endpoints (see ledger.py)
+class GroupMemberBalance(Base):
+    __tablename__ = "group_member_balances"
+    
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    paid = Column(BigInteger, nullable=False, default=0)  # Sum of expenses this user paid
+    owed = Column(BigInteger, nullable=False, default=0)  # Sum of this user's splits
+    own_share = Column(BigInteger, nullable=False, default=0)  # Splits on expenses this user paid
+    settlements_made = Column(BigInteger, nullable=False, default=0)
+    settlements_received = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+# Per-member totals of a group as of a point in time, the starting point
+# for historical balance queries (see snapshots.py)
+class BalanceSnapshot(Base):
+    __tablename__ = "balance_snapshots"
+    
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    as_of = Column(DateTime, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    paid = Column(BigInteger, nullable=False, default=0)
+    owed = Column(BigInteger, nullable=False, default=0)
+    own_share = Column(BigInteger, nullable=False, default=0)
+    settlements_made = Column(BigInteger, nullable=False, default=0)
+    settlements_received = Column(BigInteger, nullable=False, default=0)
+    created_at = Column(DateTime, default=func.now())
+
+# Totals of each member over a group's archived expenses and settlements,
+# which stand in for them in balance aggregates (see archive.py). as_of is
+# the archive cutoff, the same on every row of a group
+class GroupOpeningBalance(Base):
+    __tablename__ = "group_opening_balances"
+    
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="RESTRICT"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), primary_key=True)
+    as_of = Column(DateTime, nullable=False)
+    paid = Column(BigInteger, nullable=False, default=0)
+    owed = Column(BigInteger, nullable=False, default=0)
+    own_share = Column(BigInteger, nullable=False, default=0)
+    settlements_made = Column(BigInteger, nullable=False, default=0)
+    settlements_received = Column(BigInteger, nullable=False, default=0)
+
+# Archived rows keep the ids and columns they had in expenses,
+# expense_splits and settlements
+class ArchivedExpense(Base):
+    __tablename__ = "archived_expenses"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String, nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="RESTRICT"), nullable=False)
+    paid_by = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)
+    split_type = Column(Enum(SplitType), nullable=False)
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=func.now())
+    
+    archived = True
+    
+    # Relationships
+    paid_by_user = relationship("User", viewonly=True)
+    splits = relationship("ArchivedExpenseSplit", viewonly=True)
+    
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+    
+    __table_args__ = (
+        Index("ix_archived_expenses_group_created", "group_id", "created_at", "id"),
+    )
+
+class ArchivedExpenseSplit(Base):
+    __tablename__ = "archived_expense_splits"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    expense_id = Column(Integer, ForeignKey("archived_expenses.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    percentage = Column(Float, nullable=True)
+    
+    # Relationships
+    user = relationship("User", viewonly=True)
+    
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+    
+    __table_args__ = (
+        Index("ix_archived_expense_splits_expense", "expense_id"),
+    )
+
+class ArchivedSettlement(Base):
+    __tablename__ = "archived_settlements"
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    group_id = Column(Integer, ForeignKey("groups.id", ondelete="RESTRICT"), nullable=False)
+    payer_id = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)
+    payee_id = Column(Integer, ForeignKey("users.id", ondelete="RESTRICT"), nullable=False)
+    amount_cents = Column(BigInteger, nullable=False)
+    description = Column(String, nullable=True)
+    settled_at = Column(DateTime)
+    archived_at = Column(DateTime, default=func.now())
+    archived = True
+    
+    # Relationships
+    payer = relationship("User", foreign_keys=[payer_id], viewonly=True)
+    payee = relationship("User", foreign_keys=[payee_id], viewonly=True)
+    
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+    
+    __table_args__ = (
+        Index("ix_archived_settlements_group_settled", "group_id", "settled_at", "id"),
+    )
+
+# Append-only journal of ledger events; the id is the event's offset (see journal.py).
+# group_id has no foreign key so a group's events outlive it
+class LedgerEvent(Base):
+    __tablename__ = "ledger_events"
+    
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    group_id = Column(Integer, nullable=False)
+    type = Column(String(40), nullable=False)
+    entity_id = Column(Integer, nullable=True)  # The expense, settlement or user the event is about
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=func.now())
+    
+    # Tailing one group's events
+    __table_args__ = (
+        Index("ix_ledger_events_group_id", "group_id", "id"),
+    )
+
+# Offset up to which each projection has applied the journal (see projections.py)
+class ProjectionCheckpoint(Base):
+    __tablename__ = "projection_checkpoints"
+    
+    name = Column(String(40), primary_key=True)
+    position = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+# Per-member totals built from the journal by the balances projection
+class ProjectedBalance(Base):
+    __tablename__ = "projected_balances"
+    
+    group_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    paid = Column(BigInteger, nullable=False, default=0)
+    owed = Column(BigInteger, nullable=False, default=0)
+    own_share = Column(BigInteger, nullable=False, default=0)
+    settlements_made = Column(BigInteger, nullable=False, default=0)
+    settlements_received = Column(BigInteger, nullable=False, default=0)
+
+# Per-group listing figures built from the journal by the activity projection
+class GroupActivity(Base):
+    __tablename__ = "group_activity"
+    
+    group_id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=True)
+    expense_count = Column(Integer, nullable=False, default=0)
+    settlement_count = Column(Integer, nullable=False, default=0)
+    total_expense_cents = Column(BigInteger, nullable=False, default=0)
+    last_event_id = Column(BigInteger, nullable=False, default=0)
+    last_activity_at = Column(DateTime, nullable=True)
@@ -0,0 +1,42 @@
+"""
+Money helpers. Amounts are stored as integer cents; the API speaks in
+decimal currency units.
+"""
+from decimal import Decimal, ROUND_FLOOR, ROUND_HALF_UP
+
+
+def to_cents(amount) -> int:
+    """
+    Converts a currency amount (float, str or Decimal) to integer cents,
+    rounding half up.
+    """
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> float:
+    return cents / 100
+
+
+def allocate(total_cents: int, weights):
+    """
+    Splits total_cents in proportion to weights using the largest remainder
+    method. The parts always sum to total_cents exactly; leftover cents go to
+    the largest remainders, with earlier entries winning ties.
+    """
+    weights = [Decimal(str(weight)) for weight in weights]
+    weight_sum = sum(weights)
+    if not weights or weight_sum <= 0:
+        raise ValueError("Weights must be non-empty and sum to a positive value")
+
+    shares = []
+    remainders = []
+    for index, weight in enumerate(weights):
+        exact = Decimal(total_cents) * weight / weight_sum
+        share = int(exact.to_integral_value(rounding=ROUND_FLOOR))
+        shares.append(share)
+        remainders.append((exact - share, -index))
+
+    leftover = total_cents - sum(shares)
+    for _, negative_index in sorted(remainders, reverse=True)[:leftover]:
+        shares[-negative_index] += 1
+    return shares
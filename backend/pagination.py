@@ -0,0 +1,26 @@
+import base64
+from datetime import datetime
+from fastapi import HTTPException
+
+# Response header carrying the cursor of the next page, if any
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """
+    Encodes the (created_at, id) keyset position of the last row of a page.
+    """
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Decodes a cursor produced by encode_cursor into (created_at, id).
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,303 @@
+"""
+Read models built from the journal.
+
+Each projection applies journal events in offset order. It records the
+offset it has applied up to in projection_checkpoints, in the same
+transaction as its read-model changes. So a crashed or restarted run picks
+up exactly where the last commit left off and never applies an event twice,
+and every run only reads the events after the checkpoint, batch by batch.
+
+Projections:
+    balances  per-member totals in projected_balances, the same figures
+              the ledger keeps in group_member_balances
+    activity  per-group expense and settlement counts, total spent and
+              last activity in group_activity, for listings
+
+The API keeps reading balances from the ledger, which the write
+transaction updates itself; these read models are for consumers that can
+lag behind, such as reporting, exports or another database. `verify`
+checks the balances projection against the ledger, which also shows that
+the journal is complete.
+
+Usage (e.g. every minute from cron, or with --follow):
+    python projections.py run [--name balances] [--batch-size 1000] [--follow SECONDS]
+    python projections.py status
+    python projections.py reset NAME
+    python projections.py verify
+"""
+import argparse
+import time
+from collections import defaultdict
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import journal
+import ledger
+import models
+from money import from_cents
+
+BATCH_SIZE = 1000
+
+
+def _expense_deltas(state: dict, sign: int = 1, deltas=None):
+    return ledger.expense_deltas(
+        state["paid_by"], state["amount_cents"], [(user_id, share) for user_id, share, _ in state["splits"]],
+        sign, deltas
+    )
+
+
+def _settlement_deltas(state: dict, sign: int = 1):
+    return {
+        state["payer_id"]: {"settlements_made": sign * state["amount_cents"]},
+        state["payee_id"]: {"settlements_received": sign * state["amount_cents"]},
+    }
+
+
+class Projection:
+    """
+    A read model kept up to date from the journal.
+    """
+    name = None
+
+    def apply(self, db: Session, events):
+        """
+        Applies a batch of events, oldest first. The runner commits.
+        """
+        raise NotImplementedError
+
+    def reset(self, db: Session):
+        """
+        Deletes the read model so it is rebuilt from the start.
+        """
+        raise NotImplementedError
+
+
+class BalanceProjection(Projection):
+    name = "balances"
+
+    def apply(self, db: Session, events):
+        table = models.ProjectedBalance
+        rows = {
+            (row.group_id, row.user_id): row
+            for row in db.query(table).filter(table.group_id.in_({event.group_id for event in events})).all()
+        }
+
+        def add(group_id, deltas):
+            for user_id, fields in deltas.items():
+                row = rows.get((group_id, user_id))
+                if row is None:
+                    row = table(group_id=group_id, user_id=user_id, **{name: 0 for name in ledger.LEDGER_FIELDS})
+                    db.add(row)
+                    rows[(group_id, user_id)] = row
+                for name, value in fields.items():
+                    setattr(row, name, getattr(row, name) + value)
+
+        def remove(keys):
+            db.flush()
+            for key in keys:
+                db.delete(rows.pop(key))
+
+        for event in events:
+            payload = event.payload
+            if event.type == journal.EXPENSE_CREATED:
+                add(event.group_id, _expense_deltas(payload))
+            elif event.type == journal.EXPENSE_UPDATED:
+                add(event.group_id, _expense_deltas(payload["after"], deltas=_expense_deltas(payload["before"], -1)))
+            elif event.type == journal.EXPENSE_DELETED:
+                add(event.group_id, _expense_deltas(payload, -1))
+            elif event.type == journal.SETTLEMENT_RECORDED:
+                add(event.group_id, _settlement_deltas(payload))
+            elif event.type == journal.SETTLEMENT_DELETED:
+                add(event.group_id, _settlement_deltas(payload, -1))
+            elif event.type == journal.EXPENSES_PURGED:
+                add(event.group_id, {int(user_id): fields for user_id, fields in payload["deltas"].items()})
+            elif event.type == journal.GROUP_DELETED:
+                remove([key for key in rows if key[0] == event.group_id])
+            elif event.type == journal.MEMBER_REMOVED:
+                remove([key for key in [(event.group_id, payload["user_id"])] if key in rows])
+
+    def reset(self, db: Session):
+        db.query(models.ProjectedBalance).delete()
+
+
+class ActivityProjection(Projection):
+    name = "activity"
+
+    def apply(self, db: Session, events):
+        table = models.GroupActivity
+        rows = {
+            row.group_id: row
+            for row in db.query(table).filter(table.group_id.in_({event.group_id for event in events})).all()
+        }
+
+        for event in events:
+            if event.type == journal.GROUP_DELETED:
+                if event.group_id in rows:
+                    db.flush()
+                    db.delete(rows.pop(event.group_id))
+                continue
+
+            row = rows.get(event.group_id)
+            if row is None:
+                row = table(group_id=event.group_id, expense_count=0, settlement_count=0, total_expense_cents=0)
+                db.add(row)
+                rows[event.group_id] = row
+            payload = event.payload
+            if event.type == journal.GROUP_CREATED:
+                row.name = payload["name"]
+            elif event.type == journal.EXPENSE_CREATED:
+                row.expense_count += 1
+                row.total_expense_cents += payload["amount_cents"]
+            elif event.type == journal.EXPENSE_UPDATED:
+                row.total_expense_cents += payload["after"]["amount_cents"] - payload["before"]["amount_cents"]
+            elif event.type == journal.EXPENSE_DELETED:
+                row.expense_count -= 1
+                row.total_expense_cents -= payload["amount_cents"]
+            elif event.type == journal.EXPENSES_PURGED:
+                row.expense_count -= payload["count"]
+                row.total_expense_cents -= payload["amount_cents"]
+            elif event.type == journal.SETTLEMENT_RECORDED:
+                row.settlement_count += 1
+            elif event.type == journal.SETTLEMENT_DELETED:
+                row.settlement_count -= 1
+            row.last_event_id = event.id
+            row.last_activity_at = event.created_at
+
+    def reset(self, db: Session):
+        db.query(models.GroupActivity).delete()
+
+
+PROJECTIONS = {projection.name: projection for projection in (BalanceProjection(), ActivityProjection())}
+
+
+def _checkpoint(db: Session, name: str) -> models.ProjectionCheckpoint:
+    # Row lock, so two runners of one projection take turns
+    checkpoint = db.query(models.ProjectionCheckpoint).filter(
+        models.ProjectionCheckpoint.name == name
+    ).with_for_update().first()
+    if checkpoint is None:
+        checkpoint = models.ProjectionCheckpoint(name=name, position=0)
+        db.add(checkpoint)
+    return checkpoint
+
+
+def run(db: Session, projection: Projection, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Applies the events after the projection's checkpoint, committing each
+    batch together with the new checkpoint. Returns the number applied.
+    """
+    applied = 0
+    while True:
+        checkpoint = _checkpoint(db, projection.name)
+        events = db.query(models.LedgerEvent).filter(
+            models.LedgerEvent.id > checkpoint.position
+        ).order_by(models.LedgerEvent.id).limit(batch_size).all()
+        if not events:
+            db.rollback()
+            return applied
+        projection.apply(db, events)
+        checkpoint.position = events[-1].id
+        db.commit()
+        applied += len(events)
+
+
+def reset(db: Session, projection: Projection):
+    """
+    Clears the read model and its checkpoint. The caller commits.
+    """
+    projection.reset(db)
+    db.query(models.ProjectionCheckpoint).filter(models.ProjectionCheckpoint.name == projection.name).delete()
+
+
+def status(db: Session):
+    """
+    Returns (name, checkpoint offset, events behind) for every projection.
+    """
+    head = db.query(func.coalesce(func.max(models.LedgerEvent.id), 0)).scalar()
+    positions = dict(db.query(models.ProjectionCheckpoint.name, models.ProjectionCheckpoint.position).all())
+    result = []
+    for name in PROJECTIONS:
+        position = positions.get(name, 0)
+        behind = db.query(func.count(models.LedgerEvent.id)).filter(
+            models.LedgerEvent.id > position, models.LedgerEvent.id <= head
+        ).scalar()
+        result.append((name, position, behind))
+    return result
+
+
+def verify(db: Session):
+    """
+    Compares the balances projection with the ledger and returns a list of
+    drift entries (group_id, user_id, field, projected value, ledger value).
+    Bring the projection up to date first.
+    """
+    projected = defaultdict(dict)
+    for row in db.query(models.ProjectedBalance).all():
+        projected[row.group_id][row.user_id] = row
+    stored = defaultdict(dict)
+    for row in db.query(models.GroupMemberBalance).all():
+        stored[row.group_id][row.user_id] = row
+
+    drift = []
+    for group_id in sorted(set(projected) | set(stored)):
+        for user_id in sorted(set(projected[group_id]) | set(stored[group_id])):
+            have = projected[group_id].get(user_id)
+            want = stored[group_id].get(user_id)
+            for name in ledger.LEDGER_FIELDS:
+                have_value = getattr(have, name) if have is not None else 0
+                want_value = getattr(want, name) if want is not None else 0
+                if have_value != want_value:
+                    drift.append((group_id, user_id, name, have_value, want_value))
+    return drift
+
+
+def main():
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Build read models from the ledger event journal.")
+    parser.add_argument("command", choices=["run", "status", "reset", "verify"])
+    parser.add_argument("projection", nargs="?", choices=list(PROJECTIONS), help="Projection to reset")
+    parser.add_argument("--name", action="append", choices=list(PROJECTIONS),
+                        help="Projection to run (may be repeated; default all)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Events per transaction")
+    parser.add_argument("--follow", type=float, metavar="SECONDS", help="Keep running, polling this often")
+    args = parser.parse_args()
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        if args.command == "status":
+            for name, position, behind in status(db):
+                print(f"{name}: at offset {position}, {behind} event(s) behind")
+            return 0
+
+        if args.command == "reset":
+            if args.projection is None:
+                parser.error("reset needs the name of a projection")
+            reset(db, PROJECTIONS[args.projection])
+            db.commit()
+            print(f"Reset {args.projection}; the next run rebuilds it from the start")
+            return 0
+
+        if args.command == "verify":
+            run(db, PROJECTIONS["balances"], args.batch_size)
+            drift = verify(db)
+            for group_id, user_id, name, have, want in drift:
+                print(f"group {group_id} user {user_id}: {name} is {from_cents(have):.2f}, ledger has {from_cents(want):.2f}")
+            print(f"{len(drift)} drifted value(s)")
+            return 1 if drift else 0
+
+        names = args.name or list(PROJECTIONS)
+        while True:
+            for name in names:
+                applied = run(db, PROJECTIONS[name], args.batch_size)
+                if applied or not args.follow:
+                    print(f"{name}: applied {applied} event(s)")
+            if not args.follow:
+                return 0
+            time.sleep(args.follow)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
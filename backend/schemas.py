@@ -1,6 +1,7 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
+from enum import Enum
 from models import SplitType
 
 # User schemas
@@ -29,6 +30,7 @@ class GroupCreate(GroupBase):
 class Group(GroupBase):
     id: int
     created_at: datetime
+    archived_at: Optional[datetime] = None
     members: List[User] = []
     
     class Config:
@@ -37,6 +39,10 @@ class Group(GroupBase):
 class GroupDetails(Group):
     total_expenses: float
 
+class GroupInclude(str, Enum):
+    MEMBERS = "members"
+    NONE = "none"
+
 # Expense schemas
 class ExpenseSplitCreate(BaseModel):
     user_id: int
@@ -49,6 +55,37 @@ class ExpenseCreate(BaseModel):
     split_type: SplitType
     splits: Optional[List[ExpenseSplitCreate]] = None  # Only for percentage splits
 
+class ExpenseImportRow(ExpenseCreate):
+    created_at: Optional[datetime] = None
+
+class ImportFormat(str, Enum):
+    CSV = "csv"
+    JSONL = "jsonl"
+
+class BulkImportError(BaseModel):
+    row: int
+    error: str
+
+class BulkImportReport(BaseModel):
+    group_id: int
+    total_rows: int
+    imported: int
+    failed: int
+    errors: List[BulkImportError]
+
+class ExpensePurgeReport(BaseModel):
+    group_id: int
+    before: datetime
+    deleted: int
+    total_amount: float
+
+class GroupArchiveReport(BaseModel):
+    group_id: int
+    before: datetime  # Archive cutoff
+    archived_at: Optional[datetime] = None  # Set when the whole group was archived
+    expenses_archived: int
+    settlements_archived: int
+
 class ExpenseSplit(BaseModel):
     id: int
     user_id: int
@@ -68,6 +105,7 @@ class Expense(BaseModel):
     created_at: datetime
     paid_by_user: User
     splits: List[ExpenseSplit] = []
+    archived: bool = False
     
     class Config:
         from_attributes = True
@@ -91,6 +129,30 @@ class UserBalance(BaseModel):
     group_balances: List[GroupBalance]
     total_net_balance: float
 
+class GroupNetBalance(BaseModel):
+    group_id: int
+    group_name: str
+    net_balance: float
+
+class UserBalanceSummary(BaseModel):
+    user_id: int
+    user_name: str
+    group_balances: List[GroupNetBalance]
+    total_net_balance: float
+
+# Batch read schemas; ids that can't be served are reported per item
+class BatchError(BaseModel):
+    status_code: int
+    detail: str
+
+class GroupBalanceBatch(BaseModel):
+    results: Dict[int, GroupBalance]
+    errors: Dict[int, BatchError]
+
+class UserBatch(BaseModel):
+    results: Dict[int, User]
+    errors: Dict[int, BatchError]
+
 # Settlement schemas
 class SettlementCreate(BaseModel):
     payer_id: int  # Who is paying
@@ -108,6 +170,40 @@ class Settlement(BaseModel):
     settled_at: datetime
     payer: User
     payee: User
+    archived: bool = False
     
     class Config:
         from_attributes = True
+
+# Journal schemas
+class LedgerEvent(BaseModel):
+    offset: int
+    group_id: int
+    type: str
+    entity_id: Optional[int]
+    payload: dict
+    created_at: datetime
+
+# Settle-up plan schemas
+class SettlePlanMode(str, Enum):
+    GREEDY = "greedy"
+    EXACT = "exact"
+
+class Transfer(BaseModel):
+    payer_id: int
+    payer_name: str
+    payee_id: int
+    payee_name: str
+    amount: float
+
+class SettlePlan(BaseModel):
+    group_id: int
+    mode: SettlePlanMode
+    transfers: List[Transfer]
+
+# Chatbot schemas
+class ChatbotRequest(BaseModel):
+    query: str
+
+class ChatbotResponse(BaseModel):
+    response: str
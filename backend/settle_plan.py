@@ -0,0 +1,108 @@
+"""
+Debt simplification: turns net balances into a short list of transfers.
+
+Balances are handled in integer cents. Positive nets are owed money
+(creditors), negative nets owe money (debtors).
+"""
+import heapq
+
+# Exact mode is exponential in the number of members with a non-zero balance
+EXACT_MAX_MEMBERS = 12
+
+
+def normalize_nets(nets):
+    """
+    Drops settled members and absorbs any residue (the nets should sum to
+    zero) into the largest balance, so every plan fully settles.
+    Returns {user_id: cents}.
+    """
+    nets = {user_id: cents for user_id, cents in nets.items() if cents}
+    residue = sum(nets.values())
+    if residue and nets:
+        largest = max(nets, key=lambda user_id: (abs(nets[user_id]), user_id))
+        nets[largest] -= residue
+        if not nets[largest]:
+            del nets[largest]
+    return nets
+
+
+def greedy_plan(nets):
+    """
+    Repeatedly matches the largest debtor with the largest creditor.
+    Runs in O(n log n) and needs at most n - 1 transfers.
+    Returns a list of (payer_id, payee_id, cents).
+    """
+    nets = normalize_nets(nets)
+    creditors = [(-cents, user_id) for user_id, cents in nets.items() if cents > 0]
+    debtors = [(cents, user_id) for user_id, cents in nets.items() if cents < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, payee_id = heapq.heappop(creditors)
+        debt, payer_id = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((payer_id, payee_id, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, payee_id))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, payer_id))
+
+    return transfers
+
+
+def exact_plan(nets):
+    """
+    Finds a plan with the minimum number of transfers.
+
+    A group of k members whose balances sum to zero can always be settled
+    with k - 1 transfers, so the optimum splits the members into as many
+    zero-sum subsets as possible. This is found with a DP over subsets, then
+    each subset is settled with the greedy matcher.
+    """
+    nets = normalize_nets(nets)
+    if len(nets) > EXACT_MAX_MEMBERS:
+        raise ValueError(f"Exact mode supports at most {EXACT_MAX_MEMBERS} members with a non-zero balance")
+
+    user_ids = sorted(nets)
+    count = len(user_ids)
+    full = (1 << count) - 1
+
+    subset_sum = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low_bit = mask & -mask
+        subset_sum[mask] = subset_sum[mask ^ low_bit] + nets[user_ids[low_bit.bit_length() - 1]]
+
+    # best[mask] = most zero-sum subsets the members in mask can be split into
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        bits = mask
+        value = 0
+        while bits:
+            bit = bits & -bits
+            value = max(value, best[mask ^ bit])
+            bits ^= bit
+        best[mask] = value + (1 if subset_sum[mask] == 0 else 0)
+
+    # Walk back from the full set; every zero-sum mask on the way closes a subset
+    transfers = []
+    mask = full
+    current = {}
+    while mask:
+        closes = 1 if subset_sum[mask] == 0 else 0
+        bits = mask
+        while bits:
+            bit = bits & -bits
+            if best[mask ^ bit] + closes == best[mask]:
+                break
+            bits ^= bit
+        user_id = user_ids[bit.bit_length() - 1]
+        current[user_id] = nets[user_id]
+        mask ^= bit
+        if subset_sum[mask] == 0:
+            transfers.extend(greedy_plan(current))
+            current = {}
+
+    return transfers
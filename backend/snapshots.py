@@ -0,0 +1,187 @@
+"""
+Balance checkpoints for historical "balance as of" queries.
+
+take() stores the totals of every member with activity in a group up to a
+point in time in balance_snapshots, keyed by (group_id, as_of).
+totals_as_of() starts from the latest checkpoint at or before the requested
+time and adds only the expenses and settlements after it, so a historical
+balance scans the rows since the checkpoint instead of the whole history.
+Expenses are placed in time by created_at and settlements by settled_at,
+both in UTC.
+
+A write that changes a row dated at or before a checkpoint (editing or
+deleting an older expense or settlement, importing backdated expenses)
+calls invalidate() in its transaction, which drops the checkpoints it makes
+stale. New rows are dated now, and checkpoints are never taken less than
+MIN_AGE ago, so a transaction still in flight can't land before one.
+
+Live balances don't use checkpoints; they are read from the materialized
+ledger (see ledger.py).
+
+Usage (e.g. nightly from cron):
+    python snapshots.py take [--group-id ID] [--as-of 2026-10-01T00:00:00]
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.orm import Session
+import models
+import schemas
+from balance_engine import ArchivedHistory, MemberTotals, archive_cutoffs, compute_member_totals, to_balance
+from ledger import LEDGER_FIELDS
+
+MIN_AGE = timedelta(minutes=5)
+BATCH_SIZE = 500
+
+
+def to_utc(moment: datetime) -> datetime:
+    """
+    Converts an aware datetime to the naive UTC the tables store; naive
+    ones are taken to be UTC already.
+    """
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def totals_as_of(db: Session, group_ids, as_of: datetime, include_archived: bool = False):
+    """
+    Computes MemberTotals counting the expenses and settlements up to and
+    including as_of, starting from each group's latest checkpoint. Returns
+    {group_id: {user_id: MemberTotals}}.
+
+    A group with archived history starts from its opening balance instead
+    of an older checkpoint. Times before its archive cutoff raise
+    ArchivedHistory unless include_archived, which reads the archive tables.
+    """
+    group_ids = list(group_ids)
+    totals = defaultdict(lambda: defaultdict(MemberTotals))
+    if not group_ids:
+        return totals
+    cutoffs = {} if include_archived else archive_cutoffs(db, group_ids)
+    for group_id, cutoff in cutoffs.items():
+        if as_of < cutoff:
+            raise ArchivedHistory(group_id, cutoff)
+
+    snapshot = models.BalanceSnapshot
+    latest = select(snapshot.group_id, func.max(snapshot.as_of).label("as_of")).where(
+        snapshot.group_id.in_(group_ids), snapshot.as_of <= as_of
+    ).group_by(snapshot.group_id).subquery()
+    bases = {}
+    for row in db.query(snapshot).join(
+        latest, and_(snapshot.group_id == latest.c.group_id, snapshot.as_of == latest.c.as_of)
+    ).all():
+        if row.group_id in cutoffs and row.as_of < cutoffs[row.group_id]:
+            continue
+        bases[row.group_id] = row.as_of
+        member = totals[row.group_id][row.user_id]
+        for name in LEDGER_FIELDS:
+            setattr(member, name, getattr(row, name))
+
+    # Groups checkpointed at the same time share one replay
+    by_base = defaultdict(list)
+    for group_id in group_ids:
+        by_base[bases.get(group_id)].append(group_id)
+    for base, base_group_ids in by_base.items():
+        replayed = compute_member_totals(db, base_group_ids, after=base, until=as_of, include_archived=include_archived)
+        for group_id, members in replayed.items():
+            for user_id, delta in members.items():
+                member = totals[group_id][user_id]
+                for name in LEDGER_FIELDS:
+                    setattr(member, name, getattr(member, name) + getattr(delta, name))
+    return totals
+
+
+def get_group_balance_as_of(db: Session, group: models.Group, as_of: datetime,
+                            include_archived: bool = False) -> schemas.GroupBalance:
+    """
+    Builds the GroupBalance of a group as it stood at as_of, for the members
+    who had joined by then or had activity before it.
+    """
+    totals = totals_as_of(db, [group.id], as_of, include_archived)[group.id]
+    rows = db.query(models.GroupMember.user_id, models.User.name, models.GroupMember.joined_at).join(
+        models.User, models.GroupMember.user_id == models.User.id
+    ).filter(models.GroupMember.group_id == group.id).order_by(models.GroupMember.id).all()
+
+    balances = [
+        to_balance(user_id, user_name, totals.get(user_id) or MemberTotals())
+        for user_id, user_name, joined_at in rows
+        if user_id in totals or joined_at is None or joined_at <= as_of
+    ]
+    return schemas.GroupBalance(group_id=group.id, group_name=group.name, balances=balances)
+
+
+def take(db: Session, as_of: datetime, group_ids=None) -> int:
+    """
+    Stores checkpoints at as_of for the given groups (all groups by
+    default), replacing any taken at the same time. The caller commits.
+    Returns the number of rows written.
+    """
+    if as_of > datetime.utcnow() - MIN_AGE:
+        raise ValueError(f"Checkpoints must be at least {MIN_AGE} in the past")
+    if group_ids is None:
+        group_ids = [group_id for (group_id,) in db.query(models.Group.id).order_by(models.Group.id).all()]
+
+    written = 0
+    for start in range(0, len(group_ids), BATCH_SIZE):
+        batch = group_ids[start:start + BATCH_SIZE]
+        # Exact for any time, archived or not
+        totals = totals_as_of(db, batch, as_of, include_archived=True)
+        db.execute(delete(models.BalanceSnapshot).where(
+            models.BalanceSnapshot.group_id.in_(batch), models.BalanceSnapshot.as_of == as_of
+        ))
+        rows = [
+            {"group_id": group_id, "as_of": as_of, "user_id": user_id,
+             **{name: getattr(member, name) for name in LEDGER_FIELDS}}
+            for group_id in batch
+            for user_id, member in totals[group_id].items()
+        ]
+        if rows:
+            db.execute(insert(models.BalanceSnapshot), rows)
+        written += len(rows)
+    return written
+
+
+def invalidate(db: Session, group_id: int, since):
+    """
+    Drops the group's checkpoints that include rows dated since, because
+    this transaction changes one of them. since=None drops them all.
+    """
+    condition = models.BalanceSnapshot.group_id == group_id
+    if since is not None:
+        condition = and_(condition, models.BalanceSnapshot.as_of >= since)
+    db.execute(delete(models.BalanceSnapshot).where(condition))
+
+
+def main():
+    from database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Take balance checkpoints.")
+    parser.add_argument("command", choices=["take"])
+    parser.add_argument("--group-id", type=int, action="append", dest="group_ids",
+                        help="Limit to this group (may be repeated)")
+    parser.add_argument("--as-of", type=datetime.fromisoformat,
+                        help="Checkpoint time, UTC unless an offset is given (default: start of today)")
+    args = parser.parse_args()
+
+    as_of = to_utc(args.as_of) if args.as_of else (datetime.utcnow() - MIN_AGE).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        try:
+            rows = take(db, as_of, args.group_ids)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        db.commit()
+        print(f"Wrote {rows} checkpoint row(s) as of {as_of.isoformat()}")
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,44 @@
+import models
+from money import allocate
+
+
+class SplitError(ValueError):
+    """
+    Raised when the requested splits can't be applied to an expense.
+    """
+
+
+def compute_splits(amount_cents: int, split_type: models.SplitType, member_ids, splits=None):
+    """
+    Works out how an expense is divided between group members.
+
+    Equal splits divide the amount between every member in member_ids;
+    percentage splits use the given ExpenseSplitCreate entries, which must
+    sum to 100 and only name members. Cents are allocated with the largest
+    remainder method, so the parts always add up to amount_cents. Returns a
+    list of (user_id, amount_cents, percentage) tuples.
+    """
+    if split_type == models.SplitType.EQUAL:
+        member_ids = list(member_ids)
+        if not member_ids:
+            raise SplitError("Group has no members to split the expense between")
+        shares = allocate(amount_cents, [1] * len(member_ids))
+        return [(user_id, share, None) for user_id, share in zip(member_ids, shares)]
+
+    if not splits or any(split.percentage is None for split in splits):
+        raise SplitError("Percentage splits must be provided for percentage split type")
+
+    # Validate percentages sum to 100
+    total_percentage = sum(split.percentage for split in splits)
+    if abs(total_percentage - 100.0) > 0.01:  # Percentages are user input, e.g. 33.33 x 3
+        raise SplitError("Percentages must sum to 100")
+    if any(split.percentage < 0 for split in splits):
+        raise SplitError("Percentages cannot be negative")
+
+    member_ids = set(member_ids)
+    for split in splits:
+        if split.user_id not in member_ids:
+            raise SplitError(f"User {split.user_id} is not a member of this group")
+
+    shares = allocate(amount_cents, [split.percentage for split in splits])
+    return [(split.user_id, share, split.percentage) for split, share in zip(splits, shares)]
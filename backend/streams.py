@@ -0,0 +1,353 @@
+"""
+Push of group balance changes over Server-Sent Events and WebSockets.
+
+Clients subscribe to a group's channel and first receive its current
+balances, then a new copy each time a write that changes them commits, so
+open tabs don't have to poll. The ledger's on_commit hook queues the
+changed groups for a single publisher task on the event loop. For each
+group that has subscribers it loads the balances once and hands the same
+encoded message to every subscriber through the broker. A burst of writes
+to one group that arrives while the group is still queued is sent as one
+message.
+
+Every message carries a group's full balances, so only the newest one
+matters: a subscriber that falls STREAM_QUEUE_SIZE messages behind drops
+its oldest instead of growing without bound, and a WebSocket send that
+takes longer than STREAM_SEND_TIMEOUT closes the connection. Idle streams
+get a comment (SSE) or ping (WebSocket) every STREAM_HEARTBEAT seconds so
+proxies keep them open and dead clients are noticed.
+
+STREAM_BROKER selects the broker. Only "memory" is built in: fan-out within
+one process, so like the memory response cache it needs a single worker.
+Anything implementing Broker (e.g. on Redis pub/sub) can be plugged in
+with set_broker().
+"""
+import asyncio
+import json
+import logging
+import os
+from fastapi.encoders import jsonable_encoder
+import balance_engine
+import ledger
+import metrics
+import models
+from database import AsyncSessionLocal
+
+STREAM_BROKER = os.getenv("STREAM_BROKER", "memory")
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "8"))
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))
+STREAM_SEND_TIMEOUT = float(os.getenv("STREAM_SEND_TIMEOUT", "10"))
+STREAM_MAX_SUBSCRIBERS = int(os.getenv("STREAM_MAX_SUBSCRIBERS", "10000"))
+STREAM_WEBSOCKET = os.getenv("STREAM_WEBSOCKET", "false").lower() in ("1", "true", "yes")
+
+BALANCES = "balances"
+DELETED = "deleted"
+
+log = logging.getLogger("splitwise.streams")
+
+STREAM_MESSAGES = metrics.Counter(
+    "stream_messages_total", "Messages queued for stream subscribers by outcome", labelnames=("result",)
+)
+STREAM_PUBLISHES = metrics.Counter("stream_publishes_total", "Balance changes published to subscribed groups")
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Message:
+    """
+    One event for the subscribers of a group, encoded once for all of them.
+    """
+    __slots__ = ("event", "data")
+
+    def __init__(self, event: str, payload: dict):
+        self.event = event
+        self.data = json.dumps(jsonable_encoder(payload), separators=(",", ":"))
+
+    def sse(self) -> str:
+        return f"event: {self.event}\ndata: {self.data}\n\n"
+
+
+class Subscription:
+    """
+    A subscriber's bounded queue of messages.
+    """
+    __slots__ = ("channel", "queue")
+
+    def __init__(self, channel: str, max_queued: int):
+        self.channel = channel
+        self.queue = asyncio.Queue(max_queued)
+
+    def offer(self, message):
+        # Never blocks the publisher; a full queue loses its oldest message,
+        # which the newer one supersedes
+        if self.queue.full():
+            self.queue.get_nowait()
+            STREAM_MESSAGES.inc(result="dropped")
+        self.queue.put_nowait(message)
+        STREAM_MESSAGES.inc(result="queued")
+
+    async def get(self, timeout: float):
+        """
+        Waits for the next message; None means the stream is closing.
+        Raises asyncio.TimeoutError when nothing arrives in time.
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    """
+    Delivers messages published on a channel to its subscribers. Called
+    on the event loop only.
+    """
+
+    def subscribe(self, channel: str) -> Subscription:
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription: Subscription):
+        raise NotImplementedError
+
+    def publish(self, channel: str, message: Message):
+        raise NotImplementedError
+
+    def subscriber_count(self, channel: str = None) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Ends every subscription, e.g. on shutdown.
+        """
+        raise NotImplementedError
+
+
+class MemoryBroker(Broker):
+    """
+    Fan-out to the subscribers in this process.
+    """
+
+    def __init__(self, max_queued: int):
+        self.max_queued = max_queued
+        self._channels = {}
+        self._count = 0
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = Subscription(channel, self.max_queued)
+        self._channels.setdefault(channel, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._channels.get(subscription.channel)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        self._count -= 1
+        if not subscribers:
+            del self._channels[subscription.channel]
+
+    def publish(self, channel: str, message: Message):
+        for subscription in self._channels.get(channel, ()):
+            subscription.offer(message)
+
+    def subscriber_count(self, channel: str = None) -> int:
+        if channel is None:
+            return self._count
+        return len(self._channels.get(channel, ()))
+
+    def close(self):
+        for subscribers in self._channels.values():
+            for subscription in subscribers:
+                subscription.offer(None)
+
+
+def _make_broker(url: str) -> Broker:
+    if url == "memory":
+        return MemoryBroker(STREAM_QUEUE_SIZE)
+    raise ValueError(f"Unsupported STREAM_BROKER: {url}")
+
+
+broker = _make_broker(STREAM_BROKER)
+
+metrics.Gauge("stream_subscribers", "Open balance streams", callback=lambda: broker.subscriber_count())
+
+
+def set_broker(new_broker: Broker):
+    global broker
+    broker = new_broker
+
+
+def group_channel(group_id: int) -> str:
+    return f"group:{group_id}"
+
+
+def _load_message(db, group_id: int) -> Message:
+    group = db.get(models.Group, group_id)
+    if group is None:
+        return Message(DELETED, {"group_id": group_id})
+    return Message(BALANCES, balance_engine.get_group_balance(db, group))
+
+
+async def _load(group_id: int) -> Message:
+    async with AsyncSessionLocal() as db:
+        return await db.run_sync(_load_message, group_id)
+
+
+async def current(group_id: int) -> Message:
+    """
+    Returns the message describing the group's balances now. Streams that
+    open together share one load, unless a change commits while it runs.
+    """
+    if _loop is None:
+        return await _load(group_id)
+    load = _shared_loads.get(group_id)
+    if load is None:
+        load = _shared_loads[group_id] = asyncio.ensure_future(_load(group_id))
+        load.add_done_callback(lambda _: _shared_loads.pop(group_id) if _shared_loads.get(group_id) is load else None)
+    # One waiter going away must not cancel the others' load
+    return await asyncio.shield(load)
+
+
+def subscribe(group_id: int) -> Subscription:
+    if broker.subscriber_count() >= STREAM_MAX_SUBSCRIBERS:
+        raise TooManySubscribers()
+    return broker.subscribe(group_channel(group_id))
+
+
+def unsubscribe(subscription: Subscription):
+    broker.unsubscribe(subscription)
+
+
+# Publisher state, owned by the event loop
+_loop = None
+_pending = None
+_queued = set()
+_publisher = None
+_shared_loads = {}
+
+
+async def _publish_changes():
+    while True:
+        group_id = await _pending.get()
+        _queued.discard(group_id)
+        channel = group_channel(group_id)
+        if not broker.subscriber_count(channel):
+            continue
+        try:
+            message = await _load(group_id)
+        except Exception:
+            log.exception("Could not load balances of group %s for its subscribers", group_id)
+            continue
+        STREAM_PUBLISHES.inc()
+        broker.publish(channel, message)
+
+
+def _enqueue(group_ids):
+    for group_id in group_ids:
+        # Streams opening from now on must see this change
+        _shared_loads.pop(group_id, None)
+        if group_id not in _queued and broker.subscriber_count(group_channel(group_id)):
+            _queued.add(group_id)
+            _pending.put_nowait(group_id)
+
+
+@ledger.on_commit
+def _on_commit(changes):
+    # Commits happen on the event loop and in worker threads alike
+    if _loop is not None and not _loop.is_closed():
+        _loop.call_soon_threadsafe(_enqueue, list(changes))
+
+
+def start():
+    """
+    Starts the publisher on the running event loop.
+    """
+    global _loop, _pending, _publisher
+    _loop = asyncio.get_running_loop()
+    _pending = asyncio.Queue()
+    _queued.clear()
+    _publisher = _loop.create_task(_publish_changes())
+
+
+async def stop():
+    global _loop, _publisher
+    broker.close()
+    _loop = None
+    if _publisher is not None:
+        _publisher.cancel()
+        try:
+            await _publisher
+        except asyncio.CancelledError:
+            pass
+        _publisher = None
+
+
+async def sse_events(subscription: Subscription, first: Message):
+    """
+    Yields the Server-Sent Events of a subscription, starting with first.
+    """
+    try:
+        yield first.sse()
+        while True:
+            try:
+                message = await subscription.get(STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if message is None:
+                return
+            yield message.sse()
+            if message.event == DELETED:
+                return
+    finally:
+        unsubscribe(subscription)
+
+
+async def pump_websocket(websocket, subscription: Subscription, first: Message):
+    """
+    Sends a subscription's messages to an accepted WebSocket as JSON text
+    frames until either side closes.
+    """
+    async def send(text: str) -> bool:
+        try:
+            await asyncio.wait_for(websocket.send_text(text), STREAM_SEND_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            await websocket.close(code=1013)  # Try again later: the client isn't reading
+            return False
+
+    def frame(message: Message) -> str:
+        return f'{{"event":"{message.event}","data":{message.data}}}'
+
+    async def watch_client():
+        # Incoming frames are ignored; this only notices the disconnect
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(watch_client())
+    try:
+        if not await send(frame(first)):
+            return
+        while not watcher.done():
+            getter = asyncio.ensure_future(subscription.get(STREAM_HEARTBEAT))
+            await asyncio.wait({getter, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                break
+            try:
+                message = getter.result()
+            except asyncio.TimeoutError:
+                if not await send('{"event":"ping"}'):
+                    return
+                continue
+            if message is None:
+                await websocket.close()
+                return
+            if not await send(frame(message)):
+                return
+            if message.event == DELETED:
+                await websocket.close()
+                return
+    finally:
+        watcher.cancel()
+        unsubscribe(subscription)
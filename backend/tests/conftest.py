@@ -0,0 +1,65 @@
+"""
+Shared fixtures. The tests run against a throwaway SQLite database that is
+migrated once per session, with the in-process response cache, no AI
+token and the WebSocket stream route on, so nothing outside the process is
+needed.
+"""
+import itertools
+import os
+import tempfile
+
+_DB_DIR = tempfile.mkdtemp(prefix="splitwise-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["CACHE_URL"] = "memory"
+os.environ["HUGGINGFACE_API_TOKEN"] = ""
+os.environ["STREAM_WEBSOCKET"] = "true"
+
+import pytest
+from fastapi.testclient import TestClient
+import database
+import main
+
+_names = itertools.count(1)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    database.create_tables()
+
+
+@pytest.fixture(scope="session")
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def make_users(client):
+    def make(count: int):
+        ids = []
+        for _ in range(count):
+            n = next(_names)
+            response = client.post("/users/", json={"name": f"User {n}", "email": f"user{n}@example.com"})
+            assert response.status_code == 200, response.text
+            ids.append(response.json()["id"])
+        return ids
+    return make
+
+
+@pytest.fixture
+def make_group(client, make_users):
+    def make(members: int = 3, user_ids=None):
+        user_ids = user_ids or make_users(members)
+        response = client.post("/groups/", json={"name": f"Group {next(_names)}", "user_ids": user_ids})
+        assert response.status_code == 200, response.text
+        return response.json()["id"], user_ids
+    return make
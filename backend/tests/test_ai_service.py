@@ -0,0 +1,110 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import ai_service
+
+CONTEXT = "**Users (2):**\n- ID: 1, Name: A\n- ID: 2, Name: B"
+QUESTION = "Who should pay for dinner?"
+
+
+class StubLLM:
+    """
+    A local stand-in for the inference API: answers every POST with the
+    configured status and body after the configured delay.
+    """
+
+    def __init__(self):
+        self.status = 200
+        self.body = [{"generated_text": " Alice should. "}]
+        self.delay = 0.0
+        self.calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stub.calls += 1
+                self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(stub.delay)
+                body = json.dumps(stub.body).encode()
+                try:
+                    self.send_response(stub.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # The client gave up waiting
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/model"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubLLM()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def ask(stub, monkeypatch):
+    monkeypatch.setattr(ai_service, "AI_TIMEOUT", 0.5)
+    client = ai_service.AIClient(api_url=stub.url, token="test-token")
+    client.breaker = ai_service.CircuitBreaker(threshold=2, reset_timeout=60)
+
+    def run(*questions):
+        async def main():
+            try:
+                return await asyncio.gather(*(client.ask(CONTEXT, question) for question in questions))
+            finally:
+                await client.close()
+        return asyncio.run(main())
+
+    run.client = client
+    return run
+
+
+def test_answer_comes_from_upstream_and_is_cached(stub, ask):
+    assert ask(QUESTION) == ["Alice should."]
+    assert ask("who should pay for   DINNER") == ["Alice should."]
+    assert stub.calls == 1
+
+
+def test_identical_concurrent_questions_share_one_call(stub, ask):
+    stub.delay = 0.2
+    assert ask(QUESTION, QUESTION, QUESTION) == ["Alice should."] * 3
+    assert stub.calls == 1
+
+
+def test_timeout_falls_back_and_counts_against_the_breaker(stub, ask):
+    stub.delay = 1.0
+    assert ask(QUESTION) == [ai_service.get_fallback_response(CONTEXT, QUESTION)]
+    assert ask.client.breaker.failures == 1
+
+
+def test_upstream_errors_fall_back(stub, ask):
+    stub.status, stub.body = 500, {"error": "boom"}
+    assert ask(QUESTION) == [ai_service.get_fallback_response(CONTEXT, QUESTION)]
+    stub.status = 503
+    assert ask("Is the model up?") == [ai_service.MODEL_LOADING_MESSAGE]
+
+
+def test_open_circuit_stops_calling_upstream(stub, ask):
+    stub.status, stub.body = 500, {"error": "boom"}
+    ask("first question about money", "second question about money")
+    assert ask.client.breaker.is_open
+    assert ask("third question about money") == [
+        ai_service.get_fallback_response(CONTEXT, "third question about money")
+    ]
+    assert stub.calls == 2
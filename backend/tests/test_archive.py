@@ -0,0 +1,62 @@
+import json
+import ledger
+
+
+def _archived_group(client, make_group):
+    # One imported expense in January, settled up today, then the whole
+    # group archived
+    group_id, (alice, bob) = make_group(2)
+    row = {"description": "Hotel", "amount": 100, "paid_by": alice, "split_type": "equal",
+           "created_at": "2026-01-10T00:00:00Z"}
+    response = client.post(
+        f"/groups/{group_id}/expenses/bulk", content=json.dumps(row), headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200, response.text
+    response = client.post(f"/groups/{group_id}/settlements/", json={"payer_id": bob, "payee_id": alice, "amount": 50})
+    assert response.status_code == 200, response.text
+
+    response = client.post(f"/groups/{group_id}/archive")
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert (report["expenses_archived"], report["settlements_archived"]) == (1, 1)
+    return group_id, alice, bob
+
+
+def test_archived_rows_are_listed_only_when_asked_for(client, make_group):
+    group_id, alice, bob = _archived_group(client, make_group)
+
+    assert client.get(f"/groups/{group_id}/expenses/").json() == []
+    assert client.get(f"/groups/{group_id}/settlements/").json() == []
+    expenses = client.get(f"/groups/{group_id}/expenses/", params={"include_archived": True}).json()
+    assert [(expense["description"], expense["archived"]) for expense in expenses] == [("Hotel", True)]
+    settlements = client.get(f"/groups/{group_id}/settlements/", params={"include_archived": True}).json()
+    assert [(settlement["payer_id"], settlement["archived"]) for settlement in settlements] == [(bob, True)]
+
+
+def test_balances_before_the_cutoff_need_include_archived(client, make_group):
+    group_id, alice, bob = _archived_group(client, make_group)
+
+    balances = client.get(f"/groups/{group_id}/balances").json()["balances"]
+    assert all(balance["net_balance"] == 0 for balance in balances)
+    assert client.get(f"/groups/{group_id}/balances", params={"as_of": "2026-01-11T00:00:00Z"}).status_code == 400
+    response = client.get(
+        f"/groups/{group_id}/balances", params={"as_of": "2026-01-11T00:00:00Z", "include_archived": True}
+    )
+    assert response.status_code == 200, response.text
+    net = {balance["user_id"]: balance["net_balance"] for balance in response.json()["balances"]}
+    assert net == {alice: 50, bob: -50}
+
+
+def test_ledger_verifies_after_archiving(client, make_group, db):
+    group_id, alice, bob = _archived_group(client, make_group)
+
+    assert ledger.verify(db, [group_id]) == []
+
+
+def test_group_with_archived_history_is_not_deleted(client, make_group):
+    group_id, alice, bob = _archived_group(client, make_group)
+
+    response = client.delete(f"/groups/{group_id}")
+    assert response.status_code == 400
+    assert "archived history" in response.json()["detail"]
+    assert client.get(f"/groups/{group_id}").status_code == 200
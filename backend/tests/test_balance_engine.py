@@ -0,0 +1,58 @@
+import random
+import balance_engine
+import models
+from money import from_cents
+
+
+def reference_balances(db, group_id):
+    # The per-member loop the grouped aggregates replaced, in cents
+    balances = {}
+    for member in db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).all():
+        user_id = member.user_id
+        expenses = db.query(models.Expense).filter(models.Expense.group_id == group_id).all()
+        settlements = db.query(models.Settlement).filter(models.Settlement.group_id == group_id).all()
+        owes = sum(split.amount_cents for expense in expenses for split in expense.splits if split.user_id == user_id)
+        paid = sum(expense.amount_cents for expense in expenses if expense.paid_by == user_id)
+        own_share = sum(split.amount_cents for expense in expenses if expense.paid_by == user_id
+                        for split in expense.splits if split.user_id == user_id)
+        made = sum(s.amount_cents for s in settlements if s.payer_id == user_id)
+        received = sum(s.amount_cents for s in settlements if s.payee_id == user_id)
+        adjusted_owes = (owes - own_share) - made
+        adjusted_owed = (paid - own_share) - received
+        balances[user_id] = {
+            "owes": from_cents(max(0, adjusted_owes)),
+            "owed": from_cents(max(0, adjusted_owed)),
+            "net_balance": from_cents(adjusted_owed - adjusted_owes),
+        }
+    return balances
+
+
+def test_aggregates_match_per_member_loop(client, db, make_group):
+    rnd = random.Random(1)
+    group_id, user_ids = make_group(6)
+    for i in range(40):
+        payer = rnd.choice(user_ids)
+        body = {"description": f"e{i}", "amount": round(rnd.uniform(1, 300), 2), "paid_by": payer}
+        if rnd.random() < 0.5:
+            body["split_type"] = "equal"
+        else:
+            shares = rnd.sample(user_ids, 3)
+            body["split_type"] = "percentage"
+            body["splits"] = [{"user_id": u, "percentage": p} for u, p in zip(shares, (33.3, 33.3, 33.4))]
+        response = client.post(f"/groups/{group_id}/expenses/", json=body)
+        assert response.status_code == 200, response.text
+    for _ in range(8):
+        payer, payee = rnd.sample(user_ids, 2)
+        response = client.post(f"/groups/{group_id}/settlements/", json={
+            "payer_id": payer, "payee_id": payee, "amount": round(rnd.uniform(1, 80), 2)
+        })
+        assert response.status_code == 200, response.text
+
+    expected = reference_balances(db, group_id)
+    totals = balance_engine.compute_member_totals(db, [group_id])[group_id]
+    for user_id in user_ids:
+        balance = balance_engine.to_balance(user_id, "", totals[user_id])
+        assert {"owes": balance.owes, "owed": balance.owed, "net_balance": balance.net_balance} == expected[user_id]
+
+    served = client.get(f"/groups/{group_id}/balances").json()["balances"]
+    assert {b["user_id"]: {k: b[k] for k in ("owes", "owed", "net_balance")} for b in served} == expected
@@ -0,0 +1,57 @@
+def nets(group_balance) -> dict:
+    return {balance["user_id"]: balance["net_balance"] for balance in group_balance["balances"]}
+
+
+def test_balances_batch_reports_missing_groups_under_errors(client, make_group):
+    first, (alice, bob) = make_group(2)
+    second, _ = make_group(2)
+    missing = 10_000_000
+
+    # Comma-separated and repeated ids can be mixed
+    response = client.get("/balances", params=[("group_ids", f"{first},{missing}"), ("group_ids", str(second))])
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert sorted(body["results"]) == sorted([str(first), str(second)])
+    assert body["errors"] == {str(missing): {"status_code": 404, "detail": "Group not found"}}
+    assert nets(body["results"][str(first)]) == {alice: 0, bob: 0}
+
+
+def test_users_batch_reports_missing_users_under_errors(client, make_users):
+    alice, bob = make_users(2)
+    body = client.get("/users/batch", params={"ids": f"{bob},{alice},{bob},10000000"}).json()
+    assert list(body["results"]) == [str(bob), str(alice)]
+    assert body["results"][str(alice)]["id"] == alice
+    assert body["errors"] == {"10000000": {"status_code": 404, "detail": "User not found"}}
+
+
+def test_bad_batches_are_refused(client):
+    too_many = ",".join(str(i) for i in range(1, 102))
+    for url, name in (("/balances", "group_ids"), ("/users/batch", "ids")):
+        assert client.get(url, params={name: too_many}).status_code == 400
+        assert client.get(url, params={name: "1,two"}).json()["detail"] == "Invalid id: two"
+        assert client.get(url).status_code == 400
+
+
+def test_balances_batch_is_invalidated_by_its_groups_only(client, make_group):
+    first, (alice, bob) = make_group(2)
+    second, (carol, dave) = make_group(2)
+    other, (erin, _) = make_group(2)
+    params = {"group_ids": f"{first},{second}"}
+    assert client.get("/balances", params=params).headers["X-Cache"] == "MISS"
+    assert client.get("/balances", params=params).headers["X-Cache"] == "HIT"
+
+    # A group outside the batch leaves it cached
+    response = client.post(f"/groups/{other}/expenses/", json={
+        "description": "Lunch", "amount": 10, "paid_by": erin, "split_type": "equal",
+    })
+    assert response.status_code == 200, response.text
+    assert client.get("/balances", params=params).headers["X-Cache"] == "HIT"
+
+    response = client.post(f"/groups/{second}/expenses/", json={
+        "description": "Taxi", "amount": 10, "paid_by": carol, "split_type": "equal",
+    })
+    assert response.status_code == 200, response.text
+    again = client.get("/balances", params=params)
+    assert again.headers["X-Cache"] == "MISS"
+    assert nets(again.json()["results"][str(second)]) == {carol: 5, dave: -5}
+    assert nets(again.json()["results"][str(first)]) == {alice: 0, bob: 0}
@@ -0,0 +1,49 @@
+import json
+
+
+def test_imported_timestamps_are_stored_in_utc(client, make_group):
+    group_id, (alice, bob) = make_group(2)
+    rows = [{"description": "Hotel", "amount": 100, "paid_by": alice, "split_type": "equal",
+             "created_at": "2026-01-15T00:00:00+02:00"}]
+    response = client.post(
+        f"/groups/{group_id}/expenses/bulk", content="\n".join(json.dumps(row) for row in rows),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["imported"] == 1
+
+    expense = client.get(f"/groups/{group_id}/expenses/").json()[0]
+    assert expense["created_at"].startswith("2026-01-14T22:00:00")
+
+    def net(as_of):
+        balances = client.get(f"/groups/{group_id}/balances", params={"as_of": as_of}).json()["balances"]
+        return {balance["user_id"]: balance["net_balance"] for balance in balances}
+
+    assert net("2026-01-14T21:59:00Z").get(alice, 0) == 0
+    assert net("2026-01-14T23:00:00Z") == {alice: 50, bob: -50}
+
+
+def test_imported_expenses_page_by_keyset_with_tied_timestamps(client, make_group):
+    group_id, (alice, bob) = make_group(2)
+    # Rows of one import share their timestamps, so most of the order rests on the id
+    rows = [{"description": f"Row {i}", "amount": 10 + i, "paid_by": alice, "split_type": "equal",
+             "created_at": "2026-02-01T12:00:00Z" if i < 5 else "2026-02-02T12:00:00Z"} for i in range(7)]
+    response = client.post(
+        f"/groups/{group_id}/expenses/bulk", content="\n".join(json.dumps(row) for row in rows),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.json()["imported"] == 7
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/groups/{group_id}/expenses/", params=params)
+        assert response.status_code == 200, response.text
+        pages.append([expense["description"] for expense in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    # Newest first, and by id descending within a timestamp
+    assert sum(pages, []) == ["Row 6", "Row 5", "Row 4", "Row 3", "Row 2", "Row 1", "Row 0"]
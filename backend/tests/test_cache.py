@@ -0,0 +1,71 @@
+import asyncio
+import cache
+
+
+def test_user_balances_follow_other_members_expenses(client, make_group):
+    group_id, (alice, bob, carol) = make_group(3)
+    first = client.get(f"/users/{alice}/balances")
+    assert first.headers["X-Cache"] == "MISS"
+    assert client.get(f"/users/{alice}/balances").headers["X-Cache"] == "HIT"
+
+    # Alice takes no part in this expense, but her response lists Bob and Carol
+    response = client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Taxi", "amount": 20, "paid_by": bob, "split_type": "percentage",
+        "splits": [{"user_id": bob, "percentage": 50}, {"user_id": carol, "percentage": 50}],
+    })
+    assert response.status_code == 200, response.text
+
+    second = client.get(f"/users/{alice}/balances")
+    assert second.headers["X-Cache"] == "MISS"
+    balances = {b["user_id"]: b["net_balance"] for b in second.json()["group_balances"][0]["balances"]}
+    assert balances == {alice: 0, bob: 10, carol: -10}
+
+
+def test_etag_revalidation(client, make_group):
+    group_id, _ = make_group(2)
+    etag = client.get(f"/groups/{group_id}/balances").headers["ETag"]
+    assert client.get(f"/groups/{group_id}/balances", headers={"If-None-Match": etag}).status_code == 304
+
+
+class FakeNetworkBackend(cache.MemoryBackend):
+    """
+    Counters in memory, but blocking like Redis; records whether each bump
+    ran on a thread with a running event loop.
+    """
+    blocking = True
+
+    def __init__(self):
+        super().__init__(100, 60)
+        self.bumps = []
+
+    def bump(self, scopes):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop = True
+        except RuntimeError:
+            on_event_loop = False
+        self.bumps.append((set(scopes), on_event_loop))
+        super().bump(scopes)
+
+
+def test_network_backend_is_bumped_off_the_event_loop(client, make_group, monkeypatch):
+    group_id, (alice, bob) = make_group(2)
+    backend = FakeNetworkBackend()
+    monkeypatch.setattr(cache, "backend", backend)
+    assert client.get(f"/groups/{group_id}/balances").headers["X-Cache"] == "MISS"
+
+    # An async endpoint, which commits on the event loop
+    response = client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Dinner", "amount": 30, "paid_by": alice, "split_type": "equal",
+    })
+    assert response.status_code == 200, response.text
+    # A sync endpoint, which commits in a worker thread
+    assert client.post("/groups/", json={"name": "Another", "user_ids": [alice]}).status_code == 200
+
+    assert any(cache.group_scope(group_id) in scopes for scopes, _ in backend.bumps)
+    assert any(cache.LISTING in scopes for scopes, _ in backend.bumps)
+    assert not any(on_event_loop for _, on_event_loop in backend.bumps)
+    # The bump is done before the write's response, so the next read misses
+    second = client.get(f"/groups/{group_id}/balances")
+    assert second.headers["X-Cache"] == "MISS"
+    assert {b["user_id"]: b["net_balance"] for b in second.json()["balances"]} == {alice: 15, bob: -15}
@@ -0,0 +1,12 @@
+import chat_context
+from ai_service import Intent
+
+
+def test_group_names_match_questions_literally(client, db, make_users):
+    user_ids = make_users(2)
+    for name in ("100x_club", "100%_club"):
+        assert client.post("/groups/", json={"name": name, "user_ids": user_ids}).status_code == 200
+
+    context = chat_context.build_context(db, "What are the balances in 100x_club?", Intent.BALANCES)
+    assert "*Group: 100x_club*" in context
+    assert "*Group: 100%_club*" not in context
@@ -0,0 +1,9 @@
+def test_user_outside_a_groups_settlements_can_be_deleted(client, make_group):
+    group_id, (alice, bob, carol) = make_group(3)
+    response = client.post(f"/groups/{group_id}/settlements/", json={"payer_id": bob, "payee_id": carol, "amount": 5})
+    assert response.status_code == 200, response.text
+
+    assert client.delete(f"/users/{bob}").status_code == 400
+    assert client.delete(f"/users/{alice}").status_code == 200
+    members = client.get(f"/groups/{group_id}").json()["members"]
+    assert sorted(member["id"] for member in members) == [bob, carol]
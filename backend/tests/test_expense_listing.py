@@ -0,0 +1,63 @@
+def add_expense(client, group_id, description, amount, paid_by, participants=None):
+    body = {"description": description, "amount": amount, "paid_by": paid_by, "split_type": "equal"}
+    if participants:
+        # Equal splits always cover the whole group
+        body["split_type"] = "percentage"
+        body["splits"] = [{"user_id": user_id, "percentage": 100 / len(participants)} for user_id in participants]
+    response = client.post(f"/groups/{group_id}/expenses/", json=body)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def walk(client, group_id, **params):
+    pages, cursor = [], None
+    while True:
+        response = client.get(f"/groups/{group_id}/expenses/", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        pages.append([expense["id"] for expense in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_the_listing_once_newest_first(client, make_group):
+    group_id, (alice, bob, carol) = make_group(3)
+    ids = [add_expense(client, group_id, f"Expense {i}", 10 + i, alice) for i in range(7)]
+
+    pages = walk(client, group_id, limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == ids[::-1]
+    assert [e["id"] for e in client.get(f"/groups/{group_id}/expenses/").json()] == ids[::-1]
+
+
+def test_new_expenses_dont_shift_later_pages(client, make_group):
+    group_id, (alice, bob) = make_group(2)
+    ids = [add_expense(client, group_id, f"Expense {i}", 10, alice) for i in range(4)]
+
+    first = client.get(f"/groups/{group_id}/expenses/", params={"limit": 2})
+    add_expense(client, group_id, "Late", 10, bob)
+    second = client.get(
+        f"/groups/{group_id}/expenses/", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]}
+    )
+    assert [e["id"] for e in first.json()] + [e["id"] for e in second.json()] == ids[::-1]
+    assert "X-Next-Cursor" not in second.headers
+
+
+def test_filters_apply_across_pages(client, make_group):
+    group_id, (alice, bob, carol) = make_group(3)
+    cheap = add_expense(client, group_id, "Coffee", 5, alice, [alice, bob])
+    taxi = add_expense(client, group_id, "Taxi", 30, bob, [bob, carol])
+    hotel = add_expense(client, group_id, "Hotel", 300, alice)
+    dinner = add_expense(client, group_id, "Dinner", 60, alice, [alice, carol])
+
+    assert sum(walk(client, group_id, limit=1, paid_by=alice), []) == [dinner, hotel, cheap]
+    assert sum(walk(client, group_id, limit=1, participant_id=carol), []) == [dinner, hotel, taxi]
+    assert sum(walk(client, group_id, limit=2, min_amount=30, max_amount=100), []) == [dinner, taxi]
+    assert sum(walk(client, group_id, limit=2, paid_by=alice, participant_id=bob), []) == [hotel, cheap]
+
+
+def test_bad_cursor_is_refused(client, make_group):
+    group_id, _ = make_group(2)
+    response = client.get(f"/groups/{group_id}/expenses/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
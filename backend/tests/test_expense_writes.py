@@ -0,0 +1,73 @@
+import ledger
+
+
+def create_percentage_expense(client, group_id, user_ids, percentages, amount=90):
+    return client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Rent", "amount": amount, "paid_by": user_ids[0], "split_type": "percentage",
+        "splits": [{"user_id": u, "percentage": p} for u, p in zip(user_ids, percentages)],
+    })
+
+
+def test_update_validates_splits_like_create(client, make_group):
+    group_id, user_ids = make_group(3)
+    bad = [-10, 60, 50]
+    assert create_percentage_expense(client, group_id, user_ids, bad).status_code == 400
+
+    expense = create_percentage_expense(client, group_id, user_ids, [20, 30, 50]).json()
+    response = client.put(f"/expenses/{expense['id']}", json={
+        "description": "Rent", "amount": 90, "paid_by": user_ids[0], "split_type": "percentage",
+        "splits": [{"user_id": u, "percentage": p} for u, p in zip(user_ids, bad)],
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Percentages cannot be negative"
+
+
+def test_update_splits_equally_between_listed_users(client, make_group):
+    group_id, user_ids = make_group(3)
+    expense = create_percentage_expense(client, group_id, user_ids, [20, 30, 50], amount=10).json()
+    response = client.put(f"/expenses/{expense['id']}", json={
+        "description": "Rent", "amount": 10, "paid_by": user_ids[0], "split_type": "equal",
+        "splits": [{"user_id": user_ids[0]}, {"user_id": user_ids[1]}],
+    })
+    assert response.status_code == 200, response.text
+    assert sorted((s["user_id"], s["amount"]) for s in response.json()["splits"]) == [
+        (user_ids[0], 5.0), (user_ids[1], 5.0)
+    ]
+
+
+def test_amount_only_update_rescales_splits(client, db, make_group):
+    group_id, user_ids = make_group(3)
+    equal = client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Dinner", "amount": 30, "paid_by": user_ids[0], "split_type": "equal"
+    }).json()
+    percentage = create_percentage_expense(client, group_id, user_ids, [20, 30, 50]).json()
+
+    for expense, amount in ((equal, 10), (percentage, 10.01)):
+        response = client.put(f"/expenses/{expense['id']}", json={
+            "description": expense["description"], "amount": amount, "paid_by": user_ids[0],
+            "split_type": expense["split_type"],
+        })
+        assert response.status_code == 200, response.text
+        splits = response.json()["splits"]
+        assert round(sum(split["amount"] for split in splits), 2) == amount
+        assert len(splits) == 3
+    assert [s["amount"] for s in sorted(response.json()["splits"], key=lambda s: s["user_id"])] == [2.0, 3.0, 5.01]
+    assert ledger.verify(db, [group_id]) == []
+
+
+def test_equal_splits_are_stored_the_same_on_create_and_update(client, make_group):
+    group_id, user_ids = make_group(3)
+    created = client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Dinner", "amount": 10, "paid_by": user_ids[0], "split_type": "equal",
+    }).json()
+
+    expense = create_percentage_expense(client, group_id, user_ids, [20, 30, 50], amount=10).json()
+    for splits in (None, [{"user_id": user_id} for user_id in user_ids]):
+        response = client.put(f"/expenses/{expense['id']}", json={
+            "description": "Dinner", "amount": 10, "paid_by": user_ids[0], "split_type": "equal", "splits": splits,
+        })
+        assert response.status_code == 200, response.text
+
+        def stored(e):
+            return sorted((split["user_id"], split["amount"], split["percentage"]) for split in e["splits"])
+        assert stored(response.json()) == stored(created)
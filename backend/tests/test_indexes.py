@@ -0,0 +1,26 @@
+import pytest
+import check_indexes
+import database
+
+CHECK_NAMES = [name for name, _, _ in check_indexes.checks(0, 0, [0])]
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    # The synthetic dataset lives in a transaction that is rolled back
+    with database.engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            check_indexes.seed(connection, groups=20)
+            target = check_indexes.pick_target(connection, check_indexes.SEED_BASE_ID)
+            yield connection, {name: (statement, indexes) for name, statement, indexes in check_indexes.checks(*target)}
+        finally:
+            transaction.rollback()
+
+
+@pytest.mark.parametrize("name", CHECK_NAMES)
+def test_hot_query_uses_its_index(seeded, name):
+    connection, checks = seeded
+    statement, indexes = checks[name]
+    plan = check_indexes.explain(connection, statement)
+    assert any(index in plan for index in indexes), plan
@@ -0,0 +1,81 @@
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+import membership
+
+
+def warm(db, group_id):
+    # This worker caches the member list...
+    assert membership.member_ids(db, group_id) is not None
+    db.rollback()
+
+
+def elsewhere(db, statement, **params):
+    # ...and another worker changes the group without telling it
+    db.execute(text(statement), params)
+    db.commit()
+
+
+def expense(client, group_id, paid_by, **extra):
+    return client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Lunch", "amount": 12, "paid_by": paid_by, "split_type": "equal", **extra
+    })
+
+
+def test_write_to_group_deleted_by_another_worker(client, db, make_group):
+    group_id, user_ids = make_group(2)
+    warm(db, group_id)
+    elsewhere(db, "DELETE FROM groups WHERE id = :id", id=group_id)
+    response = expense(client, group_id, user_ids[0])
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Group not found"
+
+
+def test_write_to_group_archived_by_another_worker(client, db, make_group):
+    group_id, user_ids = make_group(2)
+    warm(db, group_id)
+    elsewhere(db, "UPDATE groups SET archived_at = CURRENT_TIMESTAMP WHERE id = :id", id=group_id)
+    response = client.post(f"/groups/{group_id}/settlements/", json={
+        "payer_id": user_ids[0], "payee_id": user_ids[1], "amount": 5
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Group is archived"
+
+
+def test_write_naming_user_deleted_by_another_worker(client, db, make_group):
+    group_id, (alice, bob, carol) = make_group(3)
+    warm(db, group_id)
+    elsewhere(db, "DELETE FROM users WHERE id = :id", id=carol)
+
+    response = expense(client, group_id, carol)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "User not found"
+    response = client.post(f"/groups/{group_id}/settlements/", json={"payer_id": alice, "payee_id": carol, "amount": 5})
+    assert response.status_code == 404
+
+    # The stale list was dropped, so the remaining members can carry on
+    response = expense(client, group_id, alice)
+    assert response.status_code == 200, response.text
+    assert {split["user_id"] for split in response.json()["splits"]} == {alice, bob}
+
+
+def test_percentage_split_loads_members_once(client, make_group, make_users):
+    def membership_queries(size):
+        group_id, user_ids = make_group(user_ids=make_users(size))
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if "group_members" in statement:
+                statements.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", record)
+        try:
+            response = client.post(f"/groups/{group_id}/expenses/", json={
+                "description": "Party", "amount": 500, "paid_by": user_ids[0], "split_type": "percentage",
+                "splits": [{"user_id": user_id, "percentage": 100 / size} for user_id in user_ids],
+            })
+        finally:
+            event.remove(Engine, "before_cursor_execute", record)
+        assert response.status_code == 200, response.text
+        return len(statements)
+
+    assert membership_queries(50) == membership_queries(2) == 1
@@ -0,0 +1,59 @@
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+import database
+import ledger
+import models
+
+# The money tables as Base.metadata.create_all made them with float amounts
+LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, email VARCHAR NOT NULL, created_at DATETIME)",
+    "CREATE TABLE groups (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, description TEXT, created_at DATETIME)",
+    "CREATE TABLE group_members (id INTEGER PRIMARY KEY, group_id INTEGER NOT NULL REFERENCES groups (id), "
+    "user_id INTEGER NOT NULL REFERENCES users (id), joined_at DATETIME)",
+    "CREATE TABLE expenses (id INTEGER PRIMARY KEY, description VARCHAR NOT NULL, amount FLOAT NOT NULL, "
+    "group_id INTEGER NOT NULL REFERENCES groups (id), paid_by INTEGER NOT NULL REFERENCES users (id), "
+    "split_type VARCHAR(10) NOT NULL, created_at DATETIME)",
+    "CREATE TABLE expense_splits (id INTEGER PRIMARY KEY, expense_id INTEGER NOT NULL REFERENCES expenses (id), "
+    "user_id INTEGER NOT NULL REFERENCES users (id), amount FLOAT NOT NULL, percentage FLOAT)",
+    "CREATE TABLE settlements (id INTEGER PRIMARY KEY, group_id INTEGER NOT NULL REFERENCES groups (id), "
+    "payer_id INTEGER NOT NULL REFERENCES users (id), payee_id INTEGER NOT NULL REFERENCES users (id), "
+    "amount FLOAT NOT NULL, description VARCHAR, settled_at DATETIME)",
+]
+
+LEGACY_ROWS = [
+    "INSERT INTO users VALUES (1, 'A', 'a@example.com', '2025-01-01'), (2, 'B', 'b@example.com', '2025-01-01'), "
+    "(3, 'C', 'c@example.com', '2025-01-01')",
+    "INSERT INTO groups VALUES (1, 'Trip', NULL, '2025-01-01')",
+    "INSERT INTO group_members VALUES (1, 1, 1, NULL), (2, 1, 2, NULL), (3, 1, 3, NULL)",
+    # Equal thirds of 10.00 stored as 3.33 each, a cent short of the total
+    "INSERT INTO expenses VALUES (1, 'Dinner', 10.0, 1, 1, 'EQUAL', '2025-01-02'), "
+    "(2, 'Taxi', 20.0, 1, 2, 'PERCENTAGE', '2025-01-03')",
+    "INSERT INTO expense_splits VALUES (1, 1, 1, 3.33, NULL), (2, 1, 2, 3.33, NULL), (3, 1, 3, 3.33, NULL), "
+    "(4, 2, 1, 6.666, 33.33), (5, 2, 2, 6.666, 33.33), (6, 2, 3, 6.668, 33.34)",
+    "INSERT INTO settlements VALUES (1, 1, 2, 1, 1.5, NULL, '2025-01-04')",
+]
+
+
+def test_float_database_converts_to_a_consistent_ledger(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    event.listen(engine, "connect", database._enable_foreign_keys)
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA + LEGACY_ROWS:
+            connection.execute(text(statement))
+
+    # The same upgrade the backend runs on startup
+    monkeypatch.setattr(database, "engine", engine)
+    try:
+        database.create_tables()
+
+        db = sessionmaker(bind=engine)()
+        try:
+            for expense in db.query(models.Expense).all():
+                assert sum(split.amount_cents for split in expense.splits) == expense.amount_cents
+            assert db.get(models.Expense, 1).amount_cents == 1000
+            assert db.get(models.Settlement, 1).amount_cents == 150
+            assert ledger.verify(db) == []
+        finally:
+            db.close()
+    finally:
+        engine.dispose()
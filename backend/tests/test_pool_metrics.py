@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+import database
+
+
+def checkout_count() -> int:
+    prefix = 'db_pool_checkout_seconds_count{engine="sync"} '
+    lines = [line for line in database.POOL_CHECKOUT_SECONDS.render() if line.startswith(prefix)]
+    return int(lines[0][len(prefix):]) if lines else 0
+
+
+def test_checkouts_and_timeouts_are_recorded(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}", poolclass=database.InstrumentedQueuePool,
+        pool_size=1, max_overflow=0, pool_timeout=0.05,
+    )
+    checkouts, timeouts = checkout_count(), database.POOL_TIMEOUTS.value(engine="sync")
+    try:
+        with engine.connect():
+            with pytest.raises(PoolTimeoutError):
+                engine.connect()
+    finally:
+        engine.dispose()
+
+    assert checkout_count() == checkouts + 2
+    assert database.POOL_TIMEOUTS.value(engine="sync") == timeouts + 1
@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta
+import pytest
+import balance_engine
+import ledger
+import models
+import projections
+
+
+def expense(client, group_id, paid_by, amount, **fields):
+    response = client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "e", "amount": amount, "paid_by": paid_by, "split_type": "equal", **fields
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def settle(client, group_id, payer_id, payee_id, amount):
+    response = client.post(f"/groups/{group_id}/settlements/", json={
+        "payer_id": payer_id, "payee_id": payee_id, "amount": amount
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def projected(db, group_ids):
+    rows = db.query(models.ProjectedBalance).filter(models.ProjectedBalance.group_id.in_(group_ids)).all()
+    return {
+        (row.group_id, row.user_id): tuple(getattr(row, name) for name in ledger.LEDGER_FIELDS)
+        for row in rows
+    }
+
+
+def assert_matches_ledger(db, group_ids):
+    db.expire_all()
+    groups = db.query(models.Group).filter(models.Group.id.in_(group_ids)).all()
+    for group_id, group_balance in balance_engine.get_group_balances(db, groups).items():
+        rows = {
+            row.user_id: row
+            for row in db.query(models.ProjectedBalance).filter(models.ProjectedBalance.group_id == group_id)
+        }
+        for balance in group_balance.balances:
+            row = rows.get(balance.user_id) or balance_engine.MemberTotals()
+            assert balance_engine.to_balance(balance.user_id, balance.user_name, row) == balance
+
+
+class CrashingProjection(projections.BalanceProjection):
+    # Dies on its second batch, like a runner killed mid-replay
+    def __init__(self):
+        self.batches = 0
+
+    def apply(self, db, events):
+        self.batches += 1
+        if self.batches == 2:
+            raise RuntimeError("runner killed")
+        super().apply(db, events)
+
+
+@pytest.fixture
+def history(client, make_group):
+    """
+    A write of every kind the journal records, in four groups; the last
+    one is deleted.
+    """
+    active, (a, b, c) = make_group(3)
+    first = expense(client, active, a, 30)
+    second = expense(client, active, b, 12.5)
+    third = expense(client, active, c, 7)
+    response = client.put(f"/expenses/{first}", json={
+        "description": "e", "amount": 45, "paid_by": b, "split_type": "equal"
+    })
+    assert response.status_code == 200, response.text
+    response = client.put(f"/expenses/{second}", json={
+        "description": "e", "amount": 12.5, "paid_by": b, "split_type": "percentage",
+        "splits": [{"user_id": a, "percentage": 70}, {"user_id": c, "percentage": 30}]
+    })
+    assert response.status_code == 200, response.text
+    assert client.delete(f"/expenses/{third}").status_code == 200
+    settlement = settle(client, active, a, b, 4)
+    settle(client, active, c, b, 6.25)
+    assert client.delete(f"/settlements/{settlement}").status_code == 200
+
+    purged, (d, e) = make_group(2)
+    expense(client, purged, d, 20)
+    expense(client, purged, e, 9.99)
+    response = client.delete(f"/groups/{purged}/expenses/", params={
+        "before": (datetime.utcnow() + timedelta(minutes=1)).isoformat()
+    })
+    assert response.status_code == 200 and response.json()["deleted"] == 2, response.text
+    expense(client, purged, e, 3)
+
+    archived, (f, g) = make_group(2)
+    expense(client, archived, f, 10)
+    settle(client, archived, g, f, 5)
+    response = client.post(f"/groups/{archived}/archive")
+    assert response.status_code == 200, response.text
+
+    deleted, (h, i) = make_group(2)
+    expense(client, deleted, h, 8, description="gone")
+    assert client.delete(f"/expenses/{expense(client, deleted, i, 2)}").status_code == 200
+    settle(client, deleted, i, h, 1)
+    response = client.get(f"/groups/{deleted}/expenses/")
+    for item in response.json():
+        assert client.delete(f"/expenses/{item['id']}").status_code == 200
+    assert client.delete(f"/groups/{deleted}").status_code == 200
+
+    return [active, purged, archived], deleted
+
+
+def test_balance_projection_matches_ledger(db, history):
+    group_ids, deleted = history
+    projections.run(db, projections.PROJECTIONS["balances"])
+    assert_matches_ledger(db, group_ids)
+    assert projected(db, [deleted]) == {}
+    assert projections.verify(db) == []
+
+
+def test_resumed_runner_matches_full_replay(client, db, history, make_group):
+    group_ids, deleted = history
+    projection = projections.PROJECTIONS["balances"]
+    projections.run(db, projection)
+    # Incrementally: more writes, then the runner picks up from its checkpoint
+    later, (x, y) = make_group(2)
+    expense(client, later, x, 17)
+    settle(client, later, y, x, 2)
+    assert projections.run(db, projection) >= 3
+    group_ids = group_ids + [later, deleted]
+    incremental = projected(db, group_ids)
+
+    projections.reset(db, projection)
+    db.commit()
+    with pytest.raises(RuntimeError):
+        projections.run(db, CrashingProjection(), batch_size=5)
+    db.rollback()
+    position = db.query(models.ProjectionCheckpoint.position).filter(
+        models.ProjectionCheckpoint.name == projection.name
+    ).scalar()
+    assert position > 0
+    projections.run(db, projection, batch_size=5)
+    resumed = projected(db, group_ids)
+
+    projections.reset(db, projection)
+    db.commit()
+    projections.run(db, projection)
+    assert projected(db, group_ids) == resumed == incremental
+    assert_matches_ledger(db, group_ids)
+    assert projections.verify(db) == []
@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@contextmanager
+def statements():
+    # Every statement any engine runs meanwhile
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        yield seen
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+
+def query_count(client, url, **params):
+    with statements() as seen:
+        response = client.get(url, params=params)
+    assert response.status_code == 200, response.text
+    return len(seen)
+
+
+def add_expenses(client, group_id, user_ids, count):
+    for i in range(count):
+        response = client.post(f"/groups/{group_id}/expenses/", json={
+            "description": f"e{i}", "amount": 10 + i, "paid_by": user_ids[i % len(user_ids)], "split_type": "equal"
+        })
+        assert response.status_code == 200, response.text
+
+
+def test_group_listing_does_not_query_per_group(client, make_group):
+    make_group(2)
+    small = query_count(client, "/groups/", limit=500)
+    for _ in range(5):
+        make_group(4)
+    assert query_count(client, "/groups/", limit=500) == small
+    assert query_count(client, "/groups/", limit=500, include="none") <= small
+
+
+def test_group_details_do_not_query_per_member_or_expense(client, make_group, make_users):
+    small_id, small_users = make_group(2)
+    add_expenses(client, small_id, small_users, 1)
+    large_id, large_users = make_group(user_ids=make_users(8))
+    add_expenses(client, large_id, large_users, 10)
+    assert query_count(client, f"/groups/{large_id}") == query_count(client, f"/groups/{small_id}")
+
+
+def test_expense_listing_does_not_query_per_expense(client, make_group):
+    group_id, user_ids = make_group(4)
+    add_expenses(client, group_id, user_ids, 2)
+    small = query_count(client, f"/groups/{group_id}/expenses/")
+    add_expenses(client, group_id, user_ids, 20)
+    assert len(client.get(f"/groups/{group_id}/expenses/").json()) == 22
+    add_expenses(client, group_id, user_ids, 1)
+    assert query_count(client, f"/groups/{group_id}/expenses/") == small
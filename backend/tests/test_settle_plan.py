@@ -0,0 +1,78 @@
+import random
+import pytest
+import settle_plan
+
+
+def random_nets(rng: random.Random, members: int):
+    # Small balances, so zero-sum subsets (and shorter exact plans) are common
+    nets = {user_id: rng.randint(-6, 6) for user_id in range(1, members)}
+    nets[members] = -sum(nets.values())
+    return nets
+
+
+def remaining(nets, transfers):
+    left = dict(nets)
+    for payer_id, payee_id, cents in transfers:
+        assert cents > 0
+        left[payer_id] += cents
+        left[payee_id] -= cents
+    return left
+
+
+def partitions(items):
+    if not items:
+        yield []
+        return
+    first, rest = items[0], items[1:]
+    for partition in partitions(rest):
+        yield [[first]] + partition
+        for index in range(len(partition)):
+            yield partition[:index] + [[first] + partition[index]] + partition[index + 1:]
+
+
+def brute_force_minimum(nets) -> int:
+    # k members settle in k - 1 transfers per zero-sum block, at best
+    owing = [user_id for user_id, cents in nets.items() if cents]
+    blocks = max(
+        len(partition) for partition in partitions(owing)
+        if all(sum(nets[user_id] for user_id in block) == 0 for block in partition)
+    ) if owing else 0
+    return len(owing) - blocks
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_greedy_plan_settles_everyone(seed):
+    rng = random.Random(seed)
+    nets = random_nets(rng, rng.randint(1, 30))
+    transfers = settle_plan.greedy_plan(nets)
+
+    assert not any(remaining(nets, transfers).values())
+    assert len(transfers) <= max(0, sum(1 for cents in nets.values() if cents) - 1)
+    for payer_id, payee_id, _ in transfers:
+        assert nets[payer_id] < 0 < nets[payee_id]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_exact_plan_matches_the_brute_force_minimum(seed):
+    rng = random.Random(seed)
+    nets = random_nets(rng, rng.randint(1, 8))
+    transfers = settle_plan.exact_plan(nets)
+
+    assert not any(remaining(nets, transfers).values())
+    assert len(transfers) == brute_force_minimum(nets)
+    assert len(transfers) <= len(settle_plan.greedy_plan(nets))
+
+
+def test_applying_a_plan_twice_settles_once(client, make_group):
+    group_id, (alice, bob, carol) = make_group(3)
+    response = client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Cabin", "amount": 90, "paid_by": alice, "split_type": "equal",
+    })
+    assert response.status_code == 200, response.text
+
+    first = client.post(f"/groups/{group_id}/settle-plan/apply")
+    assert first.status_code == 200, first.text
+    assert sorted((s["payer_id"], s["amount"]) for s in first.json()) == [(bob, 30), (carol, 30)]
+    assert client.post(f"/groups/{group_id}/settle-plan/apply").json() == []
+    balances = client.get(f"/groups/{group_id}/balances").json()["balances"]
+    assert all(balance["net_balance"] == 0 for balance in balances)
@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+import main
+import streams
+
+
+@pytest.fixture(scope="module")
+def live():
+    # A client that ran startup, so the stream publisher is running
+    with TestClient(main.app) as client:
+        yield client
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def subscribers(group_id: int) -> int:
+    return streams.broker.subscriber_count(streams.group_channel(group_id))
+
+
+def nets(message) -> dict:
+    return {balance["user_id"]: balance["net_balance"] for balance in message["balances"]}
+
+
+def test_websocket_sends_balances_then_updates(live, make_group):
+    group_id, (alice, bob) = make_group(2)
+    with live.websocket_connect(f"/groups/{group_id}/ws") as websocket:
+        first = websocket.receive_json()
+        assert first["event"] == "balances"
+        assert nets(first["data"]) == {alice: 0, bob: 0}
+
+        response = live.post(f"/groups/{group_id}/expenses/", json={
+            "description": "Dinner", "amount": 40, "paid_by": alice, "split_type": "equal",
+        })
+        assert response.status_code == 200, response.text
+        update = websocket.receive_json()
+        assert update["event"] == "balances"
+        assert nets(update["data"]) == {alice: 20, bob: -20}
+        assert subscribers(group_id) == 1
+
+    # The server notices the disconnect and drops the subscription
+    wait_for(lambda: subscribers(group_id) == 0)
+
+
+def test_websocket_ends_when_the_group_is_deleted(live, make_group):
+    group_id, _ = make_group(2)
+    with live.websocket_connect(f"/groups/{group_id}/ws") as websocket:
+        assert websocket.receive_json()["event"] == "balances"
+        assert live.delete(f"/groups/{group_id}").status_code == 200
+        assert websocket.receive_json() == {"event": "deleted", "data": {"group_id": group_id}}
+    wait_for(lambda: subscribers(group_id) == 0)
+
+
+def test_sse_stream_sends_balances_updates_and_deleted(live, make_group):
+    group_id, (alice, bob) = make_group(2)
+    result = {}
+
+    def read_stream():
+        # The test client returns the body once the stream ends
+        result["response"] = live.get(f"/groups/{group_id}/stream")
+
+    reader = threading.Thread(target=read_stream)
+    reader.start()
+    wait_for(lambda: subscribers(group_id) == 1)
+
+    published = streams.STREAM_PUBLISHES.value()
+    response = live.post(f"/groups/{group_id}/settlements/", json={"payer_id": bob, "payee_id": alice, "amount": 5})
+    assert response.status_code == 200, response.text
+    wait_for(lambda: streams.STREAM_PUBLISHES.value() > published)
+    assert live.delete(f"/groups/{group_id}").status_code == 200
+    reader.join(5)
+    assert not reader.is_alive()
+
+    response = result["response"]
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    assert [event for event, _ in events] == ["balances", "balances", "deleted"]
+    assert nets(events[0][1]) == {alice: 0, bob: 0}
+    assert nets(events[1][1]) == {alice: -5, bob: 5}
+    assert subscribers(group_id) == 0
+
+
+def test_streams_over_the_cap_are_refused(live, make_group, monkeypatch):
+    group_id, _ = make_group(2)
+    monkeypatch.setattr(streams, "STREAM_MAX_SUBSCRIBERS", 0)
+
+    response = live.get(f"/groups/{group_id}/stream")
+    assert response.status_code == 503
+    with pytest.raises(WebSocketDisconnect) as refused:
+        with live.websocket_connect(f"/groups/{group_id}/ws"):
+            pass
+    assert refused.value.code == 4503
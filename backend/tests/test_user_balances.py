@@ -0,0 +1,73 @@
+from tests.test_query_counts import add_expenses, query_count
+
+
+def own_nets(full, user_id):
+    return {
+        group["group_id"]: next(
+            (balance["net_balance"] for balance in group["balances"] if balance["user_id"] == user_id), 0
+        )
+        for group in full["group_balances"]
+    }
+
+
+def test_summary_matches_full_balances(client, make_group, make_users):
+    user_id, *others = make_users(4)
+    first, first_users = make_group(user_ids=[user_id, others[0], others[1]])
+    second, second_users = make_group(user_ids=[others[2], user_id])
+    third, _ = make_group(user_ids=[user_id, others[0]])
+    add_expenses(client, first, first_users, 4)
+    add_expenses(client, second, second_users, 3)
+    response = client.post(f"/groups/{second}/settlements/", json={
+        "payer_id": user_id, "payee_id": others[2], "amount": 5.55
+    })
+    assert response.status_code == 200, response.text
+
+    full = client.get(f"/users/{user_id}/balances").json()
+    summary = client.get(f"/users/{user_id}/balances", params={"summary_only": True}).json()
+
+    assert summary["user_id"] == full["user_id"] == user_id
+    assert summary["user_name"] == full["user_name"]
+    assert [group["group_id"] for group in summary["group_balances"]] == [first, second, third]
+    assert [group["group_id"] for group in full["group_balances"]] == [first, second, third]
+    assert all(set(group) == {"group_id", "group_name", "net_balance"} for group in summary["group_balances"])
+    assert {group["group_id"]: group["net_balance"] for group in summary["group_balances"]} == own_nets(full, user_id)
+    assert summary["total_net_balance"] == full["total_net_balance"]
+    assert round(sum(own_nets(full, user_id).values()), 2) == summary["total_net_balance"]
+    assert next(group for group in summary["group_balances"] if group["group_id"] == third)["net_balance"] == 0
+
+
+def test_summary_follows_writes(client, make_group):
+    group_id, user_ids = make_group(2)
+    url = f"/users/{user_ids[0]}/balances"
+    assert client.get(url, params={"summary_only": True}).json()["total_net_balance"] == 0
+    add_expenses(client, group_id, user_ids, 1)
+    summary = client.get(url, params={"summary_only": True}).json()
+    assert summary["total_net_balance"] == 5
+    assert client.get(url).json()["total_net_balance"] == 5
+
+
+def test_user_without_groups(client, make_users):
+    (user_id,) = make_users(1)
+    for params in ({}, {"summary_only": True}):
+        body = client.get(f"/users/{user_id}/balances", params=params).json()
+        assert body["group_balances"] == []
+        assert body["total_net_balance"] == 0
+
+
+def test_unknown_user(client):
+    for params in ({}, {"summary_only": True}):
+        assert client.get("/users/999999/balances", params=params).status_code == 404
+
+
+def test_balances_do_not_query_per_group(client, make_group, make_users):
+    (user_id,) = make_users(1)
+    group_id, user_ids = make_group(user_ids=[user_id] + make_users(2))
+    add_expenses(client, group_id, user_ids, 2)
+    url = f"/users/{user_id}/balances"
+    small = query_count(client, url)
+    small_summary = query_count(client, url, summary_only=True)
+    for _ in range(5):
+        group_id, user_ids = make_group(user_ids=[user_id] + make_users(3))
+        add_expenses(client, group_id, user_ids, 3)
+    assert query_count(client, url) == small
+    assert query_count(client, url, summary_only=True) == small_summary